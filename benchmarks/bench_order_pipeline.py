@@ -0,0 +1,119 @@
+# benchmarks/bench_order_pipeline.py
+"""
+Compares order placement in sync mode (price and reserve within the request)
+with async mode (accept with 202, outbox worker prices and reserves), while
+the product service answers with an artificial latency.
+
+    python benchmarks/bench_order_pipeline.py --clients 8 --orders 400 --product-latency-ms 20
+
+For each mode it reports request throughput and latency percentiles; for
+async mode also the end-to-end throughput until the worker has drained the
+outbox.
+"""
+
+import argparse
+import datetime
+import json
+import threading
+import time
+
+import jwt
+from werkzeug.serving import make_server
+
+from common import load_service
+
+USER_ID = 1
+PRODUCT_IDS = list(range(1, 21))
+SERVICE_TOKEN = "benchmark-service-token"
+
+
+def start_product_service(latency):
+    """Serves the real product service on an ephemeral port, with `latency` seconds added per request."""
+    products = load_service("product_service", SERVICE_TOKEN=SERVICE_TOKEN)
+    with products.app.app_context():
+        for product_id in PRODUCT_IDS:
+            products.db.session.add(products.Product(id=product_id, name=f"Item {product_id}",
+                                                     price=1.0, stock=10 ** 9))
+        products.db.session.commit()
+    products.app.before_request(lambda: time.sleep(latency))
+    server = make_server("127.0.0.1", 0, products.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def run(service, mode, clients, orders, token):
+    """Places `orders` single-line orders from `clients` threads in the given mode."""
+    service.app.config["ORDER_PROCESSING_MODE"] = mode
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    per_client = orders // clients
+
+    def client(offset):
+        http = service.app.test_client()
+        local_latencies, local_statuses = [], {}
+        for i in range(per_client):
+            product_id = PRODUCT_IDS[(offset + i) % len(PRODUCT_IDS)]
+            start = time.perf_counter()
+            status = http.post("/orders", json={"product_id": product_id, "quantity": 1}, headers=headers).status_code
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    accepted = time.perf_counter() - start
+
+    drained = accepted
+    if mode == "async":
+        with service.app.app_context():
+            while any(service.process_outbox().values()):
+                pass
+        drained = time.perf_counter() - start
+
+    placed = per_client * clients
+    return {
+        "mode": mode,
+        "clients": clients,
+        "orders": placed,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "request_rps": round(placed / accepted, 1),
+        "end_to_end_rps": round(placed / drained, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--orders", type=int, default=400, help="orders placed per mode")
+    parser.add_argument("--product-latency-ms", type=float, default=20.0)
+    parser.add_argument("--batch-size", type=int, default=50, help="outbox entries per worker batch")
+    parser.add_argument("--database-url", default=None, help="order database (default: a temporary SQLite file)")
+    args = parser.parse_args()
+
+    product_url = start_product_service(args.product_latency_ms / 1000)
+    service = load_service("order_service", args.database_url, PRODUCT_SERVICE_URL=product_url,
+                           OUTBOX_BATCH_SIZE=args.batch_size, SERVICE_TOKEN=SERVICE_TOKEN)
+    token = jwt.encode({"user_id": USER_ID, "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)},
+                       service.app.config["SECRET_KEY"], algorithm="HS256")
+    results = [run(service, mode, args.clients, args.orders, token) for mode in ("sync", "async")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# benchmarks/bench_password_logins.py
+"""
+Measures user-service logins per second as the password hashing pool grows,
+with a fixed number of concurrent clients, and counts logins shed with 503.
+
+    python benchmarks/bench_password_logins.py --workers 1 2 4 --clients 16 --seconds 5
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from common import load_service
+
+EMAIL = "bench@example.com"
+PASSWORD = "benchmark-password"
+
+
+def run(service, workers, clients, seconds, queue_limit, method):
+    """Drives logins from `clients` threads for `seconds` against a pool of `workers` processes."""
+    service.password_hasher = service.PasswordHasher(method=method, workers=workers, queue_limit=queue_limit)
+    counts = {"ok": 0, "shed": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client():
+        http = service.app.test_client()
+        local = {"ok": 0, "shed": 0, "errors": 0}
+        while time.monotonic() < deadline:
+            status = http.post("/login", json={"email": EMAIL, "password": PASSWORD}).status_code
+            key = "ok" if status == 200 else "shed" if status == 503 else "errors"
+            local[key] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "hash_workers": workers,
+        "clients": clients,
+        "logins_per_second": round(counts["ok"] / elapsed, 1),
+        **counts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--queue-limit", type=int, default=32)
+    parser.add_argument("--method", default=None, help="werkzeug hash method (default: the service's)")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    service = load_service("user_service", args.database_url, PASSWORD_HASH_WORKERS=0)
+    method = args.method or service.password_hasher.method
+    service.password_hasher = service.PasswordHasher(method=method, workers=0)
+    with service.app.app_context():
+        user = service.User(email=EMAIL)
+        user.set_password(PASSWORD)
+        service.db.session.add(user)
+        service.db.session.commit()
+
+    results = [run(service, workers, args.clients, args.seconds, args.queue_limit, method)
+               for workers in sorted(set(args.workers))]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# benchmarks/bench_search.py
+"""
+Measures /products/search latency at growing catalog sizes.
+
+    python benchmarks/bench_search.py --products 100000 1000000 --queries 200
+
+Products get generated names ("Brand Adjective Noun Model") and are loaded
+with the bulk import. On SQLite this measures the in-memory index, including
+the time a full build of it takes (what the service pays at startup); pass a Postgres --database-url
+to measure the GIN-indexed query instead.
+"""
+
+import argparse
+import json
+import time
+
+from common import load_service, percentile, product_feed
+
+QUERIES = ["wireless mouse", "keyboard", "acme", "pro headset", "mon", "rugged charger", "stark cable 12",
+           "umbrela", "smart lamp", "compact dock"]
+
+
+def run(service, count, queries):
+    """Loads `count` products and times `queries` searches drawn from QUERIES."""
+    with service.app.app_context():
+        service.db.session.execute(service.db.delete(service.Product))
+        service.db.session.commit()
+        start = time.perf_counter()
+        summary = service._import_catalog(product_feed(count), "ndjson")
+        load_seconds = time.perf_counter() - start
+    service.search_index = service.InvertedIndex()
+
+    client = service.app.test_client()
+    start = time.perf_counter()
+    client.get("/products/search", query_string={"q": "warmup"})
+    first_search = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for i in range(queries):
+        start = time.perf_counter()
+        response = client.get("/products/search", query_string={"q": QUERIES[i % len(QUERIES)], "in_stock": "true"})
+        latencies.append(time.perf_counter() - start)
+        hits += response.json["total"]
+    return {
+        "products": summary["written"],
+        "load_seconds": round(load_seconds, 2),
+        "first_search_ms": round(first_search * 1000, 1),
+        "queries": queries,
+        "mean_hits": round(hits / queries, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    # Measure the search itself, not the search cache in front of it
+    service = load_service("product_service", args.database_url, SEARCH_CACHE_TTL="0", SEARCH_CACHE_STALE_TTL="0")
+    with service.app.app_context():
+        service._upgrade_schema()
+    results = [run(service, count, args.queries) for count in args.products]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# benchmarks/bench_serving.py
+"""
+Compares gunicorn worker classes on a network-bound page: the frontend's
+home page, served by a real gunicorn with shared/gunicorn_conf.py, while
+a stub product service answers each catalog call after a fixed latency.
+
+    python benchmarks/bench_serving.py --modes sync gthread gevent --clients 32 --seconds 10
+
+Each mode runs with the config's own defaults for the machine (override
+them with --workers / --threads). It reports requests per second and
+latency percentiles as JSON.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from flask import Flask, jsonify
+from werkzeug.serving import make_server
+
+from common import ROOT, percentile
+
+CATALOG = [{"id": i, "name": f"Item {i}", "price": 9.99, "stock": 10, "version": 1} for i in range(1, 25)]
+
+
+def stub_product_service(latency):
+    """Serves a fixed catalog page after `latency` seconds; uncacheable, so every page load calls it."""
+    stub = Flask("product_stub")
+
+    @stub.route("/products")
+    def products():
+        time.sleep(latency)
+        response = jsonify(CATALOG)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    server = make_server("127.0.0.1", 0, stub, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_frontend(mode, product_url, workers, threads):
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT, GUNICORN_WORKER_CLASS=mode, PRODUCT_SERVICE_URL=product_url,
+               USER_SERVICE_URL="http://127.0.0.1:9", ORDER_SERVICE_URL="http://127.0.0.1:9")
+    if workers:
+        env["WEB_CONCURRENCY"] = str(workers)
+    if threads:
+        env["GUNICORN_THREADS"] = str(threads)
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", os.path.join(ROOT, "shared", "gunicorn_conf.py"),
+         "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=os.path.join(ROOT, "frontend_service"), env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}/"
+    for _ in range(100):
+        try:
+            requests.get(url, timeout=5)
+            return process, url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    log.seek(0)
+    raise RuntimeError(f"gunicorn ({mode}) did not start: {log.read().decode()[-2000:]}")
+
+
+def drive(url, clients, seconds):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client():
+        session = requests.Session()
+        local, failed = [], 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = session.get(url, timeout=30).status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            local.append(time.perf_counter() - start)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["sync", "gthread", "gevent"])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--upstream-latency-ms", type=float, default=50)
+    parser.add_argument("--workers", type=int, help="WEB_CONCURRENCY (default: the config's CPU-based value)")
+    parser.add_argument("--threads", type=int, help="GUNICORN_THREADS for gthread")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    product_url = stub_product_service(args.upstream_latency_ms / 1000)
+    results = []
+    for mode in args.modes:
+        process, url = start_frontend(mode, product_url, args.workers, args.threads)
+        try:
+            latencies, errors, elapsed = drive(url, args.clients, args.seconds)
+        finally:
+            process.terminate()
+            process.wait()
+        results.append({
+            "mode": mode,
+            "clients": args.clients,
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# benchmarks/bench_stock_reservation.py
+"""
+Measures reservation throughput on a single hot product as the number of
+concurrent workers grows, and checks that the product is never oversold.
+
+    python benchmarks/bench_stock_reservation.py --workers 1 2 4 8 16 --requests 2000
+
+Set --database-url to a Postgres URL to measure real row-lock contention;
+the default SQLite file serializes all writers and shows the lower bound.
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from common import load_service
+
+HOT_PRODUCT_ID = 1
+SERVICE_TOKEN = "benchmark-service-token"
+
+
+def run(service, workers, total_requests, stock):
+    """Fires total_requests single-unit reservations from `workers` threads."""
+    with service.app.app_context():
+        service.db.session.execute(service.db.delete(service.Product))
+        service.db.session.execute(service.db.delete(service.StockReservation))
+        service.db.session.add(service.Product(id=HOT_PRODUCT_ID, name="Hot Item", price=1.0, stock=stock))
+        service.db.session.commit()
+
+    items = [{"product_id": HOT_PRODUCT_ID, "quantity": 1}]
+    headers = {"Authorization": f"Bearer {SERVICE_TOKEN}"}
+    counts = {"reserved": 0, "rejected": 0, "errors": 0}
+    lock = threading.Lock()
+    per_worker = total_requests // workers
+
+    def worker(n):
+        client = service.app.test_client()
+        local = {"reserved": 0, "rejected": 0, "errors": 0}
+        for i in range(per_worker):
+            payload = {"items": items, "reservation_id": f"bench-{workers}-{n}-{i}"}
+            status = client.post("/products/reserve", json=payload, headers=headers).status_code
+            if status == 200:
+                local["reserved"] += 1
+            elif status == 409:
+                local["rejected"] += 1
+            else:
+                local["errors"] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with service.app.app_context():
+        remaining = service.db.session.get(service.Product, HOT_PRODUCT_ID).stock
+    return {
+        "workers": workers,
+        "requests": per_worker * workers,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(per_worker * workers / elapsed, 1),
+        **counts,
+        "remaining_stock": remaining,
+        "oversold": remaining < 0 or counts["reserved"] != stock - remaining,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=2000, help="reservations attempted per run")
+    parser.add_argument("--stock", type=int, default=None,
+                        help="starting stock (default: 3/4 of --requests, so some attempts must be rejected)")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    service = load_service("product_service", args.database_url, SERVICE_TOKEN=SERVICE_TOKEN)
+    stock = args.stock if args.stock is not None else args.requests * 3 // 4
+    results = [run(service, workers, args.requests, stock) for workers in args.workers]
+    print(json.dumps(results, indent=2))
+    if any(result["oversold"] for result in results):
+        raise SystemExit("Stock was oversold")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# benchmarks/bench_suite.py
+"""
+End-to-end regression benchmark: boots the user, product and order services
+in-process (the order service talks to an in-memory stub of the product
+service over HTTP), seeds them, and drives each scenario at a fixed
+concurrency.
+
+    python benchmarks/bench_suite.py --concurrency 8 --requests 400
+    python benchmarks/bench_suite.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json --tolerance 0.3
+
+Scenarios:
+  browse   catalog page, product detail and search on the product service
+  login    password login on the user service
+  order    single-line order placement (price + reserve) on the order service
+  cancel   cancellation of a freshly placed order (only the DELETE is timed)
+  history  the user's order history page
+  mixed    70% browse, 10% login, 10% order, 5% cancel, 5% history
+
+Each scenario reports throughput and p50/p95/p99 latency as JSON. With
+--baseline the run is compared against a stored one recorded with the same
+settings, and the script exits with status 1 if any scenario's p95 grew, or
+its throughput fell, by more than the tolerance. Baselines are only
+comparable on the same machine; record one per CI runner.
+
+With --database-url all three services share that database (like the
+docker-compose stack). Use a scratch database: the suite empties its tables.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+import jwt
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from common import load_service, percentile, product_feed
+
+SCENARIOS = ("browse", "login", "order", "cancel", "history", "mixed")
+MIX = (("browse", 70), ("login", 10), ("order", 10), ("cancel", 5), ("history", 5))
+PASSWORD = "benchmark-password"
+SEARCH_TERMS = ["wireless", "keyboard", "acme mouse", "pro", "charger", "stark cable"]
+# Statuses that count as a successful request in every scenario
+OK_STATUSES = frozenset([200, 201])
+
+
+def stub_product_service(products, latency):
+    """
+    Serves the three product endpoints the order service calls from an
+    in-memory dict, on an ephemeral port, with `latency` seconds added per
+    request. Stock is effectively unlimited so orders never fail on it.
+    """
+    stub = Flask("product_stub")
+    lock = threading.Lock()
+    reserved = {}
+
+    @stub.before_request
+    def delay():
+        if latency:
+            time.sleep(latency)
+
+    @stub.route("/products")
+    def get_products():
+        ids = [int(i) for i in request.args.get("ids", "").split(",") if i]
+        fields = request.args.get("fields", "name,price,version").split(",")
+        return jsonify([{"id": i, **{f: products[i][f] for f in fields}} for i in ids if i in products])
+
+    @stub.route("/products/reserve", methods=["POST"])
+    @stub.route("/products/release", methods=["POST"])
+    def move_stock():
+        sign = 1 if request.path.endswith("reserve") else -1
+        with lock:
+            for item in request.get_json().get("items", []):
+                reserved[item["product_id"]] = reserved.get(item["product_id"], 0) + sign * item["quantity"]
+        return jsonify({"message": "ok"})
+
+    server = make_server("127.0.0.1", 0, stub, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class Stack:
+    """The three services, seeded, plus what the scenarios need to address them."""
+
+    def __init__(self, args):
+        self.product_count = args.products
+        self.user_count = args.users
+        catalog = {}
+        for line in product_feed(args.products):
+            record = json.loads(line)
+            catalog[record["id"]] = {"name": record["name"], "price": record["price"], "version": 1}
+
+        # Every simulated user shares one address and a few tokens: measure the
+        # endpoints, not the rate limits and concurrency caps in front of them.
+        self.users = load_service("user_service", args.database_url, RATE_LIMIT_LOGIN="off", MAX_CONCURRENT_LOGIN=0)
+        self.products = load_service("product_service", args.database_url)
+        self.orders = load_service("order_service", args.database_url,
+                                   PRODUCT_SERVICE_URL=stub_product_service(catalog, args.product_latency_ms / 1000),
+                                   RATE_LIMIT_CREATE_ORDER="off", RATE_LIMIT_CANCEL_ORDER="off",
+                                   MAX_CONCURRENT_CREATE_ORDER=0, MAX_CONCURRENT_CANCEL_ORDER=0)
+        for service in (self.users, self.products, self.orders):
+            with service.app.app_context():
+                service.upgrade_schema(service.db.engine, service.__name__, service.MIGRATIONS, service.db.metadata)
+        self._seed(args, catalog)
+        secret = self.orders.app.config["SECRET_KEY"]
+        expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        self.tokens = [jwt.encode({"user_id": user_id, "exp": expires}, secret, algorithm="HS256")
+                       for user_id in range(1, args.users + 1)]
+
+    def _seed(self, args, catalog):
+        with self.products.app.app_context():
+            self.products.db.session.execute(self.products.db.delete(self.products.Product))
+            self.products.db.session.commit()
+            self.products._import_catalog(product_feed(args.products), "ndjson")
+
+        users = self.users
+        with users.app.app_context():
+            users.db.session.execute(users.db.delete(users.User))
+            password_hash = users.password_hasher.hash(PASSWORD)
+            users.db.session.execute(users.db.insert(users.User), [
+                {"id": user_id, "email": f"bench-{user_id}@example.com", "password_hash": password_hash}
+                for user_id in range(1, args.users + 1)])
+            users.db.session.commit()
+
+        orders = self.orders
+        rng = random.Random(7)
+        with orders.app.app_context():
+            orders.db.session.execute(orders.db.delete(orders.Order))
+            rows = []
+            for _ in range(args.orders):
+                product_id = rng.randint(1, args.products)
+                quantity = rng.randint(1, 3)
+                rows.append({"user_id": rng.randint(1, args.users), "product_id": product_id, "quantity": quantity,
+                             "product_name": catalog[product_id]["name"],
+                             "total_price": catalog[product_id]["price"] * quantity})
+            if rows:
+                orders.db.session.execute(orders.db.insert(orders.Order), rows)
+            orders.db.session.commit()
+
+
+class Client:
+    """One simulated user: test clients for each service and its own random stream."""
+
+    def __init__(self, stack, seed):
+        self.stack = stack
+        self.rng = random.Random(seed)
+        self.users = stack.users.app.test_client()
+        self.products = stack.products.app.test_client()
+        self.orders = stack.orders.app.test_client()
+
+    def _auth(self):
+        return {"Authorization": f"Bearer {self.rng.choice(self.stack.tokens)}"}
+
+    def _timed(self, call):
+        start = time.perf_counter()
+        response = call()
+        return response.status_code, time.perf_counter() - start
+
+    def browse(self):
+        roll = self.rng.random()
+        if roll < 0.5:
+            return self._timed(lambda: self.products.get("/products", query_string={"limit": 24}))
+        if roll < 0.85:
+            product_id = self.rng.randint(1, self.stack.product_count)
+            return self._timed(lambda: self.products.get(f"/products/{product_id}"))
+        term = self.rng.choice(SEARCH_TERMS)
+        return self._timed(lambda: self.products.get("/products/search", query_string={"q": term}))
+
+    def login(self):
+        user = self.rng.randint(1, self.stack.user_count)
+        payload = {"email": f"bench-{user}@example.com", "password": PASSWORD}
+        return self._timed(lambda: self.users.post("/login", json=payload))
+
+    def _place_order(self, headers):
+        payload = {"product_id": self.rng.randint(1, self.stack.product_count), "quantity": 1}
+        return self.orders.post("/orders", json=payload, headers=headers)
+
+    def order(self):
+        headers = self._auth()
+        return self._timed(lambda: self._place_order(headers))
+
+    def cancel(self):
+        headers = self._auth()
+        placed = self._place_order(headers)
+        if placed.status_code != 201:
+            return placed.status_code, 0.0
+        order_id = placed.get_json()["order_id"]
+        return self._timed(lambda: self.orders.delete(f"/orders/{order_id}", headers=headers))
+
+    def history(self):
+        headers = self._auth()
+        return self._timed(lambda: self.orders.get("/orders", query_string={"limit": 25}, headers=headers))
+
+    def mixed(self):
+        roll = self.rng.uniform(0, sum(weight for _, weight in MIX))
+        for scenario, weight in MIX:
+            roll -= weight
+            if roll <= 0:
+                return getattr(self, scenario)()
+        return self.browse()
+
+
+def run(stack, scenario, concurrency, requests, seed, warmup):
+    """
+    Runs `requests` iterations of a scenario spread over `concurrency` threads,
+    after `warmup` untimed ones (which fill caches and build the search index).
+    """
+    client = Client(stack, -seed)
+    for _ in range(warmup):
+        getattr(client, scenario)()
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    per_client = max(1, requests // concurrency)
+
+    def drive(n):
+        client = Client(stack, seed * 1000 + n)
+        local_latencies, local_errors = [], 0
+        for _ in range(per_client):
+            status, seconds = getattr(client, scenario)()
+            local_latencies.append(seconds)
+            local_errors += status not in OK_STATUSES
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=drive, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": scenario,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """Returns a description of every scenario that regressed against the baseline."""
+    regressions = []
+    for result in results:
+        before = baseline["results"].get(result["scenario"])
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance) + slack_ms:
+            regressions.append(f"{result['scenario']}: p95 {before['p95_ms']} ms -> {result['p95_ms']} ms")
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: throughput {before['throughput_rps']} -> "
+                               f"{result['throughput_rps']} requests/s")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{result['scenario']}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per scenario")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=5000, help="orders seeded into the history")
+    parser.add_argument("--product-latency-ms", type=float, default=0.0, help="added by the stub product service")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default=None, help="shared scratch database (default: SQLite files)")
+    parser.add_argument("--baseline", help="fail if slower than this stored run")
+    parser.add_argument("--save-baseline", help="store this run as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--slack-ms", type=float, default=1.0, help="allowed absolute p95 regression")
+    args = parser.parse_args()
+
+    settings = {key: getattr(args, key) for key in
+                ("concurrency", "requests", "warmup", "products", "users", "orders", "product_latency_ms", "seed")}
+    settings["database"] = "sqlite" if args.database_url is None else args.database_url.split(":", 1)[0]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            sys.exit(f"{args.baseline} was recorded with different settings: {baseline['settings']}")
+
+    # The stub product service would log every request.
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    stack = Stack(args)
+    results = [run(stack, scenario, args.concurrency, args.requests, args.seed, args.warmup)
+               for scenario in args.scenarios]
+    report = {"settings": settings, "results": results}
+    if baseline is not None:
+        report["regressions"] = compare(results, baseline, args.tolerance, args.slack_ms)
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"settings": settings, "results": {r["scenario"]: r for r in results}}, f, indent=2)
+            f.write("\n")
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# benchmarks/bench_token_verification.py
+"""
+Compares JWT verification throughput with and without the verified-token
+cache used by token_required.
+
+    python benchmarks/bench_token_verification.py --iterations 50000 --tokens 100
+
+--tokens sets how many distinct tokens are cycled through, i.e. how many
+clients are polling at once.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.auth import KeyRing, TokenVerifier  # noqa: E402
+
+
+def measure(verifier, tokens, iterations):
+    """Returns verifications per second over `iterations` calls."""
+    start = time.perf_counter()
+    for i in range(iterations):
+        verifier.verify(tokens[i % len(tokens)])
+    elapsed = time.perf_counter() - start
+    return round(iterations / elapsed, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50000)
+    parser.add_argument("--tokens", type=int, default=100)
+    args = parser.parse_args()
+
+    keyring = KeyRing({"default": "benchmark-secret-key-of-reasonable-length"})
+    exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    tokens = [keyring.issue_token({"user_id": i, "exp": exp}) for i in range(args.tokens)]
+
+    uncached = measure(TokenVerifier(keyring, cache_size=0), tokens, args.iterations)
+    cached = measure(TokenVerifier(keyring), tokens, args.iterations)
+    print(json.dumps({
+        "iterations": args.iterations,
+        "distinct_tokens": args.tokens,
+        "uncached_per_second": uncached,
+        "cached_per_second": cached,
+        "speedup": round(cached / uncached, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
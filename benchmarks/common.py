@@ -0,0 +1,71 @@
+# benchmarks/common.py
+
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Vocabulary for generated product names ("Brand Adjective Noun Model")
+BRANDS = ["Acme", "Globex", "Initech", "Umbrella", "Stark", "Wayne", "Hooli", "Vandelay", "Soylent", "Tyrell"]
+ADJECTIVES = ["Wireless", "Mechanical", "Ergonomic", "Portable", "Compact", "Premium", "Rugged", "Smart",
+              "Silent", "Ultra", "Classic", "Pro"]
+NOUNS = ["Mouse", "Keyboard", "Webcam", "Headset", "Monitor", "Speaker", "Charger", "Cable", "Adapter",
+         "Microphone", "Router", "Tablet", "Stand", "Dock", "Hub", "Lamp"]
+
+
+def load_service(service, database_url=None, **env):
+    """
+    Imports a service's app.py in-process and returns the module.
+
+    Without a database_url the service runs against a throwaway SQLite file,
+    so the benchmarks work without the docker-compose stack. Any extra keyword
+    arguments are exported as environment variables before the import.
+    """
+    if database_url is None:
+        fd, path = tempfile.mkstemp(prefix=f"{service}-", suffix=".db")
+        os.close(fd)
+        database_url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-of-reasonable-length")
+    for key, value in env.items():
+        os.environ[key] = str(value)
+
+    service_dir = os.path.join(ROOT, service)
+    # Services have same-named local modules (e.g. migrations.py); drop any
+    # that an earlier load_service call imported from another service.
+    for name, loaded in list(sys.modules.items()):
+        origin = getattr(loaded, '__file__', None) or ''
+        if os.path.dirname(os.path.dirname(origin)) == ROOT and not origin.startswith(service_dir + os.sep) \
+                and os.path.basename(os.path.dirname(origin)).endswith('_service'):
+            del sys.modules[name]
+    for path in (ROOT, service_dir):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(service, os.path.join(service_dir, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[service] = module  # lets Flask find the service's templates
+    spec.loader.exec_module(module)
+    sys.path.remove(service_dir)
+    if hasattr(module, 'db'):
+        with module.app.app_context():
+            module.db.create_all()
+    return module
+
+
+def product_feed(count, seed=42):
+    """Yields `count` generated products (ids 1..count) as NDJSON lines for the catalog import."""
+    rng = random.Random(seed)
+    for product_id in range(1, count + 1):
+        name = f"{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.randint(1, 999)}"
+        record = {"id": product_id, "name": name, "price": round(rng.uniform(1, 800), 2),
+                  "stock": rng.choice([0, rng.randint(1, 500)])}
+        yield json.dumps(record) + "\n"
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
@@ -1,8 +1,19 @@
 # frontend_service/app.py
 
+import hashlib
 import os
+import time
+import uuid
 import requests
-from flask import Flask, render_template, request, redirect, url_for, flash, make_response
+from flask import Flask, jsonify, render_template, request, redirect, url_for, flash, make_response, session
+from markupsafe import Markup
+from shared.cache import SharedCache, backend_from_env
+from shared.fanout import Call, fan_out
+from shared.http_client import ServiceClient
+from shared.instrumentation import init_instrumentation
+from shared.metrics import Histogram
+from fragments import RENDER_BUCKETS, FragmentCache
+from sessions import CacheSessionInterface
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a-default-secret-key')
@@ -12,20 +23,127 @@ USER_SERVICE_URL = os.environ.get("USER_SERVICE_URL", "http://127.0.0.1:5003")
 PRODUCT_SERVICE_URL = os.environ.get("PRODUCT_SERVICE_URL", "http://127.0.0.1:5001")
 ORDER_SERVICE_URL = os.environ.get("ORDER_SERVICE_URL", "http://127.0.0.1:5002")
 
+# Pooled keep-alive clients with timeouts, retries and circuit breakers, one per upstream.
+# Catalog reads also go through an HTTP cache that honours the product service's
+# Cache-Control and ETag headers.
+user_client = ServiceClient.from_env("user-service", USER_SERVICE_URL)
+product_client = ServiceClient.from_env("product-service", PRODUCT_SERVICE_URL,
+                                        cache_size=int(os.environ.get("PRODUCT_HTTP_CACHE_SIZE", 256)))
+order_client = ServiceClient.from_env("order-service", ORDER_SERVICE_URL)
+
+# Request and upstream timings on /metrics and in Server-Timing headers
+init_instrumentation(app, clients=[user_client, product_client, order_client])
+
+# With a cache server (CACHE_URL), session data such as flash messages is kept
+# there instead of in the cookie.
+if backend_from_env().shared:
+    app.session_interface = CacheSessionInterface(SharedCache(backend_from_env(), 'frontend:sessions'),
+                                                  ttl=int(os.environ.get('SESSION_TTL', 86400)))
+
+# Number of products shown per catalog page
+PRODUCTS_PER_PAGE = int(os.environ.get("PRODUCTS_PER_PAGE", 24))
+# Number of orders shown per order history page
+ORDERS_PER_PAGE = int(os.environ.get("ORDERS_PER_PAGE", 25))
+
+# Per-call deadlines (seconds) for the concurrent upstream fan-out. When a call
+# misses its deadline the page is rendered without that part.
+CATALOG_DEADLINE = float(os.environ.get("CATALOG_DEADLINE", 2.0))
+ORDERS_DEADLINE = float(os.environ.get("ORDERS_DEADLINE", 2.0))
+USER_CONTEXT_DEADLINE = float(os.environ.get("USER_CONTEXT_DEADLINE", 0.5))
+
+# Catalog pages from the product service, shared by all workers. A page is
+# fresh for CATALOG_CACHE_TTL seconds; for CATALOG_CACHE_STALE_TTL more it is
+# still served while one background call refreshes it.
+catalog_cache = SharedCache(backend_from_env(), 'frontend:catalog',
+                            ttl=float(os.environ.get('CATALOG_CACHE_TTL', 5)),
+                            stale_ttl=float(os.environ.get('CATALOG_CACHE_STALE_TTL', 30)))
+
+# Rendered product grids, keyed by the catalog page's ETag. Set FRAGMENT_CACHE_DIR
+# to share them between the gunicorn workers on a host.
+fragment_cache = FragmentCache.from_env()
+# Time spent rendering the whole home page, cached grid or not
+home_render_seconds = Histogram(RENDER_BUCKETS)
+
+def _fetch_current_user(auth_token):
+    """Looks up the logged-in account. It is optional page context, so it is never retried."""
+    response = user_client.get("/me", headers={"Authorization": f"Bearer {auth_token}"},
+                               timeout=USER_CONTEXT_DEADLINE, retry=False)
+    return response.json() if response.status_code == 200 else None
+
 # --- Page Rendering Routes ---
 
 @app.route("/")
 def home():
     auth_token = request.cookies.get('auth_token')
-    try:
-        product_response = requests.get(f"{PRODUCT_SERVICE_URL}/products")
-        product_response.raise_for_status()
-        products = product_response.json()
-    except requests.exceptions.RequestException:
-        products = []
+    cursor = request.args.get('cursor', type=int)
+    params = {"limit": PRODUCTS_PER_PAGE}
+    if cursor is not None:
+        params["cursor"] = cursor
+
+    # Load the catalog page and the user context concurrently.
+    calls = {"catalog": Call(lambda: _load_catalog_page(params), CATALOG_DEADLINE)}
+    if auth_token:
+        calls["user"] = Call(lambda: _fetch_current_user(auth_token), USER_CONTEXT_DEADLINE)
+    results = fan_out(calls)
+
+    start = time.perf_counter()
+    catalog = results["catalog"]
+    if catalog.error is None:
+        product_grid = _render_product_grid(catalog.value, cursor)
+    else:
         flash("Could not connect to the Product Service.", "error")
-        
-    return render_template("index.html", products=products, logged_in=bool(auth_token))
+        product_grid = render_template("_product_grid.html", products=[], cursor=cursor, next_cursor=None)
+    current_user = results["user"].value if "user" in results else None
+    if auth_token and 'order_form_token' not in session:
+        # Kept until an order goes through; see _idempotency_key.
+        session['order_form_token'] = uuid.uuid4().hex
+
+    # The layout around the grid (flash messages, login state) is rendered per request.
+    page = render_template("index.html", product_grid=Markup(product_grid), logged_in=bool(auth_token),
+                           current_user=current_user)
+    home_render_seconds.observe(time.perf_counter() - start)
+    return page
+
+def _load_catalog_page(params):
+    """Returns a catalog page (products, ETag and next cursor) through the shared catalog cache."""
+    def load():
+        response = product_client.get("/products", params=params, timeout=CATALOG_DEADLINE)
+        response.raise_for_status()
+        return {"products": response.json(), "etag": response.headers.get("ETag"),
+                "next_cursor": response.headers.get("X-Next-Cursor")}
+
+    return catalog_cache.get_or_load(f"{params.get('cursor', '')}:{params['limit']}", load)
+
+def _render_product_grid(catalog_page, cursor):
+    """
+    Renders a catalog page's product grid, or reuses the copy rendered from the
+    same catalog state. The product service's ETag covers both the catalog
+    version and the page's query, so it is the cache key.
+    """
+    def render():
+        return render_template("_product_grid.html", products=catalog_page["products"], cursor=cursor,
+                               next_cursor=catalog_page["next_cursor"])
+
+    etag = catalog_page["etag"]
+    if not etag:
+        return render()
+    return fragment_cache.get_or_render(f"product-grid:{etag}", render)
+
+def _idempotency_key(*request_parts):
+    """
+    The Idempotency-Key for an order placed from the catalog page, derived
+    from the session's order form token. A double click, a resubmit or the
+    same form in another tab replays the first order instead of placing
+    another one; create_order rotates the token once an order goes through,
+    which allows the next one. The forms themselves are in the shared grid
+    fragment, hence the session.
+    """
+    token = session.setdefault('order_form_token', uuid.uuid4().hex)
+    return hashlib.sha256(":".join([token, *map(str, request_parts)]).encode()).hexdigest()
+
+def _forwarded_for():
+    """Passes the browser's address on, so the user service limits logins per client rather than per frontend."""
+    return {"X-Forwarded-For": request.remote_addr}
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -34,7 +152,8 @@ def register():
         email = request.form.get("email")
         password = request.form.get("password")
         try:
-            response = requests.post(f"{USER_SERVICE_URL}/register", json={"email": email, "password": password})
+            response = user_client.post("/register", json={"email": email, "password": password},
+                                        headers=_forwarded_for())
             if response.status_code == 201:
                 flash("Registration successful! Please log in.", "success")
                 return redirect(url_for("login"))
@@ -51,7 +170,8 @@ def login():
         email = request.form.get("email")
         password = request.form.get("password")
         try:
-            response = requests.post(f"{USER_SERVICE_URL}/login", json={"email": email, "password": password})
+            response = user_client.post("/login", json={"email": email, "password": password},
+                                        headers=_forwarded_for())
             if response.status_code == 200:
                 auth_token = response.json().get("token")
                 resp = make_response(redirect(url_for("home")))
@@ -74,17 +194,35 @@ def view_orders():
         return redirect(url_for("login"))
 
     headers = {"Authorization": f"Bearer {auth_token}"}
-    orders = []
-    try:
-        response = requests.get(f"{ORDER_SERVICE_URL}/orders", headers=headers)
-        if response.status_code == 200:
-            orders = response.json()
-        else:
-            flash("Could not retrieve your orders.", "error")
-    except requests.exceptions.RequestException:
+    cursor = request.args.get('cursor', type=int)
+    params = {"limit": ORDERS_PER_PAGE}
+    if cursor is not None:
+        params["cursor"] = cursor
+
+    # Load the order history page, the account summary and the user context concurrently.
+    results = fan_out({
+        "orders": Call(lambda: order_client.get("/orders", params=params, headers=headers, timeout=ORDERS_DEADLINE),
+                       ORDERS_DEADLINE),
+        "summary": Call(lambda: order_client.get("/orders/summary", params={"top": 0}, headers=headers,
+                                                 timeout=ORDERS_DEADLINE),
+                        ORDERS_DEADLINE),
+        "user": Call(lambda: _fetch_current_user(auth_token), USER_CONTEXT_DEADLINE),
+    })
+
+    orders, next_cursor = [], None
+    history = results["orders"]
+    if history.error is not None:
         flash("Could not connect to the Order Service.", "error")
+    elif history.value.status_code == 200:
+        orders = history.value.json()
+        next_cursor = history.value.headers.get("X-Next-Cursor")
+    else:
+        flash("Could not retrieve your orders.", "error")
+    summary = results["summary"]
+    summary = summary.value.json() if summary.error is None and summary.value.status_code == 200 else None
 
-    return render_template("orders.html", orders=orders, logged_in=True)
+    return render_template("orders.html", orders=orders, summary=summary, logged_in=True,
+                           current_user=results["user"].value, cursor=cursor, next_cursor=next_cursor)
 
 # --- Action Routes ---
 
@@ -104,13 +242,22 @@ def create_order(product_id):
         flash("You must be logged in to place an order.", "error")
         return redirect(url_for("login"))
     quantity = int(request.form.get("quantity", 1))
-    headers = {"Authorization": f"Bearer {auth_token}"}
+    # The Idempotency-Key makes the POST safe to retry: a retry after a timeout,
+    # or the same form submitted twice, gets the original order back instead of
+    # placing a second one.
+    headers = {"Authorization": f"Bearer {auth_token}",
+               "Idempotency-Key": _idempotency_key(product_id, quantity)}
     payload = {"product_id": product_id, "quantity": quantity}
     try:
-        response = requests.post(f"{ORDER_SERVICE_URL}/orders", headers=headers, json=payload)
+        response = order_client.post("/orders", headers=headers, json=payload, retry=True)
+        if response.status_code in (201, 202):
+            session['order_form_token'] = uuid.uuid4().hex
         if response.status_code == 201:
             order_id = response.json().get("order_id")
             flash(f"Order #{order_id} created successfully!", "success")
+        elif response.status_code == 202:
+            order_id = response.json().get("order_id")
+            flash(f"Order #{order_id} received and is being processed.", "success")
         else:
             flash(f"Order failed: {response.json().get('error')}", "error")
     except requests.exceptions.RequestException:
@@ -126,9 +273,10 @@ def cancel_order(order_id):
         flash("You must be logged in to cancel an order.", "error")
         return redirect(url_for("login"))
 
-    headers = {"Authorization": f"Bearer {auth_token}"}
+    # Cancelling an order twice is the same request, so the order id is the key.
+    headers = {"Authorization": f"Bearer {auth_token}", "Idempotency-Key": f"cancel-{order_id}"}
     try:
-        response = requests.delete(f"{ORDER_SERVICE_URL}/orders/{order_id}", headers=headers)
+        response = order_client.delete(f"/orders/{order_id}", headers=headers, retry=True)
         if response.status_code == 200:
             flash("Order cancelled successfully.", "success")
         else:
@@ -138,5 +286,17 @@ def cancel_order(order_id):
 
     return redirect(url_for("view_orders"))
 
+@app.route("/upstreams/stats")
+def upstream_stats():
+    """Returns latency histograms and circuit state for each upstream service."""
+    return jsonify({client.name: client.stats() for client in (user_client, product_client, order_client)})
+
+@app.route("/fragments/stats")
+def fragment_stats():
+    """Returns the fragment cache hit ratios and render-time histograms."""
+    return jsonify({"product_grid": fragment_cache.stats(),
+                    "catalog": catalog_cache.stats(),
+                    "home_render_seconds": home_render_seconds.snapshot()})
+
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
\ No newline at end of file
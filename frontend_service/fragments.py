@@ -0,0 +1,136 @@
+# frontend_service/fragments.py
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from shared.cache import LRUCache, SharedCache, backend_from_env
+from shared.metrics import Histogram
+
+# Rendering a fragment takes well under the default latency buckets' first bound
+RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+
+class DirectoryStore:
+    """
+    A fragment store shared by every process on the host: one file per key in
+    `path`, written atomically with a rename so readers never see a partial
+    fragment. Once it holds more than `max_entries` files the least recently
+    written ones are removed.
+    """
+
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._file(key), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(value)
+        os.replace(tmp, self._file(key))
+        self._writes += 1
+        # Pruning lists the directory, so only do it every so often.
+        if self._writes % 64 == 0:
+            self._prune()
+
+    def _prune(self):
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.name.startswith('.tmp-'):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class FragmentCache:
+    """
+    Caches rendered HTML fragments that are the same for every visitor.
+
+    Keys must name the exact data a fragment was rendered from (e.g. the
+    upstream's ETag), so entries never need invalidating: a change in the data
+    produces a new key and the old entry simply ages out. Lookups go to an
+    in-process LRU first, then to the optional shared `store`, and only then
+    render the fragment.
+    """
+
+    def __init__(self, max_size=256, ttl=300.0, store=None):
+        self.local = LRUCache(max_size=max_size, ttl=ttl)
+        self.store = store
+        self.render_seconds = Histogram(RENDER_BUCKETS)
+        self.shared_hits = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a cache from FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL and
+        FRAGMENT_CACHE_DIR. Without a directory, fragments are shared through
+        the cache server if CACHE_URL is set.
+        """
+        env = os.environ.get
+        path = env('FRAGMENT_CACHE_DIR')
+        ttl = float(env('FRAGMENT_CACHE_TTL', 300))
+        store = None
+        if path:
+            store = DirectoryStore(path, int(env('FRAGMENT_CACHE_SHARED_SIZE', 1024)))
+        elif backend_from_env().shared:
+            store = SharedCache(backend_from_env(), 'frontend:fragments', ttl=ttl)
+        return cls(max_size=int(env('FRAGMENT_CACHE_SIZE', 256)), ttl=ttl, store=store)
+
+    def get_or_render(self, key, render):
+        """Returns the fragment cached under `key`, calling `render()` to build it on a miss."""
+        fragment = self.local.get(key)
+        if fragment is not None:
+            return fragment
+        if self.store is not None:
+            fragment = self.store.get(key)
+            if fragment is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self.local.set(key, fragment)
+                return fragment
+
+        start = time.perf_counter()
+        fragment = render()
+        self.render_seconds.observe(time.perf_counter() - start)
+        self.local.set(key, fragment)
+        if self.store is not None:
+            try:
+                self.store.set(key, fragment)
+            except OSError:
+                pass  # the shared store is an optimisation; the page still renders
+        return fragment
+
+    def stats(self):
+        """Returns hit ratios for both tiers and the render-time histogram."""
+        local = self.local.stats()
+        renders = self.render_seconds.snapshot()
+        lookups = local['hits'] + local['misses']
+        hits = local['hits'] + self.shared_hits
+        return {
+            'local': local,
+            'shared': {'enabled': self.store is not None, 'hits': self.shared_hits},
+            'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+            'render_seconds': renders,
+        }
@@ -0,0 +1,67 @@
+# frontend_service/sessions.py
+
+import secrets
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+class CacheSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class CacheSessionInterface(SessionInterface):
+    """
+    Keeps session data (the flash messages) in a SharedCache, so any worker
+    can read what another one stored; the cookie only carries a signed random
+    session id. Sessions expire `ttl` seconds after they were last written.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, cache, ttl=86400):
+        self.cache = cache
+        self.ttl = ttl
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='frontend-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self.cache.get(sid)
+                if data is not None:
+                    return CacheSession(self.serializer.loads(data), sid=sid)
+        return CacheSession(sid=secrets.token_urlsafe(24), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session:
+            if session.modified and not session.new:
+                self.cache.invalidate(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not self.should_set_cookie(app, session):
+            return
+        self.cache.set(session.sid, self.serializer.dumps(dict(session)), ttl=self.ttl)
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode(),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app), domain=domain, path=path)
@@ -1,30 +1,148 @@
 # order_service/app.py
 
+import hashlib
 import os
+import time
+import uuid
 import requests
 import jwt
-from functools import wraps
-from flask import Flask, jsonify, request
+from datetime import datetime, timedelta, timezone
+from functools import partial, wraps
+import json
+from flask import Flask, Response, jsonify, request, stream_with_context, url_for
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from shared.auth import KeyRing, TokenVerifier
+from shared.cache import SharedCache, backend_from_env
+from shared.database import (ReplicaRouter, RoutingSession, engine_options_from_env, pool_capacity_from_env,
+                             replica_binds_from_env)
+from shared.fanout import Call, fan_out
+from shared.headers import bearer_token
+from shared.http_client import ServiceClient
+from shared.instrumentation import init_instrumentation
+from shared.migrations import upgrade as upgrade_schema
+from shared.ratelimit import ConcurrencyLimit, RateLimit, rejected_requests
+from migrations import MIGRATIONS
 
 app = Flask(__name__)
 
 # Configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_BINDS'] = replica_binds_from_env()
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+# Order history reads go to the read replicas in DATABASE_REPLICA_URLS, if
+# any, except for a user who has just placed or cancelled an order.
+replicas = ReplicaRouter.from_env(app, db)
 
-PRODUCT_SERVICE_URL = "http://product-service:5001"
+# Verified tokens are cached until their exp, keyed by a digest of the token
+token_verifier = TokenVerifier(KeyRing.from_env(app.config['SECRET_KEY']),
+                               cache_size=int(os.environ.get('TOKEN_CACHE_SIZE', 4096)))
 
-# --- Database Model (Unchanged) ---
+PRODUCT_SERVICE_URL = os.environ.get("PRODUCT_SERVICE_URL", "http://product-service:5001")
+# Pooled keep-alive client with timeouts, retries and a circuit breaker. Its HTTP
+# cache turns repeated product lookups into 304 revalidations (or no call at all
+# within the product service's max-age).
+product_client = ServiceClient.from_env("product-service", PRODUCT_SERVICE_URL,
+                                        cache_size=int(os.environ.get('PRODUCT_HTTP_CACHE_SIZE', 256)))
+# Bearer token the Product Service requires for reserving and releasing stock
+SERVICE_TOKEN = os.environ.get('SERVICE_TOKEN')
+
+# Request, SQL and upstream timings on /metrics and in Server-Timing headers
+instrumentation = init_instrumentation(app, db, clients=[product_client])
+instrumentation.add_family(rejected_requests)
+
+# Order placement and cancellation are limited per user (the token's user id),
+# and requests beyond the pool's connections are shed rather than queued.
+create_order_rate = RateLimit.from_env('create_order', '30/minute')
+cancel_order_rate = RateLimit.from_env('cancel_order', '30/minute')
+create_order_slots = ConcurrencyLimit.from_env('create_order', pool_capacity_from_env())
+cancel_order_slots = ConcurrencyLimit.from_env('cancel_order', pool_capacity_from_env())
+
+# Upper bound on the number of lines in a single cart checkout
+MAX_ORDER_LINES = 50
+
+# Order history pagination limits
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Rows fetched per round trip from the server-side cursor while exporting
+EXPORT_BATCH_SIZE = 1000
+
+# Product details (name/price/version, never stock) keyed by product id, in the
+# shared cache so every worker benefits from one fetch. Expired entries are kept
+# for PRODUCT_CACHE_STALE_TTL more seconds to be revalidated by version.
+app.config['PRODUCT_CACHE_TTL'] = float(os.environ.get('PRODUCT_CACHE_TTL', 30))
+app.config['PRODUCT_CACHE_STALE_TTL'] = float(os.environ.get('PRODUCT_CACHE_STALE_TTL', 600))
+product_cache = SharedCache(backend_from_env(), 'order:products', ttl=app.config['PRODUCT_CACHE_TTL'],
+                            stale_ttl=app.config['PRODUCT_CACHE_STALE_TTL'])
+
+# Local snapshot of the catalog, kept current from the Product Service's change
+# feed by worker.py. While it has caught up within PRODUCT_SNAPSHOT_MAX_LAG
+# seconds, orders are validated and priced from it without calling the
+# Product Service for product details.
+app.config['PRODUCT_SNAPSHOT_MAX_LAG'] = float(os.environ.get('PRODUCT_SNAPSHOT_MAX_LAG', 60))
+# How long a feed request waits for changes (long polling), changes per request,
+# and how often recently read changes are read again (see sync_product_snapshot)
+app.config['PRODUCT_FEED_WAIT'] = float(os.environ.get('PRODUCT_FEED_WAIT', 20))
+app.config['PRODUCT_FEED_BATCH_SIZE'] = int(os.environ.get('PRODUCT_FEED_BATCH_SIZE', 1000))
+app.config['PRODUCT_FEED_RESCAN_SECONDS'] = float(os.environ.get('PRODUCT_FEED_RESCAN_SECONDS', 60))
+# The feed has its own client: long polls would skew the product client's
+# latency histograms and could trip its circuit breaker.
+feed_client = ServiceClient.from_env("product-feed", PRODUCT_SERVICE_URL,
+                                     read_timeout=app.config['PRODUCT_FEED_WAIT'] + 10)
+# Name of the product feed's row in feed_state
+PRODUCT_FEED = 'products'
+
+# How POST /orders processes orders: 'sync' prices and reserves within the request;
+# 'async' only records them and leaves the rest to the outbox worker (worker.py).
+# Clients can ask for async processing per request with "Prefer: respond-async".
+app.config['ORDER_PROCESSING_MODE'] = os.environ.get('ORDER_PROCESSING_MODE', 'sync')
+# Outbox entries claimed per worker round trip, and how long a claim lasts
+# before another worker may retry the entry
+app.config['OUTBOX_BATCH_SIZE'] = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+app.config['OUTBOX_LEASE_SECONDS'] = float(os.environ.get('OUTBOX_LEASE_SECONDS', 30))
+# Attempts after which an entry whose product calls keep failing is given up
+app.config['OUTBOX_MAX_ATTEMPTS'] = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+# How long processed outbox entries are kept
+app.config['OUTBOX_RETENTION_HOURS'] = float(os.environ.get('OUTBOX_RETENTION_HOURS', 24))
+# Longest accepted Idempotency-Key header
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+# How long responses to requests with an Idempotency-Key are kept for replay
+app.config['IDEMPOTENCY_TTL_HOURS'] = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+# How long a duplicate request waits for the in-flight original before giving
+# up with 409, and after how long an unfinished original is presumed dead
+app.config['IDEMPOTENCY_WAIT_SECONDS'] = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10))
+app.config['IDEMPOTENCY_LOCK_SECONDS'] = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 60))
+# Client errors that may go away on their own (a conflict with an order still
+# being processed, a timeout, a rate limit); like server errors they aren't
+# stored, so a retry with the same key runs the request again.
+TRANSIENT_STATUS_CODES = frozenset({408, 409, 425, 429})
+
+# Order statuses. Orders placed synchronously are confirmed straight away.
+PENDING, CONFIRMED, REJECTED, FAILED = 'pending', 'confirmed', 'rejected', 'failed'
+
+# --- Database Model ---
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=False)
     product_id = db.Column(db.Integer, nullable=False)
-    product_name = db.Column(db.String(100), nullable=False)
+    # Name and price are filled in when the order is priced; until then
+    # (status 'pending') they are null.
+    product_name = db.Column(db.String(100))
     quantity = db.Column(db.Integer, nullable=False)
-    total_price = db.Column(db.Float, nullable=False)
+    total_price = db.Column(db.Float)
+    status = db.Column(db.String(20), nullable=False, default=CONFIRMED, server_default=CONFIRMED)
+    failure_reason = db.Column(db.String(200))
+    # The Product Service reservation holding this order's stock, released by
+    # cancel_order; null for orders placed before reservations were recorded.
+    reservation_id = db.Column(db.String(100))
+
+    # Serves both the per-user order history (filter on user_id, ordered by id)
+    # and the ownership check in cancel_order (user_id + id).
+    __table_args__ = (db.Index('ix_order_user_id_id', 'user_id', 'id'),)
 
     def to_dict(self):
         """Converts the order object to a dictionary."""
@@ -34,79 +152,926 @@ class Order(db.Model):
             'product_id': self.product_id,
             'product_name': self.product_name,
             'quantity': self.quantity,
-            'total_price': self.total_price
+            'total_price': self.total_price,
+            'status': self.status,
+            'failure_reason': self.failure_reason
         }
 
-# --- Token Verification Decorator (Unchanged) ---
+class OrderOutbox(db.Model):
+    """
+    Orders accepted asynchronously and still to be priced and reserved.
+
+    The entry is written in the same transaction as its pending order rows, so
+    an accepted order is never lost; the worker marks it processed in the same
+    transaction that confirms or rejects the orders. Processed entries are
+    kept for OUTBOX_RETENTION_HOURS. Retried requests are answered by
+    @idempotent, like synchronous ones.
+    """
+    __tablename__ = 'order_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    # JSON: {"order_ids": [...], "lines": [{"product_id", "quantity"}, ...]}
+    payload = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Not claimable before this time; claiming pushes it out by the lease
+    available_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_order_outbox_pending', 'processed_at', 'available_at'),
+    )
+
+class IdempotencyRecord(db.Model):
+    """
+    The stored outcome of a mutation sent with an Idempotency-Key.
+
+    A row without a status_code marks a request that is still running. Keys are
+    scoped per user and the request fingerprint (method, path and body) is kept
+    so a key reused for a different request is refused rather than replayed.
+    """
+    __tablename__ = 'idempotency_record'
+    user_id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(MAX_IDEMPOTENCY_KEY_LENGTH), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    # The response body as sent, plus its Content-Type and Location
+    body = db.Column(db.Text)
+    content_type = db.Column(db.String(100))
+    location = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class ProductSnapshot(db.Model):
+    """
+    The catalog fields orders are priced from, copied from the Product
+    Service's change feed (see sync_product_snapshot). Stock is not copied:
+    the reservation stays the stock check.
+    """
+    __tablename__ = 'product_snapshot'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    # The product's change number in the feed; older changes never overwrite newer ones
+    change_seq = db.Column(db.BigInteger, nullable=False)
+
+class FeedState(db.Model):
+    """Where the consumer of a change feed is, and how far behind the producer."""
+    __tablename__ = 'feed_state'
+    name = db.Column(db.String(50), primary_key=True)
+    # Position to read from next (the feed's next_since)
+    position = db.Column(db.String(50), nullable=False, default='0')
+    # While a rescan is running, its own position; see sync_product_snapshot
+    rescan_position = db.Column(db.String(50))
+    settled = db.Column(db.BigInteger, nullable=False, default=0)
+    rescan_mark = db.Column(db.BigInteger, nullable=False, default=0)
+    # When the last rescan finished
+    rescanned_at = db.Column(db.DateTime)
+    # The producer's latest change number as of the last poll
+    latest = db.Column(db.BigInteger, nullable=False, default=0)
+    polled_at = db.Column(db.DateTime)
+    # Last time a poll found nothing more to read
+    caught_up_at = db.Column(db.DateTime)
+
+    @property
+    def position_seq(self):
+        return int(self.position.partition(':')[0])
+
+def _utcnow():
+    """Naive UTC timestamp, as stored in the DateTime columns."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# --- Token Verification Decorator ---
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization'].split(" ")[1]
-        if not token:
+        token = bearer_token(request.headers.get('Authorization'))
+        if token is None:
             return jsonify({'error': 'Token is missing'}), 401
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user_id = data['user_id']
-        except Exception:
+            data = token_verifier.verify(token)
+        except jwt.InvalidTokenError:
+            return jsonify({'error': 'Token is invalid'}), 401
+        current_user_id = data.get('user_id')
+        if current_user_id is None:
             return jsonify({'error': 'Token is invalid'}), 401
         return f(current_user_id, *args, **kwargs)
     return decorated
 
+def _user_key(current_user_id, *args, **kwargs):
+    """The per-user key for rate limits and for pinning reads to the primary after a write."""
+    return current_user_id
+
+# --- Idempotency-Key Decorator ---
+def _replay(record):
+    """Rebuilds the stored response of a completed idempotent request."""
+    response = app.response_class(record.body, status=record.status_code, content_type=record.content_type)
+    if record.location:
+        response.headers['Location'] = record.location
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _claim_idempotency_key(current_user_id, key, fingerprint):
+    """
+    Records this request as the owner of the key. Returns None if it is, or
+    the response to send instead: the stored one for a completed duplicate,
+    an error for a mismatched or still-running one. A duplicate of a request
+    that is in flight polls until that request finishes.
+    """
+    deadline = time.monotonic() + app.config['IDEMPOTENCY_WAIT_SECONDS']
+    while True:
+        now = _utcnow()
+        try:
+            db.session.execute(db.insert(IdempotencyRecord).values(
+                user_id=current_user_id, key=key, fingerprint=fingerprint, created_at=now,
+                expires_at=now + timedelta(hours=app.config['IDEMPOTENCY_TTL_HOURS'])))
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+
+        record = db.session.get(IdempotencyRecord, (current_user_id, key), populate_existing=True)
+        if record is None:
+            continue  # deleted in the meantime; try to claim it again
+        if record.fingerprint != fingerprint:
+            return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+        abandoned = now - record.created_at > timedelta(seconds=app.config['IDEMPOTENCY_LOCK_SECONDS'])
+        if record.expires_at <= now or (record.status_code is None and abandoned):
+            # Compare-and-delete so only one duplicate takes over the key.
+            db.session.execute(
+                db.delete(IdempotencyRecord)
+                .where(IdempotencyRecord.user_id == current_user_id, IdempotencyRecord.key == key,
+                       IdempotencyRecord.created_at == record.created_at)
+                .execution_options(synchronize_session=False))
+            db.session.commit()
+            continue
+        if record.status_code is not None:
+            return _replay(record)
+        db.session.rollback()
+        if time.monotonic() >= deadline:
+            return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+        time.sleep(0.05)
+
+def idempotent(f):
+    """
+    Makes a mutation safe to retry: when the request carries an Idempotency-Key,
+    the first response is stored and any later request with the same key (from
+    the same user) is answered with it without running the view again.
+    Concurrent duplicates wait for the first request to finish. Only 2xx and
+    final 4xx responses are stored; after a server error or a temporary one
+    (TRANSIENT_STATUS_CODES) the key is released, so a retry runs for real.
+
+    Must be applied inside token_required, since keys are scoped per user.
+    """
+    @wraps(f)
+    def decorated(current_user_id, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return f(current_user_id, *args, **kwargs)
+        if not 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({"error": f"Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters"}), 400
+
+        fingerprint = hashlib.sha256(
+            b"\0".join([request.method.encode(), request.path.encode(), request.get_data()])).hexdigest()
+        duplicate = _claim_idempotency_key(current_user_id, key, fingerprint)
+        if duplicate is not None:
+            return duplicate
+
+        record_key = (current_user_id, key)
+        try:
+            response = app.make_response(f(current_user_id, *args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            db.session.execute(db.delete(IdempotencyRecord).where(
+                IdempotencyRecord.user_id == current_user_id, IdempotencyRecord.key == key))
+            db.session.commit()
+            raise
+        record = db.session.get(IdempotencyRecord, record_key)
+        if not (200 <= response.status_code < 300 or
+                (400 <= response.status_code < 500 and response.status_code not in TRANSIENT_STATUS_CODES)):
+            db.session.delete(record)
+        else:
+            record.status_code = response.status_code
+            record.body = response.get_data(as_text=True)
+            record.content_type = response.content_type
+            record.location = response.headers.get('Location')
+        db.session.commit()
+        return response
+    return decorated
+
 # --- API Endpoints ---
 
+def _int_arg(name, default=None):
+    """Parses an optional integer query parameter, raising ValueError on bad input."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
+
+def _parse_order_lines(data):
+    """
+    Normalizes an order payload into a list of {product_id, quantity} lines.
+
+    Accepts either the original single-product form ({"product_id", "quantity"})
+    or a cart ({"items": [{"product_id", "quantity"}, ...]}). Repeated products
+    are merged so stock is checked against the combined quantity.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Product ID and quantity are required")
+    items = data.get("items")
+    if items is None:
+        items = [{"product_id": data.get("product_id"), "quantity": data.get("quantity")}]
+    if not isinstance(items, list) or not items:
+        raise ValueError("At least one order item is required")
+    if len(items) > MAX_ORDER_LINES:
+        raise ValueError(f"An order can contain at most {MAX_ORDER_LINES} items")
+
+    quantities = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("Product ID and quantity are required")
+        product_id = item.get("product_id")
+        quantity = item.get("quantity")
+        if not product_id or not quantity:
+            raise ValueError("Product ID and quantity are required")
+        if not isinstance(product_id, int) or not isinstance(quantity, int) or quantity < 1:
+            raise ValueError("Product ID and quantity must be positive integers")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return [{"product_id": pid, "quantity": qty} for pid, qty in quantities.items()]
+
+def _fetch_products(product_ids, fields="name,price,version"):
+    """Resolves many products with a single batch call to the Product Service."""
+    response = product_client.get("/products",
+                                  params={"ids": ",".join(str(pid) for pid in product_ids), "fields": fields})
+    response.raise_for_status()
+    return {product["id"]: product for product in response.json()}
+
+def _snapshot_products(product_ids):
+    """
+    Returns name/price details for the given products from the local product
+    snapshot, or None if the snapshot has not caught up with the change feed
+    within PRODUCT_SNAPSHOT_MAX_LAG seconds (e.g. no consumer is running).
+    """
+    caught_up_at = db.session.execute(
+        db.select(FeedState.caught_up_at).where(FeedState.name == PRODUCT_FEED)).scalar()
+    if caught_up_at is None or (_utcnow() - caught_up_at).total_seconds() > app.config['PRODUCT_SNAPSHOT_MAX_LAG']:
+        return None
+    rows = db.session.execute(
+        db.select(ProductSnapshot.id, ProductSnapshot.name, ProductSnapshot.price, ProductSnapshot.version)
+        .where(ProductSnapshot.id.in_(product_ids)))
+    return {row.id: {"id": row.id, "name": row.name, "price": row.price, "version": row.version} for row in rows}
+
+def _get_products(product_ids):
+    """
+    Returns name/price details for the given products: from the product
+    snapshot while it is current, without calling the Product Service, and
+    otherwise (or for products it doesn't have yet) from _get_service_products.
+    """
+    products = _snapshot_products(product_ids) or {}
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        products.update(_get_service_products(missing))
+    return products
+
+def _get_service_products(product_ids):
+    """
+    Returns name/price details for the given products, served from the cache
+    where possible.
+
+    Fresh entries are used as-is. Expired entries are revalidated with one
+    cheap batch call that only returns each product's version; unchanged ones
+    are kept, and changed or uncached products are fetched in full, with
+    concurrent requests for the same products sharing one fetch. Stale entries
+    are never served while they are revalidated, since an order must not be
+    priced from an outdated price. Stock is
+    deliberately not cached: the reservation in create_order is the only
+    stock check.
+    """
+    products, stale, to_fetch = {}, {}, []
+    for product_id in product_ids:
+        cached = product_cache.get(product_id)
+        if cached is not None:
+            products[product_id] = cached
+            continue
+        expired = product_cache.get_stale(product_id)
+        if expired is not None:
+            stale[product_id] = expired
+        else:
+            to_fetch.append(product_id)
+
+    if stale:
+        versions = _fetch_products(stale, fields="version")
+        for product_id, expired in stale.items():
+            current = versions.get(product_id)
+            if current is None:
+                product_cache.invalidate(product_id)
+            elif current["version"] == expired["version"]:
+                product_cache.refresh(product_id)
+                products[product_id] = expired
+            else:
+                to_fetch.append(product_id)
+
+    if to_fetch:
+        products.update(product_cache.load_many(to_fetch, _fetch_products))
+    return products
+
+class StockUnavailable(Exception):
+    """The Product Service refused a reservation: unknown products or not enough stock."""
+
+    def __init__(self, error, product_ids, status_code):
+        super().__init__(error)
+        self.error = error
+        self.product_ids = product_ids
+        self.status_code = status_code
+
+def _service_headers():
+    return {"Authorization": f"Bearer {SERVICE_TOKEN}"} if SERVICE_TOKEN else {}
+
+def _reserve_stock(lines, reservation_id):
+    """
+    Reserves stock for all lines at once with the Product Service, under
+    reservation_id; repeating the call takes no more stock. Raises
+    StockUnavailable if it refuses, RequestException if it can't be reached.
+    """
+    response = product_client.post("/products/reserve", json={"items": lines, "reservation_id": reservation_id},
+                                   headers=_service_headers())
+    if response.status_code == 404:
+        raise StockUnavailable("Product not found", response.json().get("product_ids", []), 404)
+    if response.status_code == 409:
+        raise StockUnavailable("Insufficient stock", response.json().get("product_ids", []), 400)
+    response.raise_for_status()
+
+def _release_stock(reservation_id, lines=None):
+    """
+    Gives the stock a reservation holds for `lines` (by default all of it)
+    back to the Product Service. Returns False if the reservation doesn't
+    hold it, because it never went through or was released already.
+    """
+    payload = {"reservation_id": reservation_id}
+    if lines is not None:
+        payload["items"] = lines
+    response = product_client.post("/products/release", json=payload, headers=_service_headers())
+    if response.status_code in (404, 409):
+        return False
+    response.raise_for_status()
+    return True
+
+def _priced_lines(lines, products):
+    """Copies each line's product name and computes its total price."""
+    return [{
+        "product_id": line["product_id"],
+        "product_name": products[line["product_id"]]["name"],
+        "quantity": line["quantity"],
+        "total_price": products[line["product_id"]]["price"] * line["quantity"],
+    } for line in lines]
+
+def _wants_async():
+    """True if this order should be accepted now and processed by the outbox worker."""
+    return (app.config['ORDER_PROCESSING_MODE'] == 'async'
+            or 'respond-async' in request.headers.get('Prefer', ''))
+
 @app.route("/orders", methods=["POST"])
 @token_required
+@create_order_rate.limit(_user_key)
+@create_order_slots.limit()
+@replicas.pins_after(_user_key)
+@idempotent
 def create_order(current_user_id):
-    # This function's logic is unchanged
-    data = request.get_json()
-    product_id = data.get("product_id")
-    quantity = data.get("quantity")
-    # ... (rest of the create_order logic is the same)
-    if not product_id or not quantity: return jsonify({"error": "Product ID and quantity are required"}), 400
+    """
+    Creates one order row per cart line.
+
+    The whole cart is validated and priced with one batch lookup (against the
+    local product snapshot while it is current, otherwise the Product Service),
+    its stock is reserved atomically with the Product Service, and all rows are
+    written with a single bulk insert in one transaction.
+
+    In async mode (see ORDER_PROCESSING_MODE) the rows are only recorded as
+    pending and 202 is returned; see _accept_order.
+    """
+    data = request.get_json(silent=True)
     try:
-        product_response = requests.get(f"{PRODUCT_SERVICE_URL}/products/{product_id}")
-        if product_response.status_code == 404: return jsonify({"error": "Product not found"}), 404
-        product_response.raise_for_status()
-        product = product_response.json()
+        lines = _parse_order_lines(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if _wants_async():
+        return _accept_order(current_user_id, data, lines)
+    try:
+        products = _get_products([line["product_id"] for line in lines])
+    except requests.exceptions.RequestException as e:
+        return jsonify({"error": f"Could not connect to Product Service: {e}"}), 503
+
+    missing = [line["product_id"] for line in lines if line["product_id"] not in products]
+    if missing:
+        return jsonify({"error": "Product not found", "product_ids": missing}), 404
+    reservation_id = f"order:{uuid.uuid4().hex}"
+    try:
+        _reserve_stock(lines, reservation_id)
+    except StockUnavailable as e:
+        return jsonify({"error": e.error, "product_ids": e.product_ids}), e.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Could not connect to Product Service: {e}"}), 503
-    if product["stock"] < quantity: return jsonify({"error": "Insufficient stock"}), 400
-    total_price = product["price"] * quantity
-    new_order = Order(user_id=current_user_id, product_id=product_id, product_name=product["name"], quantity=quantity, total_price=total_price)
-    db.session.add(new_order)
+
+    rows = [dict(row, user_id=current_user_id, reservation_id=reservation_id)
+            for row in _priced_lines(lines, products)]
+    try:
+        result = db.session.execute(
+            db.insert(Order).returning(Order.id, sort_by_parameter_order=True), rows)
+        order_ids = list(result.scalars())
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        # Compensate the reservation so the stock isn't lost; best effort.
+        try:
+            _release_stock(reservation_id)
+        except requests.exceptions.RequestException:
+            app.logger.exception("Failed to release stock for %s", lines)
+        raise
+
+    if "items" not in data:
+        return jsonify({"message": "Order created successfully", "order_id": order_ids[0]}), 201
+    return jsonify({
+        "message": "Order created successfully",
+        "order_ids": order_ids,
+        "total_price": sum(row["total_price"] for row in rows),
+    }), 201
+
+def _accepted(data, order_ids):
+    """202 response for asynchronously accepted orders, pointing at the first order's status."""
+    body = {"message": "Order accepted", "status": PENDING}
+    if "items" not in data:
+        body["order_id"] = order_ids[0]
+    else:
+        body["order_ids"] = order_ids
+    response = jsonify(body)
+    response.status_code = 202
+    response.headers['Location'] = url_for('get_order', order_id=order_ids[0])
+    return response
+
+def _accept_order(current_user_id, data, lines):
+    """
+    Records the order lines as pending orders plus one outbox entry, in one
+    transaction, without calling the Product Service. A retry with the same
+    Idempotency-Key is answered by @idempotent with the original 202.
+    """
+    rows = [{"user_id": current_user_id, "product_id": line["product_id"], "quantity": line["quantity"],
+             "status": PENDING} for line in lines]
+    now = _utcnow()
+    result = db.session.execute(
+        db.insert(Order).returning(Order.id, sort_by_parameter_order=True), rows)
+    order_ids = list(result.scalars())
+    db.session.add(OrderOutbox(
+        user_id=current_user_id, payload=json.dumps({"order_ids": order_ids, "lines": lines}),
+        attempts=0, available_at=now, created_at=now))
+    db.session.commit()
+    return _accepted(data, order_ids)
+
+@app.route("/orders/<int:order_id>", methods=["GET"])
+@token_required
+@replicas.read_only(_user_key)
+def get_order(current_user_id, order_id):
+    """Returns one of the current user's orders, including its processing status."""
+    order = db.session.execute(
+        db.select(Order).where(Order.id == order_id, Order.user_id == current_user_id)).scalar_one_or_none()
+    if order is None:
+        return jsonify({"error": "Order not found"}), 404
+    return jsonify(order.to_dict())
+
+# --- Outbox worker ---
+# Run by worker.py, outside the request cycle.
+
+def _claim_outbox_entries(batch_size):
+    """
+    Leases up to batch_size due outbox entries to this worker. Until the lease
+    runs out other workers skip them; if this worker dies, they become due
+    again and are retried.
+    """
+    now = _utcnow()
+    due = (db.select(OrderOutbox.id)
+           .where(OrderOutbox.processed_at.is_(None), OrderOutbox.available_at <= now)
+           .order_by(OrderOutbox.id)
+           .limit(batch_size)
+           .with_for_update(skip_locked=True))
+    ids = list(db.session.execute(due).scalars())
+    if not ids:
+        db.session.rollback()
+        return []
+    db.session.execute(
+        db.update(OrderOutbox)
+        .where(OrderOutbox.id.in_(ids))
+        .values(available_at=now + timedelta(seconds=app.config['OUTBOX_LEASE_SECONDS']),
+                attempts=OrderOutbox.attempts + 1)
+        .execution_options(synchronize_session=False))
+    entries = db.session.execute(
+        db.select(OrderOutbox).where(OrderOutbox.id.in_(ids)).order_by(OrderOutbox.id)).scalars().all()
+    db.session.commit()
+    return entries
+
+def _finish_entry(entry, order_ids, status, reason=None, priced=None):
+    """Sets the entry's orders to their final status and marks the entry processed."""
+    if priced is not None:
+        db.session.execute(db.update(Order), [
+            dict(line, id=order_id, status=status) for order_id, line in zip(order_ids, priced)])
+    else:
+        db.session.execute(
+            db.update(Order).where(Order.id.in_(order_ids))
+            .values(status=status, failure_reason=reason)
+            .execution_options(synchronize_session=False))
+    entry.processed_at = _utcnow()
+    db.session.commit()
+    return status
+
+def _reservation_key(entry):
+    """The Product Service reservation id of an outbox entry, the same on every attempt."""
+    return f"order-outbox:{entry.id}"
+
+def _exhausted(entry):
+    """True once an entry has used up its attempts and is only waiting to be failed."""
+    return entry.attempts > app.config['OUTBOX_MAX_ATTEMPTS']
+
+def _fail_entry(entry, order_ids, reason):
+    """
+    Fails an entry that ran out of attempts. A reservation whose response was
+    lost may still have gone through, so it is released (by its id) first;
+    until that succeeds the entry stays due and is retried.
+    """
+    try:
+        _release_stock(_reservation_key(entry))
+    except requests.exceptions.RequestException as e:
+        app.logger.warning("Could not release the reservation of outbox entry %s: %s", entry.id, e)
+        return 'retried'
+    return _finish_entry(entry, order_ids, FAILED, reason)
+
+def _settle_entry(entry, payload, products, reservation):
+    """Confirms or rejects one accepted order given its reservation outcome; returns the outcome."""
+    order_ids, lines = payload["order_ids"], payload["lines"]
+    if _exhausted(entry):
+        return _fail_entry(entry, order_ids, "Could not connect to Product Service")
+    if products is None:
+        error = requests.exceptions.ConnectionError("Product lookup failed")
+    elif reservation is None:
+        return _finish_entry(entry, order_ids, REJECTED, "Product not found")
+    else:
+        error = reservation.error
+    if isinstance(error, StockUnavailable):
+        return _finish_entry(entry, order_ids, REJECTED, error.error)
+    if error is not None:
+        if entry.attempts >= app.config['OUTBOX_MAX_ATTEMPTS']:
+            return _fail_entry(entry, order_ids, f"Could not connect to Product Service: {error}")
+        return 'retried'  # due again once the lease runs out
+
+    try:
+        priced = [dict(line, reservation_id=_reservation_key(entry)) for line in _priced_lines(lines, products)]
+        return _finish_entry(entry, order_ids, CONFIRMED, priced=priced)
+    except SQLAlchemyError:
+        db.session.rollback()
+        app.logger.exception("Failed to confirm outbox entry %s", entry.id)
+        try:
+            _release_stock(_reservation_key(entry))
+        except requests.exceptions.RequestException:
+            app.logger.exception("Failed to release stock for %s", lines)
+        return 'retried'
+
+def process_outbox(batch_size=None):
+    """
+    Claims one batch of accepted orders, looks up all of their products with a
+    single call, reserves stock for the orders concurrently, then confirms (or
+    rejects) each order. Returns how many entries ended in each outcome.
+
+    Each entry reserves under its own reservation id, so an attempt repeated
+    after a lost response or a worker crash doesn't take the stock twice, and
+    an entry that runs out of attempts can release whatever it did take.
+    """
+    entries = _claim_outbox_entries(batch_size or app.config['OUTBOX_BATCH_SIZE'])
+    counts = dict.fromkeys((CONFIRMED, REJECTED, FAILED, 'retried'), 0)
+    if not entries:
+        return counts
+    payloads = {entry.id: json.loads(entry.payload) for entry in entries}
+    live = [entry for entry in entries if not _exhausted(entry)]
+    product_ids = sorted({line["product_id"] for entry in live for line in payloads[entry.id]["lines"]})
+    products = {}
+    if product_ids:
+        try:
+            products = _get_products(product_ids)
+        except requests.exceptions.RequestException as e:
+            app.logger.warning("Product lookup for outbox batch failed: %s", e)
+            products = None
+
+    # Reservations are independent HTTP calls, so they run side by side; the
+    # database work stays on this thread.
+    reservations = {}
+    if products is not None:
+        reservations = fan_out({
+            entry.id: Call(partial(_reserve_stock, payloads[entry.id]["lines"], _reservation_key(entry)), None)
+            for entry in live
+            if all(line["product_id"] in products for line in payloads[entry.id]["lines"])
+        })
+    for entry in entries:
+        counts[_settle_entry(entry, payloads[entry.id], products, reservations.get(entry.id))] += 1
+    return counts
+
+def purge_idempotency_records():
+    """Deletes stored Idempotency-Key responses past their TTL; returns how many."""
+    result = db.session.execute(
+        db.delete(IdempotencyRecord).where(IdempotencyRecord.expires_at < _utcnow())
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+def purge_outbox():
+    """Deletes processed entries older than the retention period; returns how many."""
+    cutoff = _utcnow() - timedelta(hours=app.config['OUTBOX_RETENTION_HOURS'])
+    result = db.session.execute(
+        db.delete(OrderOutbox).where(OrderOutbox.processed_at < cutoff)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+# --- Product change feed consumer ---
+# Run by worker.py, outside the request cycle.
+
+def _feed_state():
+    """The product feed's state row, created on first use."""
+    state = db.session.get(FeedState, PRODUCT_FEED)
+    if state is None:
+        state = FeedState(name=PRODUCT_FEED, position='0', settled=0, rescan_mark=0, latest=0,
+                          rescanned_at=_utcnow())
+        db.session.add(state)
+    return state
+
+def _apply_product_changes(changes):
+    """Upserts feed changes into the product snapshot; a change never overwrites a newer one."""
+    table = ProductSnapshot.__table__
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    insert = dialect.insert(table)
+    new = insert.excluded
+    db.session.execute(insert.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={'name': new.name, 'price': new.price, 'version': new.version, 'change_seq': new.change_seq},
+        where=table.c.change_seq < new.change_seq,
+    ), [{key: change[key] for key in ('id', 'name', 'price', 'version', 'change_seq')} for change in changes])
+
+def sync_product_snapshot(wait=0.0):
+    """
+    Reads one page of the Product Service's change feed into the product
+    snapshot, waiting up to `wait` seconds for changes if there are none.
+    Returns the number of changes read; raises RequestException if the feed
+    can't be reached.
+
+    Change numbers are handed out when a product row is written, so a change
+    whose transaction commits late can become visible after a later-numbered
+    one was read. To pick such changes up, every PRODUCT_FEED_RESCAN_SECONDS
+    the consumer reads again everything after the position it had reached
+    two rescans ago (`settled`); writes commit well within that interval.
+    The first rescan re-reads the whole initial load.
+    """
+    state = _feed_state()
+    now = _utcnow()
+    if state.rescan_position is None and (
+            state.rescanned_at is None
+            or (now - state.rescanned_at).total_seconds() >= app.config['PRODUCT_FEED_RESCAN_SECONDS']):
+        state.rescan_position = str(state.settled)
+        state.settled, state.rescan_mark = state.rescan_mark, state.position_seq
+    rescanning = state.rescan_position is not None
+    since = state.rescan_position if rescanning else state.position
+    # Leave the database alone while the request waits.
     db.session.commit()
-    return jsonify({"message": "Order created successfully", "order_id": new_order.id}), 201
+
+    response = feed_client.get("/products/changes", retry=False, params={
+        "since": since, "limit": app.config['PRODUCT_FEED_BATCH_SIZE'], "wait": 0 if rescanning else wait})
+    response.raise_for_status()
+    page = response.json()
+
+    state = _feed_state()
+    if page["changes"]:
+        _apply_product_changes(page["changes"])
+    now = _utcnow()
+    state.latest = page["latest"]
+    state.polled_at = now
+    if rescanning:
+        state.rescan_position = page["next_since"] if page["has_more"] else None
+        if state.rescan_position is None:
+            state.rescanned_at = now
+    else:
+        state.position = page["next_since"]
+        if state.position_seq > page["latest"]:
+            # The catalog is behind what was read from it (e.g. restored from a backup): start over.
+            app.logger.warning("Product feed position %s is past the catalog's latest change %s; resyncing",
+                               state.position, page["latest"])
+            state.position, state.rescan_position, state.settled, state.rescan_mark = '0', None, 0, 0
+        elif not page["has_more"]:
+            state.caught_up_at = now
+    db.session.commit()
+    return len(page["changes"])
+
+def _feed_metrics():
+    """Product feed lag gauges, read from feed_state when /metrics is scraped."""
+    state = db.session.get(FeedState, PRODUCT_FEED)
+    if state is None:
+        return []
+    families = [
+        {'name': 'product_feed_position', 'kind': 'gauge', 'help': 'Latest product change applied to the snapshot.',
+         'samples': [({}, state.position_seq)]},
+        {'name': 'product_feed_lag_changes', 'kind': 'gauge',
+         'help': 'Product changes the snapshot had not applied yet, as of the last feed poll.',
+         'samples': [({}, max(0, state.latest - state.position_seq))]},
+    ]
+    if state.caught_up_at is not None:
+        families.append({'name': 'product_feed_lag_seconds', 'kind': 'gauge',
+                         'help': 'Seconds since the product snapshot was last caught up with the change feed.',
+                         'samples': [({}, round((_utcnow() - state.caught_up_at).total_seconds(), 3))]})
+    return families
+
+instrumentation.add_collector(_feed_metrics)
 
 # --- NEW: Endpoint to get a user's orders ---
+ORDER_COLUMNS = ('id', 'user_id', 'product_id', 'product_name', 'quantity', 'total_price', 'status')
+
+def _order_history_query(current_user_id):
+    """Selects the user's order columns, newest first, along the (user_id, id) index."""
+    columns = [getattr(Order, name) for name in ORDER_COLUMNS]
+    return db.select(*columns).where(Order.user_id == current_user_id).order_by(Order.id.desc())
+
 @app.route("/orders", methods=["GET"])
 @token_required
+@replicas.read_only(_user_key)
 def get_orders(current_user_id):
-    """Returns all orders placed by the current user."""
-    orders = Order.query.filter_by(user_id=current_user_id).all()
-    return jsonify([order.to_dict() for order in orders])
+    """
+    Returns one page of the current user's orders, newest first.
+
+    Query parameters:
+      cursor -- return orders with an id lower than this (keyset pagination on (user_id, id))
+      limit  -- page size (default 50, max 500)
+
+    As with the product catalog, the body is a plain JSON list and the next
+    cursor is sent in the X-Next-Cursor header (and as a Link rel="next").
+    """
+    try:
+        cursor = _int_arg('cursor')
+        limit = _int_arg('limit', DEFAULT_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if limit < 1:
+        return jsonify({"error": "'limit' must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    query = _order_history_query(current_user_id)
+    if cursor is not None:
+        query = query.where(Order.id < cursor)
+    # Fetch one extra row to know whether another page exists.
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    orders = [dict(zip(ORDER_COLUMNS, row)) for row in rows[:limit]]
+
+    response = jsonify(orders)
+    if len(rows) > limit:
+        next_cursor = orders[-1]['id']
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+        response.headers['Link'] = '<{}>; rel="next"'.format(url_for('get_orders', _external=True, **args))
+    return response
+
+@app.route("/orders/export", methods=["GET"])
+@token_required
+def export_orders(current_user_id):
+    """
+    Streams the current user's entire order history as NDJSON (one order per line).
+
+    Rows are read from a server-side cursor in batches of EXPORT_BATCH_SIZE and
+    written out as they arrive, so memory use stays flat however many orders
+    the account has.
+    """
+    query = _order_history_query(current_user_id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    def generate():
+        for row in db.session.execute(query):
+            yield json.dumps(dict(zip(ORDER_COLUMNS, row))) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route("/orders/summary", methods=["GET"])
+@token_required
+@replicas.read_only(_user_key)
+def get_order_summary(current_user_id):
+    """
+    Returns aggregate figures for the current user's confirmed orders, computed
+    in SQL: overall counts and totals, plus the `top` products by spend (default 10).
+    """
+    try:
+        top = min(max(_int_arg('top', 10), 0), MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    totals = db.session.execute(
+        db.select(db.func.count(Order.id),
+                  db.func.coalesce(db.func.sum(Order.quantity), 0),
+                  db.func.coalesce(db.func.sum(Order.total_price), 0.0))
+        .where(Order.user_id == current_user_id, Order.status == CONFIRMED)).one()
+
+    spent = db.func.sum(Order.total_price).label('total_price')
+    by_product = db.session.execute(
+        db.select(Order.product_id, db.func.max(Order.product_name), db.func.count(Order.id),
+                  db.func.sum(Order.quantity), spent)
+        .where(Order.user_id == current_user_id, Order.status == CONFIRMED)
+        .group_by(Order.product_id)
+        .order_by(spent.desc(), Order.product_id)
+        .limit(top)).all()
+
+    return jsonify({
+        'order_count': totals[0],
+        'total_quantity': totals[1],
+        'total_price': totals[2],
+        'top_products': [
+            {'product_id': row[0], 'product_name': row[1], 'order_count': row[2],
+             'quantity': row[3], 'total_price': row[4]}
+            for row in by_product
+        ],
+    })
 
 # --- NEW: Endpoint to cancel an order ---
 @app.route("/orders/<int:order_id>", methods=["DELETE"])
 @token_required
+@cancel_order_rate.limit(_user_key)
+@cancel_order_slots.limit()
+@replicas.pins_after(_user_key)
+@idempotent
 def cancel_order(current_user_id, order_id):
-    """Cancels an order, verifying ownership first."""
-    # Security Check: Find the order that both has the right ID AND belongs to the current user.
-    order = Order.query.filter_by(id=order_id, user_id=current_user_id).first()
+    """
+    Cancels an order, verifying ownership first.
+
+    The row is claimed by deleting it (only if it belongs to the user and
+    isn't pending) before any stock is released, so of two concurrent
+    cancellations only one finds it. The delete stays uncommitted, holding
+    the row, until the stock is back; a failed release rolls it back and
+    leaves the order intact.
+    """
+    claimed = db.session.execute(
+        db.delete(Order)
+        .where(Order.id == order_id, Order.user_id == current_user_id, Order.status != PENDING)
+        .returning(Order.status, Order.product_id, Order.quantity, Order.reservation_id)).first()
 
-    # Edge Case: If the order doesn't exist or belongs to another user, return 404.
-    if not order:
+    if claimed is None:
+        db.session.rollback()
+        exists = db.session.execute(
+            db.select(Order.id).where(Order.id == order_id, Order.user_id == current_user_id)).first()
+        # The outbox worker may be reserving its stock right now.
+        if exists is not None:
+            return jsonify({"error": "Order is still being processed"}), 409
+        # Edge Case: If the order doesn't exist or belongs to another user, return 404.
         return jsonify({"error": "Order not found or you do not have permission to cancel it"}), 404
-    
-    db.session.delete(order)
+
+    # Rejected and failed orders never reserved any stock.
+    if claimed.status == CONFIRMED and claimed.reservation_id is None:
+        app.logger.warning("Order %s predates recorded reservations; its stock is not released", order_id)
+    elif claimed.status == CONFIRMED:
+        try:
+            released = _release_stock(claimed.reservation_id,
+                                      [{"product_id": claimed.product_id, "quantity": claimed.quantity}])
+        except requests.exceptions.RequestException as e:
+            db.session.rollback()
+            return jsonify({"error": f"Could not connect to Product Service: {e}"}), 503
+        if not released:
+            app.logger.warning("Stock of order %s was already released", order_id)
+
     db.session.commit()
     return jsonify({"message": "Order cancelled successfully"}), 200
 
-# ... (init-db command and main block are unchanged) ...
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Returns the product cache's hit/miss counters and its backend's stats."""
+    return jsonify(product_cache.stats())
+
+@app.route("/replicas/stats", methods=["GET"])
+def replica_stats():
+    """Returns each read replica's health, lag and share of the reads."""
+    return jsonify(replicas.stats())
+
+@app.route("/upstreams/stats", methods=["GET"])
+def upstream_stats():
+    """Returns latency histograms and circuit state for each upstream service."""
+    return jsonify({product_client.name: product_client.stats()})
+
+# --- Schema migrations ---
+def _upgrade_schema():
+    applied = upgrade_schema(db.engine, "order_service", MIGRATIONS, db.metadata)
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+
+@app.cli.command("db-upgrade")
+def db_upgrade_command():
+    """Applies any pending schema migrations."""
+    _upgrade_schema()
+
+@app.cli.command("purge")
+def purge_command():
+    """Deletes processed outbox entries and expired Idempotency-Key responses."""
+    print(f"Purged {purge_outbox()} outbox entries and {purge_idempotency_records()} idempotency records.")
+
 @app.cli.command("init-db")
 def init_db_command():
-    db.create_all()
+    _upgrade_schema()
     print("Order database initialized.")
+
 if __name__ == '__main__':
     app.run(port=5002, debug=True)
\ No newline at end of file
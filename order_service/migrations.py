@@ -0,0 +1,39 @@
+# order_service/migrations.py
+
+from shared.migrations import (Migration, add_column, create_index, create_tables, drop_column, drop_index,
+                               drop_not_null)
+
+
+def _order_history_index(conn, metadata):
+    create_index(conn, metadata, 'order', 'ix_order_user_id_id')
+
+
+def _async_orders(conn, metadata):
+    order = metadata.tables['order']
+    add_column(conn, order.c.status)
+    add_column(conn, order.c.failure_reason)
+    drop_not_null(conn, order.c.product_name)
+    drop_not_null(conn, order.c.total_price)
+    create_tables(conn, metadata)  # order_outbox
+
+
+def _order_reservation_id(conn, metadata):
+    add_column(conn, metadata.tables['order'].c.reservation_id)
+
+
+def _drop_outbox_idempotency_key(conn, metadata):
+    # Retries of asynchronous orders are answered by idempotency_record alone.
+    drop_index(conn, 'ux_order_outbox_user_key')
+    drop_column(conn, 'order_outbox', 'idempotency_key')
+
+
+# Applied in order by `flask db-upgrade` (and by `flask init-db`).
+MIGRATIONS = [
+    Migration(1, 'create tables', create_tables),
+    Migration(2, 'add (user_id, id) index for order history and ownership checks', _order_history_index),
+    Migration(3, 'add order status and the order outbox for asynchronous processing', _async_orders),
+    Migration(4, 'add idempotency_record for Idempotency-Key replays', create_tables),
+    Migration(5, 'add product_snapshot and feed_state for the product change feed', create_tables),
+    Migration(6, 'add order.reservation_id so cancellations release their own reservation', _order_reservation_id),
+    Migration(7, 'drop order_outbox.idempotency_key, replaced by idempotency_record', _drop_outbox_idempotency_key),
+]
@@ -0,0 +1,84 @@
+# order_service/worker.py
+"""
+Outbox worker: prices, reserves and confirms orders accepted asynchronously
+by POST /orders. Alongside, a thread follows the Product Service's change
+feed into the local product snapshot that orders are priced from.
+
+    python worker.py [--batch-size 50] [--poll-interval 1.0] [--once] [--no-feed]
+
+Several workers can run side by side; on Postgres each claims its own batch.
+Feed changes are applied idempotently, so several feed consumers are safe too.
+"""
+
+import argparse
+import threading
+import time
+
+import requests
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import app, process_outbox, purge_idempotency_records, purge_outbox, sync_product_snapshot
+
+# Seconds between purges of processed outbox entries and expired idempotency records
+PURGE_INTERVAL = 600
+# Seconds to wait before reading the product feed again after a failure
+FEED_RETRY_INTERVAL = 2.0
+# Seconds to wait before processing the outbox again after a failure
+OUTBOX_RETRY_INTERVAL = 2.0
+
+
+def run(batch_size=None, poll_interval=1.0, once=False):
+    """
+    Drains the outbox; sleeps poll_interval whenever it finds nothing to do.
+    Database and Product Service failures (e.g. the schema not being created
+    yet) are logged and retried rather than ending the worker.
+    """
+    last_purge = 0.0
+    while True:
+        try:
+            with app.app_context():
+                counts = process_outbox(batch_size)
+                if any(counts.values()):
+                    app.logger.info("Processed outbox batch: %s", counts)
+                if time.monotonic() - last_purge >= PURGE_INTERVAL:
+                    purge_outbox()
+                    purge_idempotency_records()
+                    last_purge = time.monotonic()
+        except (requests.exceptions.RequestException, SQLAlchemyError) as e:
+            if once:
+                raise
+            app.logger.warning("Processing the order outbox failed: %s", e)
+            time.sleep(OUTBOX_RETRY_INTERVAL)
+            continue
+        if once:
+            return counts
+        # Keep draining while there is a backlog; only idle rounds sleep.
+        if not any(counts[outcome] for outcome in counts if outcome != 'retried'):
+            time.sleep(poll_interval)
+
+
+def run_feed():
+    """Keeps the product snapshot up to date, long-polling the change feed once caught up."""
+    while True:
+        try:
+            with app.app_context():
+                sync_product_snapshot(wait=app.config['PRODUCT_FEED_WAIT'])
+        except (requests.exceptions.RequestException, SQLAlchemyError) as e:
+            app.logger.warning("Reading the product change feed failed: %s", e)
+            time.sleep(FEED_RETRY_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=None, help="entries per batch (default: OUTBOX_BATCH_SIZE)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds to wait when the outbox is empty")
+    parser.add_argument("--once", action="store_true", help="process a single batch and exit")
+    parser.add_argument("--no-feed", action="store_true", help="don't follow the product change feed")
+    args = parser.parse_args()
+    if not args.no_feed and not args.once:
+        threading.Thread(target=run_feed, name="product-feed", daemon=True).start()
+    run(args.batch_size, args.poll_interval, args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,81 @@
 # product_service/app.py
 
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import math
 import os
-from flask import Flask, jsonify
+import sys
+import time
+from datetime import datetime, timezone
+from functools import wraps
+import click
+from flask import Flask, Response, jsonify, request, stream_with_context, url_for
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from shared.cache import SharedCache, backend_from_env
+from shared.compression import init_compression
+from shared.database import ReplicaRouter, RoutingSession, engine_options_from_env, replica_binds_from_env
+from shared.headers import bearer_token
+from shared.instrumentation import init_instrumentation
+from shared.metrics import mark_long_poll
+from shared.migrations import upgrade as upgrade_schema
+from migrations import MIGRATIONS
+from catalog_io import DEFAULT_CHUNK_SIZE, FEED_COLUMNS, export_feed, import_feed, read_feed
+from search import TS_CONFIG, InvertedIndex, database_search
 
 app = Flask(__name__)
 
 # Configure the database connection using the environment variable
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_BINDS'] = replica_binds_from_env()
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+# Catalog reads go to the read replicas in DATABASE_REPLICA_URLS, if any
+replicas = ReplicaRouter.from_env(app, db)
+
+# gzip/brotli for large responses (e.g. catalog pages)
+init_compression(app)
+# Request and SQL timings on /metrics and in Server-Timing headers
+init_instrumentation(app, db)
+
+# Catalog pagination limits
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Search result limits; ranked results are paged by offset, so it is capped
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_SEARCH_OFFSET = 1000
+# Change feed page size, and the longest a request may wait for changes
+DEFAULT_FEED_LIMIT = 500
+MAX_FEED_LIMIT = 5000
+MAX_FEED_WAIT = 30
+# How often a waiting change feed request looks for new changes (seconds)
+FEED_POLL_INTERVAL = float(os.environ.get('FEED_POLL_INTERVAL', 0.2))
+
+# How long clients may reuse a product response before revalidating it with its ETag
+app.config['PRODUCT_CACHE_MAX_AGE'] = int(os.environ.get('PRODUCT_CACHE_MAX_AGE', 5))
+
+MAX_RESERVATION_ID_LENGTH = 100
+
+# Bearer token for the /admin endpoints; they are disabled while it is unset
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+# Bearer token other services use to reserve and release stock; those
+# endpoints are disabled while it is unset
+app.config['SERVICE_TOKEN'] = os.environ.get('SERVICE_TOKEN')
+# Rows fetched per round trip from the server-side cursor while exporting
+EXPORT_BATCH_SIZE = 5000
+
+# Catalog-wide change counter. Every insert or update of a product row (stock
+# movements included) stamps the row with the next value, so a row's
+# change_seq changes with every committed write to it. A Postgres sequence is
+# used because nextval() takes no row lock, unlike a counter row would; the
+# price is that values are taken before commit, so transactions can commit
+# out of order and max(change_seq) alone doesn't identify the catalog state.
+product_change_seq = db.Sequence('product_change_seq', metadata=db.metadata)
 
 # Define the Product database model
 class Product(db.Model):
@@ -17,6 +83,11 @@ class Product(db.Model):
     name = db.Column(db.String(100), nullable=False)
     price = db.Column(db.Float, nullable=False)
     stock = db.Column(db.Integer, nullable=False)
+    # Bumped whenever the catalog data (name/price) changes, but not on stock
+    # movements, so clients can cheaply revalidate cached product details.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Position of the row's latest change in the catalog-wide change order
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
 
     def to_dict(self):
         """Converts the product object to a dictionary."""
@@ -24,28 +95,638 @@ class Product(db.Model):
             'id': self.id,
             'name': self.name,
             'price': self.price,
-            'stock': self.stock
+            'stock': self.stock,
+            'version': self.version
         }
 
+def _next_change_seq(dialect_name):
+    """SQL expression for the next value of the catalog-wide change counter."""
+    if dialect_name == 'postgresql':
+        return product_change_seq.next_value()
+    # Databases without sequences (SQLite in development) serialize writers anyway.
+    return db.select(db.func.coalesce(db.func.max(Product.change_seq), 0) + 1).scalar_subquery()
+
+@db.event.listens_for(Product, 'before_insert')
+def _stamp_new_product(mapper, connection, target):
+    """Stamps a new product with the next catalog change number."""
+    target.change_seq = _next_change_seq(connection.dialect.name)
+
+@db.event.listens_for(Product, 'before_update')
+def _bump_product_version(mapper, connection, target):
+    """
+    Increments the row version when an ORM update changes name or price, and
+    stamps every change with the next catalog change number.
+    """
+    state = db.inspect(target)
+    if state.attrs.name.history.has_changes() or state.attrs.price.history.has_changes():
+        target.version = (target.version or 0) + 1
+    target.change_seq = _next_change_seq(connection.dialect.name)
+
+class StockReservation(db.Model):
+    """
+    The stock a reservation took and still holds, so that a retried reserve
+    (e.g. after a timeout) is answered without taking stock again, and
+    releases give back at most what was taken. Kept until fully released.
+    """
+    __tablename__ = 'stock_reservation'
+    id = db.Column(db.String(MAX_RESERVATION_ID_LENGTH), primary_key=True)
+    # JSON: [[product_id, quantity], ...]
+    items = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index('ix_stock_reservation_created_at', 'created_at'),)
+
+def _utcnow():
+    """Naive UTC timestamp, as stored in the DateTime columns."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# Indexes backing the catalog filters. The lower(name) index uses text_pattern_ops
+# on Postgres so that case-insensitive prefix searches (LIKE 'abc%') can use it.
+db.Index('ix_product_name_lower', db.func.lower(Product.name).label('name_lower'),
+         postgresql_ops={'name_lower': 'text_pattern_ops'})
+db.Index('ix_product_price', Product.price)
+# Serves the change feed, which pages through (change_seq, id)
+db.Index('ix_product_change_seq_id', Product.change_seq, Product.id)
+
+# Indexes backing /products/search on Postgres: full-text matching on the name
+# and trigram similarity for misspellings. Other databases search in memory.
+db.Index('ix_product_name_fts', db.func.to_tsvector(TS_CONFIG, Product.name),
+         postgresql_using='gin').ddl_if(dialect='postgresql')
+db.Index('ix_product_name_trgm', Product.name, postgresql_using='gin',
+         postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+db.event.listen(db.metadata, 'before_create',
+                db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+PRODUCT_FIELDS = ('id', 'name', 'price', 'stock', 'version')
+
+def _int_arg(name, default=None):
+    """Parses an optional integer query parameter, raising ValueError on bad input."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
+
+def _float_arg(name):
+    """Parses an optional finite numeric query parameter, raising ValueError on bad input (including nan/inf)."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a number")
+    if not math.isfinite(number):
+        raise ValueError(f"'{name}' must be a finite number")
+    return number
+
+def _int_list_arg(name):
+    """Parses an optional comma-separated list of integers, raising ValueError on bad input."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return sorted({int(v) for v in value.split(',') if v.strip()})
+    except ValueError:
+        raise ValueError(f"'{name}' must be a comma-separated list of integers")
+
+def _etag_matches(etag):
+    """
+    True if the request's If-None-Match names this ETag, in any of the encoded
+    variants the compression layer may have sent (e.g. "<tag>-gzip").
+    """
+    candidates = request.if_none_match
+    return bool(candidates) and any(
+        candidates.contains(variant) for variant in (etag, f"{etag}-gzip", f"{etag}-br"))
+
+def _not_modified(etag):
+    """An empty 304 response carrying the ETag and caching headers."""
+    response = app.response_class(status=304)
+    return _cacheable(response, etag)
+
+def _cacheable(response, etag):
+    """Adds the strong ETag and Cache-Control headers to a product response."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"public, max-age={app.config['PRODUCT_CACHE_MAX_AGE']}"
+    return response
+
+def _catalog_version():
+    """The catalog's current change number; an index-only lookup, no ORM involved."""
+    return db.session.execute(db.select(db.func.max(Product.change_seq))).scalar() or 0
+
+def _escape_like(value):
+    """Escapes LIKE wildcards so user input is matched literally."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
 @app.route("/products", methods=["GET"])
+@replicas.read_only()
 def get_products():
-    """Returns the list of all products from the database."""
-    products = Product.query.all()
-    return jsonify([product.to_dict() for product in products])
+    """
+    Returns one page of products, ordered by id.
+
+    Query parameters:
+      cursor               -- return products with an id greater than this (keyset pagination)
+      limit                -- page size (default 50, max 500)
+      min_price, max_price -- inclusive price range
+      min_stock, max_stock -- inclusive stock range
+      q                    -- case-insensitive name prefix
+      fields               -- comma-separated columns to return (id is always included)
+      ids                  -- comma-separated product ids to fetch in one batch (max 500);
+                              unknown ids are simply left out of the result
+
+    The body stays a plain JSON list; when more rows exist the id to pass as the
+    next cursor is sent in the X-Next-Cursor header (and as a Link rel="next").
+
+    The ETag is a digest of the query string and the page's (id, change_seq)
+    pairs. Every committed write gives a row a new change_seq, so it changes
+    whenever the page does, whatever order concurrent writers commit in. A
+    matching If-None-Match is answered with 304 without serialising the page.
+    """
+    try:
+        cursor = _int_arg('cursor')
+        limit = _int_arg('limit', DEFAULT_PAGE_SIZE)
+        min_price = _float_arg('min_price')
+        max_price = _float_arg('max_price')
+        min_stock = _int_arg('min_stock')
+        max_stock = _int_arg('max_stock')
+        ids = _int_list_arg('ids')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if limit < 1:
+        return jsonify({"error": "'limit' must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    if ids is not None:
+        if len(ids) > MAX_PAGE_SIZE:
+            return jsonify({"error": f"At most {MAX_PAGE_SIZE} ids can be requested at once"}), 400
+        # A batch lookup always fits in one page.
+        limit = max(len(ids), 1)
+
+    fields = request.args.get('fields')
+    if fields:
+        requested = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in requested if f not in PRODUCT_FIELDS]
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+        columns = ['id'] + [f for f in PRODUCT_FIELDS if f in requested and f != 'id']
+    else:
+        columns = list(PRODUCT_FIELDS)
+
+    # Select only the requested columns; rows come back as tuples, not ORM objects.
+    query = db.select(Product.change_seq, *[getattr(Product, c) for c in columns])
+    if ids is not None:
+        query = query.where(Product.id.in_(ids))
+    if cursor is not None:
+        query = query.where(Product.id > cursor)
+    if min_price is not None:
+        query = query.where(Product.price >= min_price)
+    if max_price is not None:
+        query = query.where(Product.price <= max_price)
+    if min_stock is not None:
+        query = query.where(Product.stock >= min_stock)
+    if max_stock is not None:
+        query = query.where(Product.stock <= max_stock)
+    prefix = request.args.get('q')
+    if prefix:
+        pattern = _escape_like(prefix.lower()) + '%'
+        query = query.where(db.func.lower(Product.name).like(pattern, escape='\\'))
+    # Fetch one extra row to know whether another page exists.
+    query = query.order_by(Product.id).limit(limit + 1)
+
+    rows = db.session.execute(query).all()
+    has_more = len(rows) > limit
+    page = rows[:limit]
+
+    digest = hashlib.sha1(request.query_string)
+    digest.update(f"|{has_more}|".encode())
+    digest.update(",".join(f"{row.id}:{row.change_seq}" for row in page).encode())
+    etag = f"c{digest.hexdigest()[:24]}"
+    if _etag_matches(etag):
+        return _not_modified(etag)
+
+    products = [dict(zip(columns, row[1:])) for row in page]
+    response = _cacheable(jsonify(products), etag)
+    if has_more:
+        next_cursor = products[-1]['id']
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+        response.headers['Link'] = '<{}>; rel="next"'.format(url_for('get_products', _external=True, **args))
+    return response
 
 @app.route("/products/<int:product_id>", methods=["GET"])
+@replicas.read_only()
 def get_product(product_id):
-    """Returns the details of a specific product from the database."""
-    product = Product.query.get(product_id)
-    if product:
-        return jsonify(product.to_dict())
-    return jsonify({"error": "Product not found"}), 404
+    """
+    Returns the details of a specific product from the database.
+
+    The row is read as plain columns and its ETag comes from the row's change
+    number, so a revalidation that still matches costs one primary-key lookup.
+    """
+    row = db.session.execute(
+        db.select(*[getattr(Product, c) for c in PRODUCT_FIELDS], Product.change_seq)
+        .where(Product.id == product_id)).first()
+    if row is None:
+        return jsonify({"error": "Product not found"}), 404
+    etag = f"p{product_id}-{row.change_seq}"
+    if _etag_matches(etag):
+        return _not_modified(etag)
+    return _cacheable(jsonify(dict(zip(PRODUCT_FIELDS, row))), etag)
+
+# In-memory search index for databases without full-text search (see search.py)
+search_index = InvertedIndex()
+
+def _build_search_index():
+    """Builds the in-memory search index at startup, so the first search doesn't scan the catalog."""
+    with app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            return
+        try:
+            with db.engine.connect() as conn:
+                search_index.refresh(conn, Product.__table__)
+        except SQLAlchemyError as e:
+            # e.g. `flask init-db` before the tables exist; the first search builds it instead.
+            app.logger.info("Search index not built at startup: %s", e)
+
+_build_search_index()
+# Search responses in the shared cache, keyed by the query and its parameters.
+# For SEARCH_CACHE_STALE_TTL seconds after they expire they are still served
+# while one background search refreshes them.
+search_cache = SharedCache(backend_from_env(), 'product:search',
+                           ttl=float(os.environ.get('SEARCH_CACHE_TTL', 5)),
+                           stale_ttl=float(os.environ.get('SEARCH_CACHE_STALE_TTL', 30)),
+                           context=app.app_context)
+
+def _bool_arg(name):
+    """Parses an optional true/false query parameter, raising ValueError on bad input."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    if value.lower() not in ('true', 'false', '1', '0'):
+        raise ValueError(f"'{name}' must be true or false")
+    return value.lower() in ('true', '1')
+
+@app.route("/products/search", methods=["GET"])
+@replicas.read_only()
+def search_products():
+    """
+    Ranked search on product names with facets.
+
+    Query parameters:
+      q                    -- search terms (required)
+      limit, offset        -- page size (default 20, max 100) and start (max 1000)
+      min_price, max_price -- price range filter
+      in_stock             -- true/false
+
+    The response holds the total number of hits after filtering, the page of
+    results with their scores, and facet counts (price buckets and in stock)
+    over all matches before the price and stock filters, so they can be used
+    to refine the search. On Postgres everything comes from one indexed query.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "'q' is required"}), 400
+    try:
+        limit = _int_arg('limit', DEFAULT_SEARCH_LIMIT)
+        offset = _int_arg('offset', 0)
+        filters = {'min_price': _float_arg('min_price'), 'max_price': _float_arg('max_price'),
+                   'in_stock': _bool_arg('in_stock')}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if limit < 1 or not 0 <= offset <= MAX_SEARCH_OFFSET:
+        return jsonify({"error": f"'limit' must be positive and 'offset' between 0 and {MAX_SEARCH_OFFSET}"}), 400
+    limit = min(limit, MAX_SEARCH_LIMIT)
+
+    def search():
+        conn = replicas.connection(db.session)
+        if conn.dialect.name == 'postgresql':
+            total, results, facets = database_search(conn, Product.__table__, query, filters, limit, offset)
+        else:
+            search_index.refresh(conn, Product.__table__)
+            total, results, facets = search_index.search(query, filters, limit, offset)
+        return {"query": query, "total": total, "results": results, "facets": facets}
+
+    key = json.dumps([query, filters, limit, offset], sort_keys=True)
+    return jsonify(search_cache.get_or_load(key, search))
+
+def _parse_feed_cursor(value):
+    """
+    Parses a change feed position: "<change_seq>" (everything after that
+    change) or "<change_seq>:<id>" as returned in next_since. Raises ValueError.
+    """
+    seq, _, after = (value or '0').partition(':')
+    try:
+        return int(seq), int(after) if after else None
+    except ValueError:
+        raise ValueError("'since' must be a change number, optionally followed by ':<product id>'")
+
+def _changes_after(seq, after, limit):
+    position = (Product.change_seq > seq if after is None
+                else db.tuple_(Product.change_seq, Product.id) > db.tuple_(seq, after))
+    return db.session.execute(
+        db.select(*[getattr(Product, c) for c in PRODUCT_FIELDS], Product.change_seq)
+        .where(position).order_by(Product.change_seq, Product.id).limit(limit)).all()
+
+@app.route("/products/changes", methods=["GET"])
+def get_product_changes():
+    """
+    Change feed of the catalog, for services that keep a local copy of it.
+
+    Query parameters:
+      since -- position to continue from: a change number, or the next_since
+               of the previous response (default 0: the whole catalog)
+      limit -- changes per response (default 500, max 5000)
+      wait  -- seconds to hold the request open while there are no changes
+               (long polling; default 0, max 30)
+
+    Returns every product whose latest change comes after `since`, in change
+    order, with its change_seq; a product changed several times appears once,
+    in its current state. `next_since` is the position to ask for next,
+    `latest` the catalog's current change number and `has_more` whether
+    another page is already waiting.
+
+    Change numbers are handed out when a row is written, so on Postgres a
+    transaction that commits late can make an earlier number visible after
+    a later one. Consumers that must not miss such changes re-read a recent
+    window from time to time (the order service does).
+    """
+    try:
+        seq, after = _parse_feed_cursor(request.args.get('since'))
+        limit = _int_arg('limit', DEFAULT_FEED_LIMIT)
+        wait = _float_arg('wait') or 0.0
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if limit < 1 or seq < 0 or wait < 0:
+        return jsonify({"error": "'since', 'limit' and 'wait' must not be negative"}), 400
+    limit = min(limit, MAX_FEED_LIMIT)
+
+    deadline = time.monotonic() + min(wait, MAX_FEED_WAIT)
+    if wait:
+        mark_long_poll()
+    while True:
+        rows = _changes_after(seq, after, limit)
+        if rows or time.monotonic() >= deadline:
+            break
+        # Hand the connection back while waiting; the next look starts a new transaction.
+        db.session.close()
+        time.sleep(FEED_POLL_INTERVAL)
+
+    changes = [dict(zip(PRODUCT_FIELDS + ('change_seq',), row)) for row in rows]
+    if changes:
+        next_since = f"{changes[-1]['change_seq']}:{changes[-1]['id']}"
+    else:
+        next_since = request.args.get('since') or '0'
+    return jsonify({"changes": changes, "next_since": next_since, "latest": _catalog_version(),
+                    "has_more": len(changes) == limit})
+
+def _bearer_required(config_key, error):
+    """Decorates a view so it only runs for requests carrying app.config[config_key] as their bearer token."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            expected = app.config[config_key]
+            token = bearer_token(request.headers.get('Authorization'))
+            if not expected or token is None or not hmac.compare_digest(token, expected):
+                return jsonify({"error": error}), 401
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+admin_required = _bearer_required('ADMIN_TOKEN', "Admin token is missing or invalid")
+service_required = _bearer_required('SERVICE_TOKEN', "Service token is missing or invalid")
+
+def _parse_stock_items(data):
+    """
+    Validates a reserve/release payload ({"items": [{"product_id", "quantity"}, ...]})
+    and returns (product_id, quantity) pairs sorted by product id, so concurrent
+    multi-item requests always touch rows in the same order and cannot deadlock.
+    """
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError("At least one item is required")
+    quantities = {}
+    for item in items:
+        product_id = item.get("product_id") if isinstance(item, dict) else None
+        quantity = item.get("quantity") if isinstance(item, dict) else None
+        if not isinstance(product_id, int) or not isinstance(quantity, int) or quantity < 1:
+            raise ValueError("Product ID and quantity must be positive integers")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return sorted(quantities.items())
+
+def _missing_products(product_ids):
+    """Returns the ids from the list that have no product row."""
+    found = set(db.session.execute(db.select(Product.id).where(Product.id.in_(product_ids))).scalars())
+    return [pid for pid in product_ids if pid not in found]
+
+def _reservation_id(data):
+    """Returns the reservation_id of a reserve/release payload, raising ValueError if missing or malformed."""
+    reservation_id = data.get("reservation_id") if isinstance(data, dict) else None
+    if not (isinstance(reservation_id, str) and 0 < len(reservation_id) <= MAX_RESERVATION_ID_LENGTH):
+        raise ValueError(f"reservation_id must be a string of 1 to {MAX_RESERVATION_ID_LENGTH} characters")
+    return reservation_id
+
+@app.route("/products/reserve", methods=["POST"])
+@service_required
+def reserve_stock():
+    """
+    Atomically takes stock for every item, or for none of them.
+
+    Each item is a single conditional UPDATE ... SET stock = stock - :qty
+    WHERE id = :id AND stock >= :qty, so the check and the decrement happen in
+    one statement and stock can never go negative, without a separate
+    SELECT ... FOR UPDATE round trip. The row lock is held only until the commit.
+
+    The reservation is recorded under its reservation_id in the same
+    transaction, and a repeat of it (a client retrying after a timeout) takes
+    nothing more.
+    """
+    data = request.get_json(silent=True)
+    try:
+        items = _parse_stock_items(data)
+        reservation_id = _reservation_id(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Inserted first: a concurrent repeat waits on the primary key and then fails it.
+    db.session.add(StockReservation(id=reservation_id, items=json.dumps(items), created_at=_utcnow()))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "Stock reserved", "replayed": True}), 200
+
+    for product_id, quantity in items:
+        result = db.session.execute(
+            db.update(Product)
+            .where(Product.id == product_id, Product.stock >= quantity)
+            .values(stock=Product.stock - quantity, change_seq=_next_change_seq(db.engine.dialect.name))
+            .execution_options(synchronize_session=False))
+        if result.rowcount == 0:
+            db.session.rollback()
+            missing = _missing_products([product_id])
+            if missing:
+                return jsonify({"error": "Product not found", "product_ids": missing}), 404
+            return jsonify({"error": "Insufficient stock", "product_ids": [product_id]}), 409
+    db.session.commit()
+    return jsonify({"message": "Stock reserved"}), 200
+
+@app.route("/products/release", methods=["POST"])
+@service_required
+def release_stock():
+    """
+    Gives back stock held by a reservation, in one transaction: the items
+    sent, or everything it still holds if no items are sent. An unknown (or
+    fully released) reservation is refused with 404, and items it doesn't
+    hold (e.g. a line released before) with 409, so stock can only come back
+    once and never more than was taken.
+    """
+    data = request.get_json(silent=True)
+    try:
+        reservation_id = _reservation_id(data)
+        items = _parse_stock_items(data) if data.get("items") is not None else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    reservation = db.session.execute(
+        db.select(StockReservation).where(StockReservation.id == reservation_id).with_for_update()
+    ).scalar_one_or_none()
+    if reservation is None:
+        db.session.rollback()
+        return jsonify({"error": "Reservation not found"}), 404
+    held = dict(tuple(item) for item in json.loads(reservation.items))
+    if items is None:
+        items = sorted(held.items())
+    over = [product_id for product_id, quantity in items if held.get(product_id, 0) < quantity]
+    if over:
+        db.session.rollback()
+        return jsonify({"error": "The reservation doesn't hold these items", "product_ids": over}), 409
+    for product_id, quantity in items:
+        held[product_id] -= quantity
+    remaining = sorted((product_id, quantity) for product_id, quantity in held.items() if quantity)
+    if remaining:
+        reservation.items = json.dumps(remaining)
+    else:
+        db.session.delete(reservation)
+
+    for product_id, quantity in items:
+        result = db.session.execute(
+            db.update(Product)
+            .where(Product.id == product_id)
+            .values(stock=Product.stock + quantity, change_seq=_next_change_seq(db.engine.dialect.name))
+            .execution_options(synchronize_session=False))
+        if result.rowcount == 0:
+            db.session.rollback()
+            return jsonify({"error": "Product not found", "product_ids": [product_id]}), 404
+    db.session.commit()
+    return jsonify({"message": "Stock released"}), 200
+
+# --- Bulk catalog import / export ---
+def _feed_format(default):
+    fmt = request.args.get('format', default)
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError("'format' must be 'csv' or 'ndjson'")
+    return fmt
+
+def _import_catalog(stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Upserts a CSV/NDJSON feed into the catalog in one transaction and returns the import summary."""
+    with db.engine.begin() as conn:
+        return import_feed(conn, Product.__table__, read_feed(stream, fmt),
+                           _next_change_seq(conn.dialect.name), chunk_size)
+
+def _catalog_rows():
+    """Every product as an (id, name, price, stock) row, read from a server-side cursor."""
+    query = (db.select(*[getattr(Product, c) for c in FEED_COLUMNS]).order_by(Product.id)
+             .execution_options(yield_per=EXPORT_BATCH_SIZE))
+    return db.session.execute(query)
+
+@app.route("/admin/products/import", methods=["POST"])
+@admin_required
+def import_products():
+    """
+    Streams a product feed from the request body into the catalog.
+
+    The format is taken from ?format=, else from the Content-Type (text/csv
+    or NDJSON). CSV feeds need a header row with id, name, price and
+    optionally stock. Invalid rows are skipped and listed in the response.
+    """
+    try:
+        fmt = _feed_format('csv' if request.mimetype == 'text/csv' else 'ndjson')
+        chunk_size = request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if chunk_size < 1:
+        return jsonify({"error": "'chunk_size' must be positive"}), 400
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    return jsonify(_import_catalog(stream, fmt, chunk_size))
+
+@app.route("/admin/products/export", methods=["GET"])
+@admin_required
+def export_products():
+    """Streams the whole catalog as NDJSON (default) or CSV, in the import feed's format."""
+    try:
+        fmt = _feed_format('ndjson')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_feed(_catalog_rows(), fmt)), mimetype=mimetype)
+
+def _open_feed(path, mode):
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(path, mode, encoding='utf-8', newline='')
+
+def _format_for(path, fmt):
+    return fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Returns the search cache's hit/miss counters and its backend's stats."""
+    return jsonify(search_cache.stats())
+
+@app.route("/replicas/stats", methods=["GET"])
+def replica_stats():
+    """Returns each read replica's health, lag and share of the reads."""
+    return jsonify(replicas.stats())
+
+@app.cli.command("import-products")
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help="default: from the file extension")
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True)
+def import_products_command(path, fmt, chunk_size):
+    """Upserts products from a CSV or NDJSON file (- for stdin)."""
+    with _open_feed(path, 'r') as feed:
+        summary = _import_catalog(feed, _format_for(path, fmt), chunk_size)
+    print(f"Imported {summary['written']} of {summary['rows']} rows ({summary['rejected']} rejected) "
+          f"in {summary['seconds']}s, {summary['rows_per_second']} rows/s.")
+    for error in summary['errors']:
+        print(f"  line {error['line']}: {error['error']}")
+
+@app.cli.command("export-products")
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help="default: from the file extension")
+def export_products_command(path, fmt):
+    """Writes the whole catalog to a CSV or NDJSON file (- for stdout)."""
+    with _open_feed(path, 'w') as out:
+        for block in export_feed(_catalog_rows(), _format_for(path, fmt)):
+            out.write(block)
+
+# --- Schema migrations ---
+def _upgrade_schema():
+    applied = upgrade_schema(db.engine, "product_service", MIGRATIONS, db.metadata)
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+
+@app.cli.command("db-upgrade")
+def db_upgrade_command():
+    """Applies any pending schema migrations."""
+    _upgrade_schema()
 
 # A command to initialize the database and seed it with data
 @app.cli.command("init-db")
 def init_db_command():
-    """Creates the database tables and seeds them with initial data."""
-    db.create_all()
+    """Migrates the database schema and seeds it with initial data."""
+    _upgrade_schema()
     # Seed with some initial products if the table is empty
     if Product.query.count() == 0:
         db.session.add(Product(id=101, name="Wireless Mouse", price=24.99, stock=150))
@@ -0,0 +1,186 @@
+# product_service/catalog_io.py
+
+import csv
+import io
+import json
+import time
+from itertools import islice
+
+from sqlalchemy import BigInteger, Column, Float, Integer, MetaData, String, Table, case, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Columns a feed may carry. `stock` is optional: rows without it keep their
+# current stock (new products start at 0), so a catalog feed doesn't undo
+# reservations made since it was generated.
+FEED_COLUMNS = ('id', 'name', 'price', 'stock')
+# Rows sent to the staging table per COPY / INSERT round trip
+DEFAULT_CHUNK_SIZE = 10000
+# Rejected rows reported back individually; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+# Per-connection scratch table the feed is loaded into before the upsert.
+# `line` keeps feed order so the last occurrence of a repeated id wins.
+_staging_metadata = MetaData()
+staging = Table(
+    'product_staging', _staging_metadata,
+    Column('line', Integer, primary_key=True, autoincrement=True),
+    Column('id', Integer, nullable=False),
+    Column('name', String(100), nullable=False),
+    Column('price', Float, nullable=False),
+    Column('stock', Integer),
+    prefixes=['TEMPORARY'],
+)
+
+
+def read_feed(stream, fmt):
+    """
+    Yields (line_number, record) pairs from a CSV (with a header row) or
+    NDJSON text stream, one line at a time.
+    """
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=2):
+            yield number, row
+    elif fmt == 'ndjson':
+        for number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def validate(record):
+    """Returns the record as an (id, name, price, stock) tuple, or raises ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    try:
+        product_id = int(record['id'])
+        name = str(record['name']).strip()
+        price = float(record['price'])
+        stock = record.get('stock')
+        stock = None if stock in (None, '') else int(stock)
+    except KeyError as e:
+        raise ValueError(f"missing '{e.args[0]}'")
+    except (TypeError, ValueError):
+        raise ValueError("id, price and stock must be numbers")
+    if product_id < 1 or price < 0 or (stock is not None and stock < 0):
+        raise ValueError("id must be positive and price and stock non-negative")
+    if not name or len(name) > 100:
+        raise ValueError("name must be 1 to 100 characters")
+    return product_id, name, price, stock
+
+
+def _copy_chunk(conn, rows):
+    """Streams a chunk into the staging table with Postgres COPY."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # An unquoted empty field is NULL in COPY's CSV format.
+        writer.writerow(['' if value is None else value for value in row])
+    buffer.seek(0)
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert("COPY product_staging (id, name, price, stock) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _insert_chunk(conn, rows):
+    conn.execute(staging.insert(), [dict(zip(FEED_COLUMNS, row)) for row in rows])
+
+
+def _upsert(conn, product, change_seq):
+    """
+    Moves the staged rows into the product table with one INSERT ... ON CONFLICT.
+    Rows identical to the current ones are left alone so their ETags survive;
+    changed rows all get the same change_seq. Returns the number of rows written.
+    """
+    latest = select(func.max(staging.c.line)).group_by(staging.c.id)
+    rows = (select(staging.c.id, staging.c.name, staging.c.price,
+                   func.coalesce(staging.c.stock, product.c.stock, 0), literal(1), literal(change_seq, BigInteger))
+            .select_from(staging.outerjoin(product, product.c.id == staging.c.id))
+            .where(staging.c.line.in_(latest)))
+    dialect = postgresql if conn.dialect.name == 'postgresql' else sqlite
+    insert = dialect.insert(product).from_select(['id', 'name', 'price', 'stock', 'version', 'change_seq'], rows)
+    new = insert.excluded
+    catalog_changed = (product.c.name != new.name) | (product.c.price != new.price)
+    upsert = insert.on_conflict_do_update(
+        index_elements=[product.c.id],
+        set_={
+            'name': new.name,
+            'price': new.price,
+            'stock': new.stock,
+            'version': product.c.version + case((catalog_changed, 1), else_=0),
+            'change_seq': change_seq,
+        },
+        where=catalog_changed | (product.c.stock != new.stock),
+    )
+    return conn.execute(upsert).rowcount
+
+
+def import_feed(conn, product, records, next_change_seq, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Loads (line_number, record) pairs into the product table in one
+    transaction on `conn`: valid rows are staged chunk by chunk (COPY on
+    Postgres), then upserted with a single set-based statement. Invalid rows
+    are skipped and reported. Returns a summary including rows per second.
+
+    Every row the import changes gets the same change number, evaluated from
+    the `next_change_seq` SQL expression only once staging is done, so it is
+    as close to the commit as possible and the catalog version moves once.
+    """
+    start = time.perf_counter()
+    # A failed import on a driver without transactional DDL may leave it behind.
+    staging.create(conn, checkfirst=True)
+    conn.execute(staging.delete())
+    load_chunk = _copy_chunk if conn.dialect.name == 'postgresql' else _insert_chunk
+    staged, errors, rejected = 0, [], 0
+    records = iter(records)
+    while True:
+        batch = list(islice(records, chunk_size))
+        if not batch:
+            break
+        chunk = []
+        for number, record in batch:
+            try:
+                chunk.append(validate(record))
+            except ValueError as e:
+                rejected += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': number, 'error': str(e)})
+        if chunk:
+            load_chunk(conn, chunk)
+            staged += len(chunk)
+    change_seq = conn.execute(select(next_change_seq)).scalar() if staged else None
+    written = _upsert(conn, product, change_seq) if staged else 0
+    staging.drop(conn)
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': staged + rejected,
+        'staged': staged,
+        'written': written,
+        'rejected': rejected,
+        'errors': errors,
+        'change_seq': change_seq if written else None,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round((staged + rejected) / elapsed, 1) if elapsed else None,
+    }
+
+
+def export_feed(rows, fmt):
+    """Yields the given (id, name, price, stock) rows as CSV (in blocks of about 64 KiB) or NDJSON text."""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(FEED_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() > 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    elif fmt == 'ndjson':
+        for row in rows:
+            yield json.dumps(dict(zip(FEED_COLUMNS, row))) + "\n"
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
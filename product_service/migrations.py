@@ -0,0 +1,66 @@
+# product_service/migrations.py
+
+from sqlalchemy import text
+
+from shared.migrations import Migration, add_column, create_index, create_sequence, create_tables, drop_index
+
+
+def _product_version(conn, metadata):
+    add_column(conn, metadata.tables['product'].c.version)
+
+
+def _catalog_indexes(conn, metadata):
+    create_index(conn, metadata, 'product', 'ix_product_name_lower')
+    create_index(conn, metadata, 'product', 'ix_product_price')
+
+
+def _change_seq(conn, metadata):
+    create_sequence(conn, metadata, 'product_change_seq')
+    add_column(conn, metadata.tables['product'].c.change_seq)
+
+
+def _backfill_change_seq(conn, metadata):
+    """
+    Gives rows still at the column default (change_seq 0) a real change
+    number, so the change feed (which reads change_seq > since) returns them
+    to a consumer starting from 0.
+    """
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("UPDATE product SET change_seq = nextval('product_change_seq') WHERE change_seq = 0"))
+        return
+    # Without sequences the next number is max + 1, so numbering above the
+    # current maximum by id keeps every row distinct.
+    base = conn.execute(text("SELECT COALESCE(MAX(change_seq), 0) FROM product")).scalar()
+    conn.execute(text("UPDATE product SET change_seq = :base + id WHERE change_seq = 0"), {'base': base})
+
+
+def _search_indexes(conn, metadata):
+    # Other databases search with the in-memory index instead.
+    if conn.dialect.name != 'postgresql':
+        return
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    create_index(conn, metadata, 'product', 'ix_product_name_fts')
+    create_index(conn, metadata, 'product', 'ix_product_name_trgm')
+
+
+def _change_feed_index(conn, metadata):
+    create_index(conn, metadata, 'product', 'ix_product_change_seq_id')
+
+
+def _drop_change_seq_index(conn, metadata):
+    # ix_product_change_seq_id serves the same lookups; this one only slowed stock updates.
+    drop_index(conn, 'ix_product_change_seq')
+
+
+# Applied in order by `flask db-upgrade` (and by `flask init-db`).
+MIGRATIONS = [
+    Migration(1, 'create tables', create_tables),
+    Migration(2, 'add product.version for cache revalidation', _product_version),
+    Migration(3, 'add catalog filter indexes', _catalog_indexes),
+    Migration(4, 'add product.change_seq for ETags', _change_seq),
+    Migration(5, 'add full-text and trigram indexes for product search', _search_indexes),
+    Migration(6, 'add (change_seq, id) index for the change feed', _change_feed_index),
+    Migration(7, 'add stock_reservation for idempotent reservations', create_tables),
+    Migration(8, 'backfill product.change_seq for rows that predate it', _backfill_change_seq),
+    Migration(9, 'drop the single-column change_seq index', _drop_change_seq_index),
+]
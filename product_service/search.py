@@ -0,0 +1,222 @@
+# product_service/search.py
+
+import bisect
+import math
+import re
+import threading
+
+from sqlalchemy import and_, case, func, literal, select
+
+# Upper bounds of the price facet buckets; the last bucket is open-ended
+PRICE_BUCKETS = (25, 50, 100, 250, 500)
+# Text search configuration: 'simple' lowercases without stemming, which suits product names
+TS_CONFIG = 'simple'
+
+_TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+def price_bucket_labels():
+    edges = (0,) + PRICE_BUCKETS
+    labels = [f"{low}-{high}" for low, high in zip(edges, edges[1:])]
+    return labels + [f"{PRICE_BUCKETS[-1]}+"]
+
+
+def _bucket_index(price):
+    return bisect.bisect_right(PRICE_BUCKETS, price)
+
+
+def _facets(price_counts, in_stock, out_of_stock):
+    return {
+        'price': [{'range': label, 'count': count} for label, count in zip(price_bucket_labels(), price_counts)],
+        'in_stock': {'true': in_stock, 'false': out_of_stock},
+    }
+
+
+def _passes(price, stock, filters):
+    if filters.get('min_price') is not None and price < filters['min_price']:
+        return False
+    if filters.get('max_price') is not None and price > filters['max_price']:
+        return False
+    if filters.get('in_stock') is not None and (stock > 0) != filters['in_stock']:
+        return False
+    return True
+
+
+def database_search(conn, product, query, filters, limit, offset):
+    """
+    Ranked search on Postgres in a single statement: full-text matches
+    (tsvector) and fuzzy matches (trigram similarity) are both served by GIN
+    indexes, facet counts over all matches are window aggregates in an inner
+    query, and the filters, ordering and page are applied outside it.
+    """
+    document = func.to_tsvector(TS_CONFIG, product.c.name)
+    tsquery = func.websearch_to_tsquery(TS_CONFIG, query)
+    rank = func.ts_rank(document, tsquery) + func.similarity(product.c.name, query)
+
+    in_bucket = []
+    edges = (0,) + PRICE_BUCKETS
+    for low, high in zip(edges, edges[1:]):
+        in_bucket.append(and_(product.c.price >= low, product.c.price < high))
+    in_bucket.append(product.c.price >= PRICE_BUCKETS[-1])
+    window = [func.sum(case((condition, 1), else_=0)).over().label(f'bucket_{i}')
+              for i, condition in enumerate(in_bucket)]
+    window.append(func.sum(case((product.c.stock > 0, 1), else_=0)).over().label('in_stock_count'))
+    window.append(func.count().over().label('match_count'))
+
+    matches = (select(product.c.id, product.c.name, product.c.price, product.c.stock, rank.label('score'), *window)
+               .where(document.op('@@')(tsquery) | product.c.name.op('%')(query))
+               .subquery('matches'))
+    conditions = []
+    if filters.get('min_price') is not None:
+        conditions.append(matches.c.price >= filters['min_price'])
+    if filters.get('max_price') is not None:
+        conditions.append(matches.c.price <= filters['max_price'])
+    if filters.get('in_stock') is not None:
+        conditions.append((matches.c.stock > 0) == literal(filters['in_stock']))
+    page = (select(matches, func.count().over().label('total'))
+            .where(*conditions)
+            .order_by(matches.c.score.desc(), matches.c.id)
+            .limit(limit).offset(offset))
+
+    rows = conn.execute(page).mappings().all()
+    if not rows:
+        # Past the last page (or no hits): count the facets and hits on their own.
+        facet_columns = [matches.c[f'bucket_{i}'] for i in range(len(in_bucket))]
+        facet_columns += [matches.c.in_stock_count, matches.c.match_count]
+        values = [int(v) for v in conn.execute(
+            select(*[func.coalesce(func.max(column), 0) for column in facet_columns])).one()]
+        total = conn.execute(select(func.count()).select_from(matches).where(*conditions)).scalar()
+        return total, [], _facets(values[:-2], values[-2], values[-1] - values[-2])
+    first = rows[0]
+    results = [{'id': r['id'], 'name': r['name'], 'price': r['price'], 'stock': r['stock'],
+                'score': round(float(r['score']), 4)} for r in rows]
+    price_counts = [int(first[f'bucket_{i}']) for i in range(len(in_bucket))]
+    in_stock = int(first['in_stock_count'])
+    return int(first['total']), results, _facets(price_counts, in_stock, int(first['match_count']) - in_stock)
+
+
+class InvertedIndex:
+    """
+    In-process search index for databases without full-text indexes (SQLite
+    in development).
+
+    It maps name tokens to product ids and keeps each product's name, price
+    and stock for ranking, filtering and facets. It is built when the service
+    starts and then kept current incrementally: every product write stamps
+    the row's change_seq, so each search first applies just the rows changed
+    since the last one it saw, which also picks up writes made by other
+    workers. Deleted rows leave no change behind; they are noticed when the
+    table holds fewer rows than the index, and evicted.
+    """
+
+    def __init__(self):
+        self._postings = {}    # token -> set of product ids
+        self._tokens = []      # sorted distinct tokens, for prefix matching
+        self._tokens_stale = False
+        self._docs = {}        # product id -> (name, price, stock, tokens)
+        self._last_seq = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def refresh(self, conn, product):
+        """Applies all product rows changed since the last refresh."""
+        with self._lock:
+            query = select(product.c.id, product.c.name, product.c.price, product.c.stock, product.c.change_seq)
+            if self._last_seq is not None:
+                query = query.where(product.c.change_seq > self._last_seq)
+            for product_id, name, price, stock, change_seq in conn.execute(query):
+                self._put(product_id, name, price, stock)
+                if self._last_seq is None or change_seq > self._last_seq:
+                    self._last_seq = change_seq
+            if self._last_seq is None:
+                self._last_seq = 0
+            if conn.execute(select(func.count()).select_from(product)).scalar() < len(self._docs):
+                present = set(conn.execute(select(product.c.id)).scalars())
+                for product_id in [pid for pid in self._docs if pid not in present]:
+                    self._remove(product_id)
+
+    def _put(self, product_id, name, price, stock):
+        old = self._docs.get(product_id)
+        tokens = frozenset(tokenize(name))
+        if old is not None:
+            for token in old[3] - tokens:
+                ids = self._postings[token]
+                ids.discard(product_id)
+                if not ids:
+                    del self._postings[token]
+                    self._tokens_stale = True
+        for token in tokens:
+            ids = self._postings.get(token)
+            if ids is None:
+                ids = self._postings[token] = set()
+                self._tokens_stale = True
+            ids.add(product_id)
+        self._docs[product_id] = (name, price, stock, tokens)
+
+    def _remove(self, product_id):
+        for token in self._docs.pop(product_id)[3]:
+            ids = self._postings[token]
+            ids.discard(product_id)
+            if not ids:
+                del self._postings[token]
+                self._tokens_stale = True
+
+    def _expand(self, term):
+        """The indexed tokens a query term matches: itself, or tokens it is a prefix of."""
+        if self._tokens_stale:
+            # Re-sorted once per batch of new tokens rather than on every insert.
+            self._tokens = sorted(self._postings)
+            self._tokens_stale = False
+        start = bisect.bisect_left(self._tokens, term)
+        end = bisect.bisect_left(self._tokens, term + '\uffff')
+        return self._tokens[start:end]
+
+    def search(self, query, filters, limit, offset):
+        """
+        Every query term must match a name token exactly or as a prefix;
+        matches are ranked by the summed IDF of the matched tokens, with exact
+        matches counting double. Facets cover all matches, before filtering.
+        """
+        terms = tokenize(query)
+        with self._lock:
+            if not terms:
+                return 0, [], _facets([0] * (len(PRICE_BUCKETS) + 1), 0, 0)
+            total_docs = len(self._docs) or 1
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for token in self._expand(term):
+                    ids = self._postings[token]
+                    weight = math.log(1 + total_docs / len(ids)) * (2 if token == term else 1)
+                    for product_id in ids:
+                        if weight > term_scores.get(product_id, 0):
+                            term_scores[product_id] = weight
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: score + term_scores[pid] for pid, score in scores.items() if pid in term_scores}
+                if not scores:
+                    break
+
+            price_counts = [0] * (len(PRICE_BUCKETS) + 1)
+            in_stock = 0
+            hits = []
+            for product_id, score in (scores or {}).items():
+                name, price, stock, _ = self._docs[product_id]
+                price_counts[_bucket_index(price)] += 1
+                in_stock += stock > 0
+                if _passes(price, stock, filters):
+                    hits.append((-score, product_id))
+            hits.sort()
+            results = []
+            for negative_score, product_id in hits[offset:offset + limit]:
+                name, price, stock, _ = self._docs[product_id]
+                results.append({'id': product_id, 'name': name, 'price': price, 'stock': stock,
+                                'score': round(-negative_score, 4)})
+            return len(hits), results, _facets(price_counts, in_stock, len(scores or {}) - in_stock)
@@ -0,0 +1,2 @@
+# shared/__init__.py
+"""Code shared by the services. Each service image copies this package next to its app.py."""
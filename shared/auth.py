@@ -0,0 +1,162 @@
+# shared/auth.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import jwt
+
+from shared.cache import LRUCache
+from shared.metrics import record_timing
+
+# Key id used for SECRET_KEY and for tokens issued without a `kid` header
+DEFAULT_KID = 'default'
+
+logger = logging.getLogger(__name__)
+
+
+class KeyRing:
+    """
+    The set of active JWT signing keys, addressed by key id (`kid`).
+
+    Several keys can be active at once so tokens signed with the previous key
+    keep verifying while new tokens are signed with the current one. When
+    `path` is set, the keys are reloaded from that JSON file whenever it
+    changes (checked at most every `reload_interval` seconds), so keys can be
+    rotated without restarting the services. The file looks like:
+
+        {"signing_kid": "2024-06", "keys": {"2024-05": "old-secret", "2024-06": "new-secret"},
+         "retired": ["2024-04"]}
+
+    Keys listed under "retired" stop verifying as soon as the file is reloaded.
+    A file that can't be read or parsed (e.g. one caught half-written) is
+    logged and skipped; the previous keys stay active until it is fixed.
+    """
+
+    def __init__(self, keys, signing_kid=DEFAULT_KID, path=None, reload_interval=5.0):
+        self._keys = dict(keys)
+        self._signing_kid = signing_kid
+        self._path = path
+        self._reload_interval = reload_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if path:
+            self._reload()
+
+    @classmethod
+    def from_env(cls, secret_key=None):
+        """
+        Builds a key ring from the environment: JWT_KEYS (a JSON object of
+        kid -> secret), JWT_SIGNING_KID and JWT_KEYS_FILE. `secret_key`, usually
+        the service's SECRET_KEY, is always active under the 'default' kid so
+        tokens issued before key ids were introduced keep working.
+        """
+        keys = json.loads(os.environ.get('JWT_KEYS', '{}'))
+        if secret_key:
+            keys.setdefault(DEFAULT_KID, secret_key)
+        signing_kid = os.environ.get('JWT_SIGNING_KID', DEFAULT_KID)
+        return cls(keys, signing_kid, path=os.environ.get('JWT_KEYS_FILE'))
+
+    def _reload(self):
+        """Re-reads the key file if it changed since the last load."""
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self._path) as f:
+                config = json.load(f)
+            if not isinstance(config, dict):
+                raise ValueError("expected a JSON object")
+            keys = dict(config.get('keys', {}))
+            retired = list(config.get('retired', []))
+            signing_kid = config.get('signing_kid', self._signing_kid)
+        except (ValueError, TypeError, OSError) as e:
+            logger.error("Could not load JWT keys from %s, keeping the current keys: %s", self._path, e)
+            return
+        self._keys.update(keys)
+        for kid in retired:
+            self._keys.pop(kid, None)
+        self._signing_kid = signing_kid
+        self._mtime = mtime
+
+    def _maybe_reload(self):
+        if not self._path:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self._reload_interval:
+            return
+        with self._lock:
+            if now - self._checked_at >= self._reload_interval:
+                self._checked_at = now
+                self._reload()
+
+    def get(self, kid):
+        """Returns the secret for a key id, or None if that key is not active."""
+        self._maybe_reload()
+        return self._keys.get(kid or DEFAULT_KID)
+
+    def signing_key(self):
+        """Returns the (kid, secret) pair new tokens should be signed with."""
+        self._maybe_reload()
+        return self._signing_kid, self._keys[self._signing_kid]
+
+    def issue_token(self, claims, algorithm='HS256'):
+        """Signs the claims with the current signing key, recording its kid in the header."""
+        kid, secret = self.signing_key()
+        return jwt.encode(claims, secret, algorithm=algorithm, headers={'kid': kid})
+
+
+class TokenVerifier:
+    """
+    Verifies JWTs against a KeyRing and remembers tokens it has already
+    verified.
+
+    The cache is keyed by a SHA-256 digest of the token, so raw tokens are not
+    kept in memory, and each entry expires at the token's own `exp`, so a
+    cached token is never accepted after it would have failed verification.
+    A cached entry is also dropped if the key that signed it was retired.
+    Pass cache_size=0 to disable caching.
+    """
+
+    def __init__(self, keyring, algorithms=('HS256',), cache_size=4096):
+        self.keyring = keyring
+        self.algorithms = list(algorithms)
+        self.cache = LRUCache(max_size=cache_size, ttl=0) if cache_size else None
+
+    def verify(self, token):
+        """Returns the token's claims, or raises jwt.InvalidTokenError."""
+        start = time.perf_counter()
+        try:
+            return self._verify(token)
+        finally:
+            record_timing('auth', time.perf_counter() - start)
+
+    def _verify(self, token):
+        digest = None
+        if self.cache is not None:
+            digest = hashlib.sha256(token.encode()).digest()
+            cached = self.cache.get(digest)
+            if cached is not None:
+                kid, claims = cached
+                if self.keyring.get(kid) is not None:
+                    return claims
+                self.cache.invalidate(digest)
+
+        kid = jwt.get_unverified_header(token).get('kid')
+        secret = self.keyring.get(kid)
+        if secret is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+        claims = jwt.decode(token, secret, algorithms=self.algorithms, options={'require': ['exp']})
+
+        if self.cache is not None:
+            ttl = claims['exp'] - time.time()
+            if ttl > 0:
+                self.cache.set(digest, (kid, claims), ttl=ttl)
+        return claims
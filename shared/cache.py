@@ -0,0 +1,504 @@
+# shared/cache.py
+
+import concurrent.futures
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded cache with least-recently-used eviction and a
+    per-entry time-to-live.
+
+    Expired entries are not dropped straight away: get() treats them as misses,
+    but get_stale() still returns them so the caller can revalidate an entry
+    (e.g. by comparing versions) and refresh() it instead of fetching it again.
+    """
+
+    def __init__(self, max_size=1024, ttl=30.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    def get(self, key):
+        """Returns the cached value if it is present and fresh, otherwise None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_stale(self, key):
+        """Returns the cached value even if it has expired, without touching the counters."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value with a fresh TTL (the cache-wide one unless `ttl` is given),
+        evicting the least recently used entries if full.
+        """
+        with self._lock:
+            self._entries[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def refresh(self, key, ttl=None):
+        """Restarts the TTL of an entry that was revalidated as unchanged."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (self._clock() + (self.ttl if ttl is None else ttl), entry[1])
+                self._entries.move_to_end(key)
+                self.revalidations += 1
+
+    def invalidate(self, key):
+        """Drops a single entry."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drops every entry; the counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit/miss/eviction counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'revalidations': self.revalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# --- Shared cache tier ---
+# A key/value store that the gunicorn workers of a service (and other
+# services) share, so hit rates don't fall as workers are added.
+
+class MemoryBackend:
+    """
+    An in-process backend, for when no shared cache server is configured.
+    Entries are shared by the threads of one process only.
+    """
+
+    shared = False
+
+    def __init__(self, max_size=4096, clock=time.monotonic):
+        self._cache = LRUCache(max_size=max_size, ttl=0, clock=clock)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl=ttl)
+
+    def add(self, key, value, ttl):
+        """Stores the value only if the key is absent; returns whether it did."""
+        with self._lock:
+            if self._cache.get(key) is not None:
+                return False
+            self._cache.set(key, value, ttl=ttl)
+            return True
+
+    def delete(self, key):
+        self._cache.invalidate(key)
+
+    def stats(self):
+        return {'type': 'memory', **self._cache.stats()}
+
+
+class RedisBackend:
+    """
+    A backend on a Redis-compatible server (Redis, Valkey, KeyDB, ...), shared
+    by every process that connects to it.
+
+    The cache is an optimisation, so a failing server is treated as empty:
+    calls return misses for `retry_after` seconds, then try the server again,
+    instead of making every request wait for a timeout.
+    """
+
+    shared = True
+
+    def __init__(self, url, timeout=0.25, retry_after=5.0):
+        import redis  # only needed by services configured with a CACHE_URL
+        self._redis = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._error = redis.RedisError
+        self.url = url
+        self.retry_after = retry_after
+        self.errors = 0
+        self._down_until = 0.0
+
+    def _call(self, method, *args, default=None, **kwargs):
+        return self._guarded(getattr(self._redis, method), *args, default=default, **kwargs)
+
+    def _guarded(self, fn, *args, default=None, **kwargs):
+        if time.monotonic() < self._down_until:
+            return default
+        try:
+            return fn(*args, **kwargs)
+        except self._error:
+            self.errors += 1
+            self._down_until = time.monotonic() + self.retry_after
+            logger.warning("Cache server %s failed; bypassing it for %.0fs", self.url, self.retry_after,
+                           exc_info=True)
+            return default
+
+    def get(self, key):
+        value = self._call('get', key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._call('set', key, value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key, value, ttl):
+        """Stores the value only if the key is absent; returns whether it did (True if the server is down)."""
+        return bool(self._call('set', key, value, px=max(1, int(ttl * 1000)), nx=True, default=True))
+
+    def delete(self, key):
+        self._call('delete', key)
+
+    def script(self, source):
+        """
+        Registers a Lua script and returns a function running it atomically on
+        the server: run(keys, args, default=None). Like the other calls it
+        returns `default` while the server is failing.
+        """
+        script = self._redis.register_script(source)
+
+        def run(keys, args, default=None):
+            return self._guarded(script, keys=keys, args=args, default=default)
+        return run
+
+    def stats(self):
+        return {'type': 'redis', 'errors': self.errors, 'available': time.monotonic() >= self._down_until}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend_from_env():
+    """
+    Returns this process's cache backend: the Redis-compatible server at
+    CACHE_URL (redis://host:port/db) if set, otherwise an in-process one
+    holding up to CACHE_MEMORY_SIZE entries. All caches in a process share it.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            url = os.environ.get('CACHE_URL')
+            if url:
+                _backend = RedisBackend(url, timeout=float(os.environ.get('CACHE_TIMEOUT', 0.25)))
+            else:
+                _backend = MemoryBackend(int(os.environ.get('CACHE_MEMORY_SIZE', 4096)))
+        return _backend
+
+
+class SharedCache:
+    """
+    One namespace of a cache backend, holding JSON-serialisable values.
+
+    Entries are fresh for `ttl` seconds and then stale for `stale_ttl` more
+    before the backend drops them. get() only returns fresh values;
+    get_stale() returns either, for callers that revalidate entries themselves.
+
+    get_or_load() fills misses with `loader()`. Concurrent misses for a key
+    are coalesced into one load: within a process the other threads wait for
+    it, and across processes a short-lived lock key in the backend makes the
+    others poll for its result. A stale entry is returned straight away while
+    one background load refreshes it (stale-while-revalidate); background
+    loads run inside `context()`, if given, e.g. app.app_context.
+    load_many() coalesces a batch of misses the same way.
+    """
+
+    POLL_INTERVAL = 0.01
+    REFRESH_WORKERS = 4
+
+    def __init__(self, backend, namespace, ttl=30.0, stale_ttl=0.0, lock_timeout=5.0, context=None,
+                 clock=time.time):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self._context = context
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._loading = {}        # key -> Future of the load in progress
+        self._refreshing = set()  # keys being refreshed in the background
+        self._refresher = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.revalidations = 0
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def _read(self, key):
+        """Returns the (value, fresh_until) entry for a key, or None."""
+        raw = self.backend.get(self._key(key))
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry['v'], entry['f']
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """Returns the value if it is present and fresh, otherwise None."""
+        entry = self._read(key)
+        if entry is None or entry[1] <= self._clock():
+            self._count('misses')
+            return None
+        self._count('hits')
+        return entry[0]
+
+    def get_stale(self, key):
+        """Returns the value even if it is stale, without touching the counters."""
+        entry = self._read(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value, ttl=None):
+        """Stores a value, fresh for `ttl` seconds (the cache-wide TTL unless given)."""
+        ttl = self.ttl if ttl is None else ttl
+        payload = json.dumps({'v': value, 'f': self._clock() + ttl}, separators=(',', ':'))
+        self.backend.set(self._key(key), payload, ttl + self.stale_ttl)
+
+    def refresh(self, key, ttl=None):
+        """Makes a stale entry that was revalidated as unchanged fresh again."""
+        entry = self._read(key)
+        if entry is not None:
+            self.set(key, entry[0], ttl)
+            self._count('revalidations')
+
+    def invalidate(self, key):
+        """Drops a single entry."""
+        self.backend.delete(self._key(key))
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Returns the value cached under `key`, calling `loader()` to fill a
+        miss. Exceptions from the loader propagate and nothing is cached.
+        """
+        entry = self._read(key)
+        if entry is not None:
+            if entry[1] > self._clock():
+                self._count('hits')
+                return entry[0]
+            self._count('stale_hits')
+            self._revalidate(key, loader, ttl)
+            return entry[0]
+        self._count('misses')
+
+        with self._lock:
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = concurrent.futures.Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            try:
+                return future.result(timeout=self.lock_timeout)
+            except concurrent.futures.TimeoutError:
+                return loader()
+        try:
+            value = self._load(key, loader, ttl)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+
+    def _load(self, key, loader, ttl):
+        lock_key = f"{self.namespace}:lock:{key}"
+        if not self.backend.add(lock_key, '1', self.lock_timeout):
+            # Another process is loading it: wait for its result instead.
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.POLL_INTERVAL)
+                entry = self._read(key)
+                if entry is not None and entry[1] > self._clock():
+                    self._count('coalesced')
+                    return entry[0]
+                if self.backend.get(lock_key) is None:
+                    break  # its load failed
+            return self._store(key, loader(), ttl)
+        try:
+            return self._store(key, loader(), ttl)
+        finally:
+            self.backend.delete(lock_key)
+
+    def load_many(self, keys, loader, ttl=None):
+        """
+        Batch form of the miss path of get_or_load(), for callers that look up
+        several keys at once and handle fresh and stale entries themselves:
+        fills `keys` with one `loader(keys)` call, which returns a dict of the
+        values it found. Keys another thread or process is already loading
+        are waited for instead of being loaded again. Keys the loader doesn't
+        return are left out of the result and not cached.
+        """
+        results, mine, waiting = {}, {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._loading.get(key)
+                if future is None:
+                    mine[key] = self._loading[key] = concurrent.futures.Future()
+                else:
+                    waiting[key] = future
+                    self.coalesced += 1
+        try:
+            if mine:
+                results.update(self._load_many(list(mine), loader, ttl))
+        except BaseException as e:
+            for future in mine.values():
+                future.set_exception(e)
+            raise
+        else:
+            for key, future in mine.items():
+                future.set_result(results.get(key))
+        finally:
+            with self._lock:
+                for key in mine:
+                    self._loading.pop(key, None)
+
+        if waiting:
+            done, late = concurrent.futures.wait(waiting.values(), timeout=self.lock_timeout)
+            retry = []
+            for key, future in waiting.items():
+                if future in done and future.exception() is None:
+                    if future.result() is not None:
+                        results[key] = future.result()
+                else:
+                    retry.append(key)  # that load failed or is stuck: load it here
+            if retry:
+                results.update(self._store_many(loader(retry), ttl))
+        return results
+
+    def _load_many(self, keys, loader, ttl):
+        locks = {key: f"{self.namespace}:lock:{key}" for key in keys}
+        mine = [key for key in keys if self.backend.add(locks[key], '1', self.lock_timeout)]
+        try:
+            results = self._store_many(loader(mine), ttl) if mine else {}
+        finally:
+            for key in mine:
+                self.backend.delete(locks[key])
+
+        # Other processes are loading the rest: wait for their results.
+        pending = [key for key in keys if key not in results and key not in mine]
+        leftover = []
+        deadline = time.monotonic() + self.lock_timeout
+        while pending and time.monotonic() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            for key in list(pending):
+                entry = self._read(key)
+                if entry is not None and entry[1] > self._clock():
+                    self._count('coalesced')
+                    results[key] = entry[0]
+                    pending.remove(key)
+                elif self.backend.get(locks[key]) is None:
+                    leftover.append(key)  # its load failed or didn't find it
+                    pending.remove(key)
+        leftover += pending
+        if leftover:
+            results.update(self._store_many(loader(leftover), ttl))
+        return results
+
+    def _store_many(self, values, ttl):
+        for key, value in values.items():
+            self._store(key, value, ttl)
+        return values
+
+    def _store(self, key, value, ttl):
+        self._count('loads')
+        self.set(key, value, ttl)
+        return value
+
+    def _revalidate(self, key, loader, ttl):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._refresher is None:
+                self._refresher = concurrent.futures.ThreadPoolExecutor(
+                    self.REFRESH_WORKERS, thread_name_prefix=f"cache-{self.namespace}")
+        self._refresher.submit(self._refresh, key, loader, ttl)
+
+    def _refresh(self, key, loader, ttl):
+        lock_key = f"{self.namespace}:lock:{key}"
+        try:
+            if not self.backend.add(lock_key, '1', self.lock_timeout):
+                return  # another process is refreshing it
+            try:
+                with self._context() if self._context is not None else contextlib.nullcontext():
+                    value = loader()
+                self.set(key, value, ttl)
+                self._count('refreshes')
+            except Exception:
+                self._count('refresh_errors')
+                logger.warning("Refreshing %s failed; the stale value is served until it expires",
+                               self._key(key), exc_info=True)
+            finally:
+                self.backend.delete(lock_key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        """Returns the hit/miss/load counters, the hit ratio and the backend's stats."""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            stats = {
+                'namespace': self.namespace,
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'loads': self.loads,
+                'coalesced': self.coalesced,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'revalidations': self.revalidations,
+                'hit_ratio': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            }
+        stats['backend'] = self.backend.stats()
+        return stats
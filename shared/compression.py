@@ -0,0 +1,65 @@
+# shared/compression.py
+
+import gzip
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone is used when brotli isn't installed
+    brotli = None
+
+# Bodies smaller than this are sent as-is; compressing them costs more than it saves
+DEFAULT_MIN_SIZE = 1024
+
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=6)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=5)
+
+
+def _codecs():
+    """The available encodings, most preferred first."""
+    codecs = [('gzip', _gzip)]
+    if brotli is not None:
+        codecs.insert(0, ('br', _brotli))
+    return codecs
+
+
+def init_compression(app, min_size=None):
+    """
+    Compresses the app's buffered 200 responses of at least `min_size` bytes
+    (COMPRESS_MIN_SIZE, default 1 KiB) with brotli or gzip, whichever the
+    client accepts, preferring brotli when it is installed.
+
+    A strong ETag has to change with the encoding, so the encoding is appended
+    to it ("<tag>-gzip"); views that answer conditional requests should accept
+    those variants too. Streamed responses are left alone.
+    """
+    if min_size is None:
+        min_size = int(os.environ.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE))
+    codecs = _codecs()
+
+    @app.after_request
+    def compress(response):
+        if (response.status_code != 200 or response.direct_passthrough
+                or response.is_streamed or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        accepted = request.accept_encodings
+        encoding, encode = next(((name, fn) for name, fn in codecs if accepted[name]), (None, None))
+        if encoding is None or response.content_length is None or response.content_length < min_size:
+            return response
+
+        response.set_data(encode(response.get_data()))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak=weak)
+        return response
+
+    return app
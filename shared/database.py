@@ -0,0 +1,280 @@
+# shared/database.py
+
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from functools import partial, wraps
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from shared.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def _env_flag(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options_from_env(database_url):
+    """
+    Returns SQLALCHEMY_ENGINE_OPTIONS for a service, read from its DB_POOL_*
+    environment variables.
+
+    Every service shares one Postgres, so the pool sizes should be set per
+    service such that the sum of (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW) times
+    the number of worker processes stays below the server's max_connections.
+    """
+    options = {
+        # Checks connections on checkout so a restarted database doesn't surface as request errors
+        'pool_pre_ping': _env_flag('DB_POOL_PRE_PING', True),
+        # Replaces connections before server- or proxy-side idle timeouts close them
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    if database_url and not database_url.startswith('sqlite'):
+        options.update({
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 5)),
+            'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        })
+    return options
+
+
+def pool_capacity_from_env():
+    """Connections one process's pool hands out at most: DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW."""
+    return int(os.environ.get('DB_POOL_SIZE', 5)) + int(os.environ.get('DB_POOL_MAX_OVERFLOW', 5))
+
+
+# --- Read replicas ---
+# The replica engine reads in the current request should use, if any
+_replica = contextvars.ContextVar('replica', default=None)
+
+# Seconds of replication delay on a Postgres standby; 0 on a primary or a
+# standby that has replayed everything it received, so an idle standby
+# doesn't look late just because nothing was written recently.
+_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+def replica_binds_from_env():
+    """
+    Returns SQLALCHEMY_BINDS entries ('replica_0', 'replica_1', ...) for the
+    comma-separated DATABASE_REPLICA_URLS. Registering replicas as binds lets
+    Flask-SQLAlchemy create and dispose of their engines with the primary's.
+    """
+    urls = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    return {f'replica_{i}': url for i, url in enumerate(urls)}
+
+
+class RoutingSession(Session):
+    """
+    A Flask-SQLAlchemy session that sends plain SELECTs to the replica chosen
+    for the current request (see ReplicaRouter.reads). Flushes, DML and
+    anything else run outside such a block go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = _replica.get()
+        if (replica is not None and bind is None and not self._flushing
+                and clause is not None and getattr(clause, 'is_select', False)):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class Replica:
+    def __init__(self, name, engine, weight):
+        self.name = name
+        self.engine = engine
+        self.weight = weight
+        self.current = 0          # smooth weighted round-robin state
+        self.healthy = True
+        self.lag = 0.0
+        self.checked_at = None
+        self.reads = 0
+        self.failures = 0
+
+
+class ReplicaRouter:
+    """
+    Routes the reads of read-only endpoints to read replicas.
+
+    Replicas are picked by smooth weighted round-robin among the healthy
+    ones. A replica is checked at most every `check_interval` seconds, when
+    it is next picked: it is taken out of rotation while it is unreachable
+    or more than `max_lag` seconds behind the primary, and as soon as a
+    query on it fails to connect. With no healthy replica, reads go to the
+    primary.
+
+    For read-your-writes, callers pin a key (usually the user id) after a
+    write; reads under that key go to the primary for `pin_seconds`, which
+    should exceed the replicas' normal lag. Pins are kept per process.
+    """
+
+    def __init__(self, replicas, session=None, max_lag=5.0, check_interval=5.0, pin_seconds=10.0,
+                 pin_cache_size=10000, clock=time.monotonic):
+        self.replicas = replicas
+        self.session = session
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pins = LRUCache(max_size=pin_cache_size, ttl=pin_seconds, clock=clock)
+        self.primary_reads = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        for replica in replicas:
+            event.listen(replica.engine, 'handle_error', partial(self._on_error, replica))
+
+    @classmethod
+    def from_env(cls, app, db):
+        """
+        Builds a router for the replica binds (see replica_binds_from_env),
+        weighted by the comma-separated DATABASE_REPLICA_WEIGHTS, with
+        REPLICA_MAX_LAG_SECONDS, REPLICA_CHECK_SECONDS and READ_YOUR_WRITES_SECONDS.
+        """
+        env = os.environ.get
+        weights = [int(w) for w in env('DATABASE_REPLICA_WEIGHTS', '').split(',') if w.strip()]
+        with app.app_context():
+            engines = {key: engine for key, engine in db.engines.items() if key and key.startswith('replica_')}
+        replicas = [Replica(key, engines[key], weights[i] if i < len(weights) else 1)
+                    for i, key in enumerate(sorted(engines, key=lambda k: int(k.split('_')[1])))]
+        return cls(replicas, db.session,
+                   max_lag=float(env('REPLICA_MAX_LAG_SECONDS', 5)),
+                   check_interval=float(env('REPLICA_CHECK_SECONDS', 5)),
+                   pin_seconds=float(env('READ_YOUR_WRITES_SECONDS', 10)))
+
+    def _on_error(self, replica, context):
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            with self._lock:
+                replica.healthy = False
+                replica.failures += 1
+                replica.checked_at = self._clock()
+
+    def _check(self, replica):
+        """Measures the replica's lag; unreachable or lagging replicas are marked unhealthy."""
+        try:
+            with replica.engine.connect() as conn:
+                lag = float(conn.execute(_LAG_SQL).scalar()) if conn.dialect.name == 'postgresql' else 0.0
+        except SQLAlchemyError:
+            logger.warning("Read replica %s is unreachable", replica.name, exc_info=True)
+            lag, healthy = None, False
+        else:
+            healthy = lag <= self.max_lag
+            if not healthy:
+                logger.warning("Read replica %s is %.1fs behind; reading from the primary", replica.name, lag)
+        with self._lock:
+            replica.lag = lag
+            replica.healthy = healthy
+
+    def choose(self):
+        """Returns the next healthy replica's engine, or None to read from the primary."""
+        now = self._clock()
+        due = []
+        with self._lock:
+            for replica in self.replicas:
+                if replica.checked_at is None or now - replica.checked_at >= self.check_interval:
+                    replica.checked_at = now  # claim the check so concurrent requests skip it
+                    due.append(replica)
+        for replica in due:
+            self._check(replica)
+
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            if not healthy:
+                self.primary_reads += 1
+                return None
+            total = 0
+            best = None
+            for replica in healthy:
+                replica.current += replica.weight
+                total += replica.weight
+                if best is None or replica.current > best.current:
+                    best = replica
+            best.current -= total
+            best.reads += 1
+            return best.engine
+
+    def pin(self, key):
+        """Sends reads under `key` to the primary for the next pin_seconds."""
+        if self.replicas:
+            self.pins.set(key, True)
+
+    @contextlib.contextmanager
+    def reads(self, key=None):
+        """
+        Within the block, the session's SELECTs go to a replica, unless `key`
+        is pinned. Yields the replica's engine, or None for the primary.
+        """
+        if not self.replicas:
+            yield None
+            return
+        if key is not None and self.pins.get(key) is not None:
+            with self._lock:
+                self.primary_reads += 1
+            yield None
+            return
+        engine = self.choose()
+        token = _replica.set(engine)
+        try:
+            yield engine
+        finally:
+            _replica.reset(token)
+
+    def read_only(self, key=None):
+        """
+        Decorator for read-only views: their SELECTs go to a replica. `key`,
+        if given, is called with the view's arguments and returns the pin key.
+        If the replica fails during the view, the view is retried on the primary.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                engine = None
+                try:
+                    with self.reads(key(*args, **kwargs) if key is not None else None) as engine:
+                        return f(*args, **kwargs)
+                except OperationalError:
+                    if engine is None or self.session is None:
+                        raise
+                # The replica failed mid-request and is now out of rotation;
+                # the view only reads, so it is safe to run again on the primary.
+                self.session.rollback()
+                with self._lock:
+                    self.primary_reads += 1
+                return f(*args, **kwargs)
+            return decorated
+        return decorator
+
+    def pins_after(self, key):
+        """
+        Decorator for views that write: once the view returns, reads under
+        the key (computed like read_only's) are pinned to the primary.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.pin(key(*args, **kwargs))
+            return decorated
+        return decorator
+
+    def connection(self, session):
+        """The session's connection for raw SQL reads: the current replica's, if one was chosen."""
+        replica = _replica.get()
+        return session.connection(bind_arguments={'bind': replica} if replica is not None else None)
+
+    def stats(self):
+        """Returns each replica's health, lag and read count, and the reads that went to the primary."""
+        with self._lock:
+            return {
+                'primary_reads': self.primary_reads,
+                'replicas': {replica.name: {'weight': replica.weight, 'healthy': replica.healthy,
+                                            'lag_seconds': replica.lag, 'reads': replica.reads,
+                                            'failures': replica.failures} for replica in self.replicas},
+            }
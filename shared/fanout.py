@@ -0,0 +1,54 @@
+# shared/fanout.py
+
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from shared.metrics import current_timings
+
+# A call to run concurrently: `fn()` is invoked on a pool thread and the
+# caller stops waiting for it after `deadline` seconds.
+Call = namedtuple('Call', ['fn', 'deadline'])
+# What happened to a call: exactly one of `value` / `error` is set.
+Outcome = namedtuple('Outcome', ['value', 'error'])
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('FANOUT_WORKERS', 16)),
+                               thread_name_prefix='fanout')
+
+
+def _timed_call(timings, fn):
+    """Runs fn on a pool thread, counting its upstream time towards the calling request."""
+    token = current_timings.set(timings)
+    try:
+        return fn()
+    finally:
+        current_timings.reset(token)
+
+
+def fan_out(calls, executor=None):
+    """
+    Runs several independent upstream calls concurrently and returns a dict of
+    name -> Outcome, so a page costs as much as its slowest call rather than
+    the sum of all of them.
+
+    Each call has its own deadline, measured from when fan_out was entered. A
+    call that misses it gets a TimeoutError outcome and the page can render
+    without that part; the call itself is left to finish (or time out at the
+    HTTP layer) in the background. Exceptions raised by a call are returned
+    as its outcome instead of being propagated.
+    """
+    executor = executor or _executor
+    start = time.monotonic()
+    timings = current_timings.get()
+    futures = {name: (executor.submit(_timed_call, timings, call.fn), call.deadline) for name, call in calls.items()}
+    outcomes = {}
+    for name, (future, deadline) in futures.items():
+        remaining = None if deadline is None else max(0.0, deadline - (time.monotonic() - start))
+        try:
+            outcomes[name] = Outcome(future.result(timeout=remaining), None)
+        except TimeoutError:
+            outcomes[name] = Outcome(None, TimeoutError(f"'{name}' missed its {deadline}s deadline"))
+        except Exception as e:
+            outcomes[name] = Outcome(None, e)
+    return outcomes
@@ -0,0 +1,102 @@
+# shared/gunicorn_conf.py
+"""
+gunicorn settings shared by the services, read from the environment:
+
+    gunicorn --config shared/gunicorn_conf.py --bind 0.0.0.0:5001 app:app
+
+GUNICORN_WORKER_CLASS  sync, gthread (default) or gevent
+WEB_CONCURRENCY        worker processes (default: derived from the CPU count, at most 8)
+GUNICORN_THREADS       threads per gthread worker (default 8)
+GUNICORN_CONNECTIONS   concurrent requests per gevent worker (default 100)
+GUNICORN_PRELOAD       import the app once in the master and fork it (default true)
+GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_KEEPALIVE
+GUNICORN_MAX_REQUESTS  recycle a worker after this many requests (default 0: never)
+
+sync workers handle one request at a time, so a worker waiting on an
+upstream or the database is idle; gthread and gevent workers overlap that
+waiting. Per-process connection pools are sized for the chosen concurrency
+unless they are set explicitly.
+"""
+
+import multiprocessing
+import os
+
+_env = os.environ.get
+_cpus = multiprocessing.cpu_count()
+
+worker_class = _env('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class not in ('sync', 'gthread', 'gevent'):
+    raise ValueError(f"Unsupported GUNICORN_WORKER_CLASS: {worker_class}")
+
+if worker_class == 'gevent':
+    # Patch before the app (and requests, threading, ...) is imported, which
+    # with preload happens in the master right after this file is read.
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:  # services without Postgres
+        pass
+    else:
+        patch_psycopg()
+
+# The usual (2 x CPUs) + 1 sync workers; concurrent workers need fewer
+# processes because each one already overlaps I/O. Every worker opens its own
+# database pool, so the default is capped: on a large host the CPU-based
+# count would exhaust Postgres's connections. Set WEB_CONCURRENCY to go higher.
+MAX_DEFAULT_WORKERS = 8
+workers = int(_env('WEB_CONCURRENCY', min(2 * _cpus + 1 if worker_class == 'sync' else _cpus, MAX_DEFAULT_WORKERS)))
+threads = int(_env('GUNICORN_THREADS', 8)) if worker_class == 'gthread' else 1
+worker_connections = int(_env('GUNICORN_CONNECTIONS', 100))
+preload_app = _env('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes', 'on')
+timeout = int(_env('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(_env('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(_env('GUNICORN_KEEPALIVE', 5))
+max_requests = int(_env('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Requests one worker process serves at once
+concurrency = {'sync': 1, 'gthread': threads, 'gevent': worker_connections}[worker_class]
+# Keep-alive connections per upstream client, and threads for concurrent
+# upstream calls (shared.fanout), so neither becomes the bottleneck.
+os.environ.setdefault('UPSTREAM_POOL_SIZE', str(max(10, concurrency)))
+os.environ.setdefault('FANOUT_WORKERS', str(max(16, 2 * concurrency)))
+# The user service's password hashing pool is per worker process; split the
+# CPUs between the workers instead of giving each one a process per CPU.
+os.environ.setdefault('PASSWORD_HASH_WORKERS', str(max(1, _cpus // workers)))
+
+accesslog = _env('GUNICORN_ACCESS_LOG')
+
+
+def when_ready(server):
+    db_connections = int(_env('DB_POOL_SIZE', 5)) + int(_env('DB_POOL_MAX_OVERFLOW', 5))
+    server.log.info("Serving with %d %s worker(s), %d concurrent request(s) each%s",
+                    workers, worker_class, concurrency, ", preloaded" if preload_app else "")
+    if _env('DATABASE_URL'):
+        server.log.info("Up to %d database connections (%d per worker)", workers * db_connections, db_connections)
+    if _env('DATABASE_URL') and db_connections < min(concurrency, 64):
+        server.log.warning("DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW (%d) is below the per-worker concurrency (%d); "
+                           "requests will queue for database connections", db_connections, concurrency)
+
+
+def post_fork(server, worker):
+    """Drops database connections inherited from the master, which must not be shared between processes."""
+    if not preload_app:
+        return
+    app = server.app.wsgi()
+    db = app.extensions.get('sqlalchemy')
+    if db is not None:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    """Removes the exited worker's metrics file, so /metrics stops reporting it straight away."""
+    metrics_dir = _env('METRICS_DIR')
+    if metrics_dir:
+        try:
+            os.remove(os.path.join(metrics_dir, f"{worker.pid}.json"))
+        except OSError:
+            pass
+
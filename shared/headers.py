@@ -0,0 +1,8 @@
+# shared/headers.py
+
+
+def bearer_token(authorization):
+    """Returns the token from an "Authorization: Bearer <token>" header value, or None."""
+    scheme, _, token = (authorization or '').partition(' ')
+    token = token.strip()
+    return token if scheme.lower() == 'bearer' and token else None
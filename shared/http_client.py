@@ -0,0 +1,246 @@
+# shared/http_client.py
+
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared.cache import LRUCache
+from shared.metrics import Histogram, record_timing
+
+# Methods that are safe to send again after a failure
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+# Upstream statuses worth retrying; anything else is handed back to the caller
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+
+def _freshness(response):
+    """
+    Seconds a response may be reused without revalidation according to its
+    Cache-Control header, or None if it must not be stored at all.
+    """
+    directives = [d.strip().lower() for d in response.headers.get('Cache-Control', '').split(',')]
+    if 'no-store' in directives or 'private' in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+    for directive in directives:
+        if directive.startswith('max-age='):
+            try:
+                return max(0, int(directive[len('max-age='):]))
+            except ValueError:
+                return 0
+    return 0
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of calling an upstream whose circuit is open.
+
+    It subclasses requests' ConnectionError so the existing
+    `except requests.exceptions.RequestException` handlers keep turning it
+    into the usual 503 response.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. After that a single trial call is let through
+    (half-open): success closes the circuit again, failure re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def allow(self):
+        """Returns True if a call may go out now."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN:
+                return False
+            if state == self.HALF_OPEN:
+                # Let exactly one trial call through; the rest wait for its outcome.
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state != self.CLOSED or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+
+class ServiceClient:
+    """
+    An HTTP client for one upstream service.
+
+    Each client owns a requests.Session with its own keep-alive connection pool,
+    applies connect/read timeouts to every call, retries idempotent calls on
+    connection errors and 502/503/504 with jittered exponential backoff, and
+    fails fast through a circuit breaker while the upstream is down. Call
+    latencies are recorded in a histogram per upstream.
+
+    With cache_size > 0 the client also keeps an HTTP cache of GET responses:
+    a response is reused without a request while its Cache-Control max-age
+    lasts, and afterwards revalidated with If-None-Match, so an unchanged
+    resource costs a bodiless 304. Requests carrying credentials bypass it.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=1.0, read_timeout=5.0, retries=2,
+                 backoff=0.1, max_backoff=1.0, pool_size=10, failure_threshold=5, reset_timeout=30.0,
+                 cache_size=0):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = Histogram()
+        self.errors = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.http_cache = LRUCache(max_size=cache_size, ttl=0) if cache_size else None
+
+    @classmethod
+    def from_env(cls, name, base_url, **overrides):
+        """
+        Builds a client configured from the UPSTREAM_* environment variables;
+        keyword arguments override them (e.g. cache_size).
+        """
+        env = os.environ.get
+        settings = dict(
+            connect_timeout=float(env('UPSTREAM_CONNECT_TIMEOUT', 1.0)),
+            read_timeout=float(env('UPSTREAM_READ_TIMEOUT', 5.0)),
+            retries=int(env('UPSTREAM_RETRIES', 2)),
+            pool_size=int(env('UPSTREAM_POOL_SIZE', 10)),
+            failure_threshold=int(env('UPSTREAM_BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(env('UPSTREAM_BREAKER_RESET', 30.0)),
+        )
+        settings.update(overrides)
+        return cls(name, base_url, **settings)
+
+    def request(self, method, path, retry=None, **kwargs):
+        """
+        Sends a request to the upstream and returns the response.
+
+        `retry` defaults to True for idempotent methods only. Raises a
+        requests.exceptions.RequestException subclass when the call fails,
+        times out, or the circuit is open; HTTP error statuses are returned
+        to the caller as-is.
+        """
+        method = method.upper()
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+        attempts = 1 + (self.retries if retry else 0)
+        kwargs.setdefault('timeout', self.timeout)
+        url = f"{self.base_url}{path}"
+        if (self.http_cache is not None and method == 'GET'
+                and 'Authorization' not in (kwargs.get('headers') or {})):
+            return self._cached_get(url, attempts, kwargs)
+        return self._send(method, url, attempts, kwargs)
+
+    def _cached_get(self, url, attempts, kwargs):
+        """GET through the HTTP cache: fresh hits skip the network, stale ones are revalidated."""
+        key = requests.Request('GET', url, params=kwargs.get('params')).prepare().url
+        cached = self.http_cache.get(key)
+        if cached is not None:
+            return cached
+        stale = self.http_cache.get_stale(key)
+        if stale is not None and stale.headers.get('ETag'):
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'If-None-Match': stale.headers['ETag']})
+
+        response = self._send('GET', url, attempts, kwargs)
+        if response.status_code == 304 and stale is not None:
+            self.http_cache.refresh(key, ttl=_freshness(response) or 0)
+            return stale
+        if response.status_code == 200:
+            ttl = _freshness(response)
+            if ttl is not None and (ttl or response.headers.get('ETag')):
+                response.content  # read the body now so the cached response can be shared
+                self.http_cache.set(key, response, ttl=ttl)
+        return response
+
+    def _send(self, method, url, attempts, kwargs):
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit to {self.name} is open")
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                self._observe(time.perf_counter() - start)
+                self.errors += 1
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+            else:
+                self._observe(time.perf_counter() - start)
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if response.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                    return response
+                response.close()
+            self._sleep_before_retry(attempt)
+
+    def _observe(self, seconds):
+        self.latency.observe(seconds)
+        record_timing('upstream', seconds)
+
+    def _sleep_before_retry(self, attempt):
+        """Full-jitter exponential backoff."""
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt))))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def stats(self):
+        """Returns the latency histogram, error count, breaker state and HTTP cache counters for this upstream."""
+        stats = {
+            'base_url': self.base_url,
+            'circuit': self.breaker.state,
+            'errors': self.errors,
+            'latency_seconds': self.latency.snapshot(),
+        }
+        if self.http_cache is not None:
+            stats['http_cache'] = self.http_cache.stats()
+        return stats
@@ -0,0 +1,356 @@
+# shared/instrumentation.py
+
+import hmac
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import Response, g, jsonify, request
+
+from shared.cache import LRUCache
+from shared.metrics import Counter, Family, RequestTimings, current_timings, render_prometheus
+from shared.profiler import SamplingProfiler
+
+logger = logging.getLogger(__name__)
+
+# SQL statements are much faster than whole requests, so they get finer buckets
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+# A request that runs the same statement this many times is reported as a likely N+1
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+# How often (seconds) a worker writes its metrics to the shared METRICS_DIR
+FLUSH_INTERVAL = 1.0
+# Profiles kept for retrieval, and for how long (seconds)
+PROFILE_CACHE_SIZE = 32
+PROFILE_TTL = 600.0
+
+# Statement kinds used as the db_query_duration_seconds label; anything else is OTHER
+_OPERATIONS = frozenset(['SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'COPY'])
+_FIRST_WORD = re.compile(r'\s*(\w+)')
+
+
+def _operation(statement):
+    match = _FIRST_WORD.match(statement)
+    operation = match.group(1).upper() if match else ''
+    return operation if operation in _OPERATIONS else 'OTHER'
+
+
+def _merge(snapshots):
+    """
+    Merges the exported families of several processes: counters and
+    histograms are summed per label set, gauges are kept per process.
+    """
+    merged = {}
+    for pid, families in snapshots.items():
+        for family in families:
+            target = merged.setdefault(family['name'], dict(family, samples={}))
+            for labels, value in family['samples']:
+                if family['kind'] == 'gauge':
+                    labels = dict(labels, pid=str(pid))
+                key = tuple(sorted(labels.items()))
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = (labels, value)
+                elif family['kind'] == 'histogram':
+                    buckets = {bound: count + value['buckets'].get(bound, 0)
+                               for bound, count in current[1]['buckets'].items()}
+                    target['samples'][key] = (labels, {'count': current[1]['count'] + value['count'],
+                                                       'sum': round(current[1]['sum'] + value['sum'], 6),
+                                                       'buckets': buckets})
+                else:
+                    target['samples'][key] = (labels, current[1] + value)
+    return [dict(family, samples=list(family['samples'].values())) for family in merged.values()]
+
+
+class MetricsDirectory:
+    """
+    Lets one worker's /metrics report every worker of the service: each
+    process writes its metrics to `<pid>.json` in `path` (atomically, at most
+    once per FLUSH_INTERVAL) and a scrape merges the files of all live
+    processes. Files of processes that have exited are removed, so their
+    counts drop out and Prometheus sees an ordinary counter reset.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, families):
+        now = time.monotonic()
+        if now - self._flushed_at < FLUSH_INTERVAL:
+            return
+        with self._lock:
+            self._flushed_at = now
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(families, f)
+            os.replace(tmp, os.path.join(self.path, f"{os.getpid()}.json"))
+
+    def collect(self, own_families):
+        """Returns the merged families of all live processes, using `own_families` for this one."""
+        snapshots = {os.getpid(): own_families}
+        for name in os.listdir(self.path):
+            pid = name[:-len('.json')]
+            if not name.endswith('.json') or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            file = os.path.join(self.path, name)
+            if not _alive(int(pid)):
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(file) as f:
+                    snapshots[int(pid)] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return _merge(snapshots)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Instrumentation:
+    """
+    Per-service request telemetry, served on /metrics in the Prometheus text
+    format: request latency per route, method and status; how much of each
+    request went to SQL, commits, upstream calls and token verification;
+    SQL statement counts and latencies, with a warning and a counter for
+    requests that repeat one statement N+1 style; upstream call latencies;
+    and worker saturation (in-flight requests and busy time).
+
+    Every response also carries a Server-Timing header with its own
+    breakdown, so a slow request can be explained from the browser or curl.
+    """
+
+    def __init__(self, clients=(), n_plus_one_threshold=DEFAULT_N_PLUS_ONE_THRESHOLD,
+                 metrics_dir=None, profile_token=None):
+        self.clients = list(clients)
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.request_seconds = Family('http_request_duration_seconds', 'Request latency by route, method and status.',
+                                      labels=('route', 'method', 'status'))
+        self.phase_seconds = Family('http_request_phase_seconds',
+                                    'Time per request spent in SQL (db), commits, upstream calls and auth.',
+                                    labels=('route', 'phase'))
+        self.queries_per_request = Family('db_queries_per_request', 'SQL statements executed per request.',
+                                          labels=('route',), buckets=QUERY_COUNT_BUCKETS)
+        self.query_seconds = Family('db_query_duration_seconds', 'SQL statement latency by operation.',
+                                    labels=('operation',), buckets=QUERY_BUCKETS)
+        self.n_plus_one = Family('db_n_plus_one_total', 'Requests that repeated one SQL statement N+1 style.',
+                                 kind='counter', labels=('route',))
+        self.busy_seconds = Counter()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self.store = MetricsDirectory(metrics_dir) if metrics_dir else None
+        self.profile_token = profile_token
+        self.profiles = LRUCache(max_size=PROFILE_CACHE_SIZE, ttl=PROFILE_TTL) if profile_token else None
+        self.collectors = []
+        self.families = []
+
+    @classmethod
+    def from_env(cls, clients=()):
+        """Configured from N_PLUS_ONE_THRESHOLD, METRICS_DIR and PROFILE_TOKEN."""
+        env = os.environ.get
+        return cls(clients, n_plus_one_threshold=int(env('N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)),
+                   metrics_dir=env('METRICS_DIR'), profile_token=env('PROFILE_TOKEN'))
+
+    # --- Collection ---
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        self.query_seconds.labels(_operation(statement)).observe(elapsed)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add_query(statement, elapsed)
+
+    def _handle_error(self, context):
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    def _before_commit(self, session):
+        timings = current_timings.get()
+        if timings is not None:
+            session.info['commit_started'] = (time.perf_counter(), timings.phases.get('db', 0.0))
+
+    def _after_commit(self, session):
+        started = session.info.pop('commit_started', None)
+        timings = current_timings.get()
+        if started is not None and timings is not None:
+            # The flush inside the commit is already counted as db time.
+            flushed = timings.phases.get('db', 0.0) - started[1]
+            timings.add('commit', max(0.0, time.perf_counter() - started[0] - flushed))
+
+    def _start_request(self):
+        timings = RequestTimings()
+        current_timings.set(timings)
+        profiler = None
+        if self.profile_token and hmac.compare_digest(request.headers.get('X-Profile', ''), self.profile_token):
+            profiler = SamplingProfiler().start()
+        g.instrumentation = {'start': time.perf_counter(), 'timings': timings, 'profiler': profiler, 'status': 500}
+        with self._lock:
+            self.in_flight += 1
+
+    def _annotate_response(self, response):
+        state = g.get('instrumentation')
+        if state is None:
+            return response
+        state['status'] = response.status_code
+        timings = state['timings']
+        entries = []
+        for phase, seconds in sorted(timings.phases.items()):
+            entry = f'{phase};dur={seconds * 1000:.1f}'
+            if phase == 'db':
+                entry += f';desc="{timings.queries} {"query" if timings.queries == 1 else "queries"}"'
+            entries.append(entry)
+        entries.append(f'total;dur={(time.perf_counter() - state["start"]) * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(entries)
+        if state['profiler'] is not None:
+            profile_id = uuid.uuid4().hex
+            self.profiles.set(profile_id, state['profiler'].stop())
+            state['profiler'] = None
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    def _finish_request(self, exc):
+        state = g.pop('instrumentation', None)
+        current_timings.set(None)
+        if state is None:
+            return
+        if state['profiler'] is not None:
+            state['profiler'].stop()
+        elapsed = time.perf_counter() - state['start']
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        timings = state['timings']
+        self.request_seconds.labels(route, request.method, str(state['status'])).observe(elapsed)
+        for phase, seconds in timings.phases.items():
+            self.phase_seconds.labels(route, phase).observe(seconds)
+        if timings.queries:
+            self.queries_per_request.labels(route).observe(timings.queries)
+            statement, count = max(timings.statements.items(), key=lambda item: item[1])
+            if count >= self.n_plus_one_threshold and not timings.long_poll:
+                self.n_plus_one.labels(route).inc()
+                logger.warning("Possible N+1 query in %s %s: ran %d times: %s",
+                               request.method, route, count, ' '.join(statement.split())[:300])
+        self.busy_seconds.inc(elapsed)
+        with self._lock:
+            self.in_flight -= 1
+        if self.store is not None:
+            try:
+                self.store.write(self.export())
+            except OSError:
+                logger.warning("Could not write metrics to %s", self.store.path, exc_info=True)
+
+    # --- Exposition ---
+    def add_collector(self, collector):
+        """
+        Registers a callable that returns exported families computed when
+        /metrics is scraped, e.g. from the database. They describe the whole
+        service, so they are added once, not merged per worker.
+        """
+        self.collectors.append(collector)
+
+    def add_family(self, family):
+        """
+        Registers another per-process Family (e.g. shared.ratelimit's rejection
+        counter), exported and merged across workers like the built-in ones.
+        """
+        self.families.append(family)
+
+    def export(self):
+        """This process's metrics as exported families (see shared.metrics.render_prometheus)."""
+        families = [family.export() for family in (self.request_seconds, self.phase_seconds,
+                                                   self.queries_per_request, self.query_seconds, self.n_plus_one,
+                                                   *self.families)]
+        families.append({'name': 'http_client_request_duration_seconds', 'kind': 'histogram',
+                         'help': 'Upstream call latency by upstream service.',
+                         'samples': [({'upstream': c.name}, c.latency.snapshot()) for c in self.clients]})
+        families.append({'name': 'http_client_errors_total', 'kind': 'counter',
+                         'help': 'Upstream calls that failed without a response.',
+                         'samples': [({'upstream': c.name}, c.errors) for c in self.clients]})
+        families.append({'name': 'worker_busy_seconds_total', 'kind': 'counter',
+                         'help': 'Time spent handling requests; its rate over workers times threads is saturation.',
+                         'samples': [({}, round(self.busy_seconds.snapshot(), 6))]})
+        families.append({'name': 'worker_requests_in_flight', 'kind': 'gauge',
+                         'help': 'Requests being handled by the worker right now.',
+                         'samples': [({}, self.in_flight)]})
+        return families
+
+    def metrics(self):
+        families = self.export()
+        if self.store is not None:
+            families = self.store.collect(families)
+            processes = len({labels['pid'] for family in families if family['name'] == 'worker_requests_in_flight'
+                             for labels, _ in family['samples']})
+        else:
+            processes = 1
+        families.append({'name': 'worker_processes', 'kind': 'gauge', 'help': 'Worker processes reporting metrics.',
+                         'samples': [({}, processes)]})
+        for collector in self.collectors:
+            try:
+                families.extend(collector())
+            except Exception:
+                logger.warning("Metrics collector %r failed", collector, exc_info=True)
+        return Response(render_prometheus(families), mimetype='text/plain; version=0.0.4')
+
+    def profile(self, profile_id):
+        if not hmac.compare_digest(request.headers.get('X-Profile', ''), self.profile_token):
+            return jsonify({"error": "Profiling token is missing or invalid"}), 401
+        folded = self.profiles.get(profile_id)
+        if folded is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return Response(folded, mimetype='text/plain')
+
+    def init_app(self, app, db=None):
+        app.before_request(self._start_request)
+        app.after_request(self._annotate_response)
+        app.teardown_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics)
+        if self.profile_token:
+            app.add_url_rule('/debug/profiles/<profile_id>', 'profile', self.profile)
+        if db is not None:
+            # Imported here because the frontend has no database (or SQLAlchemy).
+            from sqlalchemy import event
+            with app.app_context():
+                engines = list(db.engines.values())  # the primary and any read replicas
+            for engine in engines:
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+                event.listen(engine, 'handle_error', self._handle_error)
+            event.listen(db.session, 'before_commit', self._before_commit)
+            event.listen(db.session, 'after_commit', self._after_commit)
+
+
+def init_instrumentation(app, db=None, clients=()):
+    """
+    Instruments a service: request, SQL (when `db` is given) and upstream
+    (`clients`, ServiceClient instances) timings on /metrics, plus a
+    Server-Timing header on every response.
+
+    Set METRICS_DIR to a directory shared by the service's gunicorn workers to
+    have /metrics cover all of them rather than just the one that answered.
+    Set PROFILE_TOKEN to enable the sampling profiler: a request sent with
+    "X-Profile: <token>" is sampled and answered with an X-Profile-Id, whose
+    folded stacks (for flamegraph.pl or speedscope) can then be fetched from
+    /debug/profiles/<id> with the same header.
+    """
+    instrumentation = Instrumentation.from_env(clients)
+    instrumentation.init_app(app, db)
+    return instrumentation
@@ -0,0 +1,169 @@
+# shared/metrics.py
+
+import contextvars
+import threading
+
+# Latency buckets in seconds, matching the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """A thread-safe, cumulative-bucket histogram of observed values."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Records one observation."""
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """Returns the count, sum and cumulative bucket counts keyed by upper bound."""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative, running = {}, 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            running += bucket_count
+            cumulative['+Inf' if bound == float('inf') else str(bound)] = running
+        return {'count': count, 'sum': round(total, 6), 'buckets': cumulative}
+
+
+class Counter:
+    """A thread-safe, monotonically increasing count."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self):
+        return self._value
+
+
+class Family:
+    """
+    A named metric with labels: one Histogram (or Counter) per combination of
+    label values, created on first use. Label values must come from a small,
+    fixed set (route templates, not raw paths) to keep the series bounded.
+    """
+
+    def __init__(self, name, help, kind='histogram', labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = tuple(labels)
+        self.buckets = buckets
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Returns the metric for these label values, in the order of the family's label names."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = Histogram(self.buckets) if self.kind == 'histogram' else Counter()
+                    self._children[values] = child
+        return child
+
+    def samples(self):
+        """Returns (labels dict, snapshot) pairs for every series of the family."""
+        with self._lock:
+            children = list(self._children.items())
+        return [(dict(zip(self.label_names, values)), child.snapshot()) for values, child in children]
+
+    def export(self):
+        """The family as a plain dict, as expected by render_prometheus."""
+        return {'name': self.name, 'help': self.help, 'kind': self.kind, 'samples': self.samples()}
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus(families):
+    """
+    Formats exported families (dicts with name, help, kind and samples) in the
+    Prometheus text exposition format. Histogram samples are Histogram
+    snapshots; counter and gauge samples are plain numbers.
+    """
+    lines = []
+    for family in families:
+        name, kind = family['name'], family['kind']
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in family['samples']:
+            if kind == 'histogram':
+                for bound, count in value['buckets'].items():
+                    lines.append(f"{name}_bucket{_labels(labels, {'le': bound})} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class RequestTimings:
+    """
+    Where one request's time went: seconds per phase (db, commit, upstream,
+    auth, ...) and how often each SQL statement ran. Phases can be recorded
+    from several threads, e.g. upstream calls fanned out in parallel, so a
+    phase's total may exceed the request's wall time.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.queries = 0
+        self.statements = {}
+        # Long polls re-run the same query by design; they are not N+1 suspects
+        self.long_poll = False
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_query(self, statement, seconds):
+        with self._lock:
+            self.phases['db'] = self.phases.get('db', 0.0) + seconds
+            self.queries += 1
+            self.statements[statement] = self.statements.get(statement, 0) + 1
+
+
+# The timings of the request being handled on this thread, if any
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+def mark_long_poll():
+    """Marks the current request as a long poll, whose repeated queries are expected."""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.long_poll = True
+
+
+def record_timing(phase, seconds):
+    """Adds `seconds` to a phase of the current request; a no-op outside instrumented requests."""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
@@ -0,0 +1,106 @@
+# shared/migrations.py
+
+from collections import namedtuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateSequence
+
+# One schema change. `upgrade(conn, metadata)` runs inside the migration
+# transaction; `metadata` is the service's model metadata, so steps can look
+# up the tables, columns and indexes they need by name.
+Migration = namedtuple('Migration', ['version', 'description', 'upgrade'])
+
+# Every service shares one database, so applied versions are recorded per service.
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('service', String(50), primary_key=True),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False, server_default=func.now()),
+)
+
+
+def upgrade(engine, service, migrations, metadata):
+    """
+    Applies the service's pending migrations in version order, in a single
+    transaction, and returns the versions that were applied.
+
+    On Postgres an advisory lock keyed by the service name is held for the
+    duration, so several containers starting at once apply each migration
+    exactly once.
+    """
+    applied_now = []
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:service))"), {'service': service})
+        applied = set(conn.execute(
+            select(schema_migrations.c.version).where(schema_migrations.c.service == service)).scalars())
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version in applied:
+                continue
+            migration.upgrade(conn, metadata)
+            conn.execute(schema_migrations.insert().values(
+                service=service, version=migration.version, description=migration.description))
+            applied_now.append(migration.version)
+    return applied_now
+
+
+# --- Idempotent building blocks for migration steps ---
+# Databases created by the old `db.create_all()` already have some of these
+# objects, so each step checks before creating.
+
+def create_tables(conn, metadata):
+    """Creates any of the service's tables (and their indexes) that don't exist yet."""
+    metadata.create_all(conn, checkfirst=True)
+
+
+def add_column(conn, column):
+    """Adds a model column to its table if the table doesn't have it yet."""
+    table = column.table
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    if column.name in existing:
+        return
+    preparer = conn.dialect.identifier_preparer
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"))
+
+
+def drop_not_null(conn, column):
+    """
+    Makes a model column nullable in the database. SQLite can't alter columns;
+    there the column keeps its constraint until the table is recreated.
+    """
+    if conn.dialect.name == 'sqlite':
+        return
+    preparer = conn.dialect.identifier_preparer
+    conn.execute(text(f"ALTER TABLE {preparer.format_table(column.table)} "
+                      f"ALTER COLUMN {preparer.format_column(column)} DROP NOT NULL"))
+
+
+def create_index(conn, metadata, table_name, index_name):
+    """Creates one of the model's indexes if it doesn't exist yet."""
+    # IF NOT EXISTS rather than reflection: SQLite can't reflect expression indexes.
+    index = next(i for i in metadata.tables[table_name].indexes if i.name == index_name)
+    conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def drop_index(conn, index_name):
+    """Drops an index the model no longer has, if the database has it."""
+    conn.execute(text(f"DROP INDEX IF EXISTS {conn.dialect.identifier_preparer.quote(index_name)}"))
+
+
+def drop_column(conn, table_name, column_name):
+    """Drops a column the model no longer has, if the table has it. Drop its indexes first."""
+    if column_name not in {c['name'] for c in inspect(conn).get_columns(table_name)}:
+        return
+    preparer = conn.dialect.identifier_preparer
+    conn.execute(text(f"ALTER TABLE {preparer.quote(table_name)} DROP COLUMN {preparer.quote(column_name)}"))
+
+
+def create_sequence(conn, metadata, name):
+    """Creates one of the model's sequences if the database supports them and it doesn't exist yet."""
+    if not conn.dialect.supports_sequences:
+        return
+    conn.execute(CreateSequence(metadata._sequences[name], if_not_exists=True))
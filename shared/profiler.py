@@ -0,0 +1,55 @@
+# shared/profiler.py
+
+import collections
+import os
+import sys
+import threading
+
+# Sampling period in seconds; short enough to resolve a single slow request
+DEFAULT_INTERVAL = 0.005
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})".replace(';', ':')
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's call stack every `interval` seconds from a background
+    thread while it runs, without tracing every call the way cProfile does.
+
+    The result is in the "folded stacks" format read by flamegraph.pl,
+    speedscope and inferno: one line per distinct stack, frames root first and
+    separated by ';', followed by the number of samples it was seen in.
+    """
+
+    def __init__(self, thread_id=None, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._sampler.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        """Stops sampling and returns the folded stacks, most frequent first."""
+        self._stopped.set()
+        self._sampler.join()
+        return ''.join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
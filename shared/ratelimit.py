@@ -0,0 +1,253 @@
+# shared/ratelimit.py
+
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import jsonify, request
+
+from shared.cache import backend_from_env
+from shared.metrics import Family
+
+logger = logging.getLogger(__name__)
+
+# Requests turned away by a RateLimit (429) or a ConcurrencyLimit (503)
+rejected_requests = Family('http_requests_rejected_total',
+                           'Requests refused by a rate limit (reason="rate") or a concurrency cap (reason="busy").',
+                           kind='counter', labels=('limit', 'reason'))
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rate(spec):
+    """
+    Parses a limit such as "10/minute" into (tokens per second, burst): the
+    bucket holds `count` tokens, so that many requests may arrive at once and
+    then they are admitted at the average rate. "off" or "0" returns None.
+    """
+    value = spec.strip().lower()
+    if value in ('', '0', 'off', 'none'):
+        return None
+    count, _, period = value.partition('/')
+    try:
+        count, seconds = int(count), PERIODS[period.strip() or 'second']
+    except (ValueError, KeyError):
+        raise ValueError(f"Invalid rate limit {spec!r}; expected e.g. '10/minute' or 'off'") from None
+    if count <= 0:
+        return None
+    return count / seconds, count
+
+
+class TrustedProxies:
+    """
+    The proxies (e.g. the frontend) whose X-Forwarded-For header is believed.
+    `hosts` are addresses or host names; names are resolved again every
+    `refresh` seconds, since a container's address changes when it restarts.
+
+    client_ip() is the rate limit key for anonymous endpoints: the last
+    forwarded address for requests from a trusted proxy, otherwise the
+    address the request came from, whatever it claims to forward.
+    """
+
+    def __init__(self, hosts=(), refresh=60.0):
+        self.hosts = [host for host in hosts if host]
+        self.refresh = refresh
+        self._by_host = {}  # host -> its addresses at the last successful lookup
+        self._addresses = frozenset()
+        self._resolved_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Configured from TRUSTED_PROXIES, a comma-separated list of addresses or host names."""
+        return cls([host.strip() for host in os.environ.get('TRUSTED_PROXIES', '').split(',')])
+
+    def addresses(self):
+        """The trusted proxies' current addresses; a host whose lookup fails keeps its previous ones."""
+        if not self.hosts:
+            return self._addresses
+        with self._lock:
+            if self._resolved_at is None or time.monotonic() - self._resolved_at >= self.refresh:
+                for host in self.hosts:
+                    try:
+                        self._by_host[host] = {info[4][0] for info in socket.getaddrinfo(host, None)}
+                    except OSError:
+                        logger.warning("Could not resolve trusted proxy %s", host)
+                self._addresses = frozenset().union(*self._by_host.values())
+                self._resolved_at = time.monotonic()
+            return self._addresses
+
+    def client_ip(self, *args, **kwargs):
+        remote = request.remote_addr or 'unknown'
+        if remote in self.addresses():
+            forwarded = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+            if forwarded:
+                return forwarded[-1]
+        return remote
+
+
+# --- Token bucket stores ---
+class MemoryBuckets:
+    """
+    Token buckets held in this process, so a limit applies to each worker on
+    its own. Beyond `max_keys` the least recently used buckets are dropped;
+    a dropped bucket starts full again.
+    """
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Takes `cost` tokens; returns 0 if it could, else the seconds until it can."""
+        with self._lock:
+            now = self._clock()
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Refills and takes from one bucket atomically, on the server's clock so
+# workers on different hosts agree. A bucket expires once it would be full.
+TAKE_SCRIPT = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """
+    Token buckets on the shared cache server (a RedisBackend), so a limit
+    holds across all workers of a service. Each take is one script call.
+    While the server is unreachable requests are admitted: the limiter
+    protects the service, it must not take it down with the cache.
+    """
+
+    def __init__(self, backend, prefix='ratelimit'):
+        self.prefix = prefix
+        self._take = backend.script(TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1):
+        wait = self._take(keys=[f'{self.prefix}:{key}'], args=[rate, burst, cost], default=None)
+        return float(wait) if wait is not None else 0.0
+
+
+def buckets_from_env():
+    """Shared buckets on the CACHE_URL server if there is one, otherwise per-process ones."""
+    backend = backend_from_env()
+    return RedisBuckets(backend) if backend.shared else MemoryBuckets()
+
+
+# --- Limits ---
+class RateLimit:
+    """
+    A token-bucket limit of `rate` requests per second, with bursts of up to
+    `burst`, applied separately to every key (a user id, a client address).
+    A disabled limit (rate None) admits everything.
+    """
+
+    def __init__(self, name, rate, burst, buckets):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.buckets = buckets
+
+    @classmethod
+    def from_env(cls, name, default, buckets=None):
+        """Configured from RATE_LIMIT_<NAME> (e.g. "10/minute", or "off"), else `default`."""
+        parsed = parse_rate(os.environ.get(f'RATE_LIMIT_{name.upper()}', default))
+        rate, burst = parsed if parsed else (None, 0)
+        return cls(name, rate, burst, buckets if buckets is not None else buckets_from_env())
+
+    def hit(self, key):
+        """Counts one request for `key`; returns 0 if it is admitted, else the seconds to wait."""
+        if self.rate is None:
+            return 0.0
+        return self.buckets.take(f'{self.name}:{key}', self.rate, self.burst)
+
+    def limit(self, key):
+        """
+        Decorates a view so each call is counted against `key(*args, **kwargs)`
+        and refused with 429 and a Retry-After header, before the view runs,
+        once that key's bucket is empty.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                wait = self.hit(key(*args, **kwargs))
+                if wait:
+                    rejected_requests.labels(self.name, 'rate').inc()
+                    response = jsonify({"error": "Too many requests, please retry later"})
+                    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+                    return response, 429
+                return f(*args, **kwargs)
+            return decorated
+        return decorator
+
+
+class ConcurrencyLimit:
+    """
+    Caps how many requests to one endpoint a worker process handles at once.
+    A request over the cap is refused with 503 straight away, instead of
+    queueing for a database connection or an upstream call behind the ones
+    already running. A limit of 0 disables the cap.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.max_concurrent = limit
+        self._slots = threading.BoundedSemaphore(limit) if limit else None
+
+    @classmethod
+    def from_env(cls, name, default):
+        """Configured from MAX_CONCURRENT_<NAME>, else `default`."""
+        return cls(name, int(os.environ.get(f'MAX_CONCURRENT_{name.upper()}', default)))
+
+    def limit(self):
+        """Decorates a view so calls over the cap get a 503 with Retry-After instead of running."""
+        def decorator(f):
+            if self._slots is None:
+                return f
+
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not self._slots.acquire(blocking=False):
+                    rejected_requests.labels(self.name, 'busy').inc()
+                    response = jsonify({"error": "Service is busy, please retry shortly"})
+                    response.headers['Retry-After'] = '1'
+                    return response, 503
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self._slots.release()
+            return decorated
+        return decorator
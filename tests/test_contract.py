@@ -2,7 +2,7 @@
 
 import pytest
 import requests
-from pact.matchers import Like
+from pact.matchers import EachLike, Like
 from pact import Consumer, Provider
 
 # Define the Pact mock server's host and port
@@ -55,4 +55,27 @@ def test_get_product(pact):
         
         # 4. Assert that the response from the mock server is correct
         assert response.status_code == 200
-        assert response.json()['name'] == 'Mechanical Keyboard'
\ No newline at end of file
+        assert response.json()['name'] == 'Mechanical Keyboard'
+
+def test_get_products_batch(pact):
+    """
+    Defines the contract for the batch lookup the Order Service uses to
+    validate a whole cart with a single request.
+    """
+    expected = EachLike({
+        'id': Like(101),
+        'name': Like('Wireless Mouse'),
+        'price': Like(24.99),
+        'stock': Like(150)
+    })
+    (pact
+     .given('products with IDs 101 and 102 exist')
+     .upon_receiving('a batch request for several products')
+     .with_request(method='GET', path='/products', query='ids=101,102')
+     .will_respond_with(200, body=expected))
+
+    with pact:
+        response = requests.get(f"http://{PACT_MOCK_HOST}:{PACT_MOCK_PORT}/products?ids=101,102")
+
+        assert response.status_code == 200
+        assert response.json()[0]['name'] == 'Wireless Mouse'
@@ -4,16 +4,50 @@ import os
 import datetime
 from flask import Flask, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
 import jwt
+from shared.auth import KeyRing, TokenVerifier
+from shared.database import (ReplicaRouter, RoutingSession, engine_options_from_env, pool_capacity_from_env,
+                             replica_binds_from_env)
+from shared.headers import bearer_token
+from shared.instrumentation import init_instrumentation
+from shared.ratelimit import ConcurrencyLimit, RateLimit, TrustedProxies, rejected_requests
+from shared.migrations import upgrade as upgrade_schema
+from migrations import MIGRATIONS
+from passwords import HasherOverloaded, PasswordHasher
 
 app = Flask(__name__)
 
 # Configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a-super-secret-key') # It's better to set this in the environment
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_BINDS'] = replica_binds_from_env()
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+# Login lookups go to the read replicas in DATABASE_REPLICA_URLS, if any
+replicas = ReplicaRouter.from_env(app, db)
+
+# Request and SQL timings on /metrics and in Server-Timing headers
+instrumentation = init_instrumentation(app, db)
+instrumentation.add_family(rejected_requests)
+
+# Login and registration are limited per client address. Behind the frontend
+# that address comes from X-Forwarded-For, which is only believed on requests
+# that come from one of TRUSTED_PROXIES.
+trusted_proxies = TrustedProxies.from_env()
+login_rate = RateLimit.from_env('login', '20/minute')
+register_rate = RateLimit.from_env('register', '5/minute')
+# Requests beyond the pool's connections are shed rather than queued
+login_slots = ConcurrencyLimit.from_env('login', pool_capacity_from_env())
+register_slots = ConcurrencyLimit.from_env('register', pool_capacity_from_env())
+
+# Tokens are signed with the key ring's current key and carry its kid
+keyring = KeyRing.from_env(app.config['SECRET_KEY'])
+token_verifier = TokenVerifier(keyring)
+
+# Password hashing runs in a bounded process pool; see passwords.py
+password_hasher = PasswordHasher.from_env()
 
 # --- Database Model ---
 class User(db.Model):
@@ -23,14 +57,35 @@ class User(db.Model):
 
     def set_password(self, password):
         """Hashes the password and stores it."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
         """Checks if the provided password matches the stored hash."""
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """True if the stored hash was made with outdated hashing parameters."""
+        return password_hasher.needs_rehash(self.password_hash)
+
+    @classmethod
+    def find_by_email(cls, email):
+        """Case-insensitive lookup, served by the unique lower(email) index."""
+        return cls.query.filter(db.func.lower(cls.email) == email.lower()).first()
+
+# Makes emails unique regardless of case and backs find_by_email.
+db.Index('ux_user_email_lower', db.func.lower(User.email), unique=True)
+
+@app.errorhandler(HasherOverloaded)
+def handle_hasher_overloaded(e):
+    """Sheds load when the password hashing pool is saturated."""
+    response = jsonify({"error": "Service is busy, please retry shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 # --- API Endpoints ---
 @app.route("/register", methods=["POST"])
+@register_rate.limit(trusted_proxies.client_ip)
+@register_slots.limit()
 def register():
     """Handles user registration."""
     data = request.get_json()
@@ -40,7 +95,7 @@ def register():
     # --- Edge Case Handling ---
     if not email or not password:
         return jsonify({"error": "Email and password are required"}), 400
-    if User.query.filter_by(email=email).first():
+    if User.find_by_email(email):
         return jsonify({"error": "Email address already in use"}), 409 # 409 Conflict
     if len(password) < 8:
         return jsonify({"error": "Password must be at least 8 characters long"}), 400
@@ -49,11 +104,18 @@ def register():
     new_user = User(email=email)
     new_user.set_password(password)
     db.session.add(new_user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent registration for the same email won the race; the unique index caught it.
+        db.session.rollback()
+        return jsonify({"error": "Email address already in use"}), 409
 
     return jsonify({"message": "User registered successfully"}), 201
 
 @app.route("/login", methods=["POST"])
+@login_rate.limit(trusted_proxies.client_ip)
+@login_slots.limit()
 def login():
     """Handles user login and JWT generation."""
     data = request.get_json()
@@ -63,7 +125,11 @@ def login():
     if not email or not password:
         return jsonify({"error": "Email and password are required"}), 400
 
-    user = User.query.filter_by(email=email).first()
+    with replicas.reads():
+        user = User.find_by_email(email)
+    if user is None and replicas.replicas:
+        # A replica may not have the account yet if it was only just registered
+        user = User.find_by_email(email)
 
     # --- Security Consideration ---
     # Check if user exists AND if the password is correct in one go.
@@ -71,19 +137,54 @@ def login():
     if not user or not user.check_password(password):
         return jsonify({"error": "Invalid credentials"}), 401 # 401 Unauthorized
 
+    # Transparently upgrade hashes made with old parameters while we have the plaintext.
+    if user.password_needs_rehash():
+        user.set_password(password)
+        db.session.commit()
+
     # --- Token Generation ---
-    token = jwt.encode({
+    token = keyring.issue_token({
         'user_id': user.id,
         'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
-    }, app.config['SECRET_KEY'], algorithm="HS256")
+    })
 
     return jsonify({"token": token})
 
+@app.route("/me", methods=["GET"])
+def me():
+    """Returns the account behind the bearer token, for pages that show who is logged in."""
+    token = bearer_token(request.headers.get('Authorization'))
+    if token is None:
+        return jsonify({'error': 'Token is missing'}), 401
+    try:
+        data = token_verifier.verify(token)
+    except jwt.InvalidTokenError:
+        return jsonify({'error': 'Token is invalid'}), 401
+    user = db.session.get(User, data.get('user_id'))
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify({'id': user.id, 'email': user.email})
+
+@app.route("/replicas/stats", methods=["GET"])
+def replica_stats():
+    """Returns each read replica's health, lag and share of the reads."""
+    return jsonify(replicas.stats())
+
+# --- Schema migrations ---
+def _upgrade_schema():
+    applied = upgrade_schema(db.engine, "user_service", MIGRATIONS, db.metadata)
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+
+@app.cli.command("db-upgrade")
+def db_upgrade_command():
+    """Applies any pending schema migrations."""
+    _upgrade_schema()
+
 # --- Database Initialization Command ---
 @app.cli.command("init-db")
 def init_db_command():
-    """Creates the database tables for the User service."""
-    db.create_all()
+    """Migrates the database schema for the User service."""
+    _upgrade_schema()
     print("User database initialized.")
 
 if __name__ == '__main__':
@@ -0,0 +1,14 @@
+# user_service/migrations.py
+
+from shared.migrations import Migration, create_index, create_tables
+
+
+def _email_lower_index(conn, metadata):
+    create_index(conn, metadata, 'user', 'ux_user_email_lower')
+
+
+# Applied in order by `flask db-upgrade` (and by `flask init-db`).
+MIGRATIONS = [
+    Migration(1, 'create tables', create_tables),
+    Migration(2, 'add unique lower(email) index for case-insensitive lookups', _email_lower_index),
+]
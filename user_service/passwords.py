@@ -0,0 +1,97 @@
+# user_service/passwords.py
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# The full method, parameters included, is stored as the prefix of every hash,
+# so it doubles as the hash version: hashes made with other parameters are
+# upgraded on the user's next successful login. A method given without its
+# parameters (e.g. "scrypt") is expanded with werkzeug's defaults.
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+def _full_method(method):
+    """
+    The method as werkzeug records it in a hash, e.g. "scrypt:32768:8:1" for
+    "scrypt". Found by hashing an empty password, since the defaults differ
+    between werkzeug versions; an invalid method raises ValueError here.
+    """
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+class HasherOverloaded(Exception):
+    """Raised when the hashing pool is saturated and the request should be shed."""
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords in a dedicated process pool.
+
+    Password hashing is deliberately CPU-expensive; running it in the request
+    thread lets a login storm pin every worker. Here at most `workers` hashes
+    run at once, and at most `queue_limit` may be queued or running: beyond
+    that HasherOverloaded is raised straight away so the caller can answer
+    503 instead of piling up requests. With workers=0 hashing runs inline.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=2, queue_limit=32, timeout=10.0):
+        self.method = _full_method(method)
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Builds a hasher configured from the PASSWORD_HASH_* environment variables."""
+        env = os.environ.get
+        return cls(
+            method=env('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+            workers=int(env('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)),
+            queue_limit=int(env('PASSWORD_HASH_QUEUE_LIMIT', 32)),
+            timeout=float(env('PASSWORD_HASH_TIMEOUT', 10.0)),
+        )
+
+    def _executor(self):
+        # Created lazily, and again after a fork, so each gunicorn worker owns its pool.
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherOverloaded("Too many password hashes queued")
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is freed when the hash finishes, even if we stop waiting for it.
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherOverloaded("Password hashing timed out")
+
+    def hash(self, password):
+        """Returns a salted hash of the password made with the current parameters."""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Checks a password against a stored hash, whatever parameters it was made with."""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with parameters other than the current ones."""
+        return password_hash.split('$', 1)[0] != self.method